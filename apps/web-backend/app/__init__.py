@@ -5,16 +5,22 @@ import os
 import openai
 from flask import Flask
 from openai import OpenAI
-import logging
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from flask_talisman import Talisman
+from sqlalchemy.engine import make_url
 
 from .config import Config, DevelopmentConfig, ProductionConfig, TestingConfig
-from .extensions import db, cors, migrate, bcrypt, jwt, limiter
+from .extensions import db, cors, migrate, bcrypt, jwt, limiter, sock, talisman
 from flask_migrate import Migrate
 from .models import User, Conversation, Message  # Ensure all models are imported
+from .services.metrics_service import init_request_metrics
+from .logging_setup import configure_logging, NO_SAMPLE
+from .services.profiling_service import init_profiling
+from .services.query_stats_service import init_query_stats
+from .services.compression_service import init_compression
+from .json_provider import OrjsonProvider
+from .sharding import init_sharding
 
 import firebase_admin
 from firebase_admin import credentials
@@ -27,6 +33,7 @@ firebase_app = None
 def create_app(config_class=None):
     """Create the Flask application with the appropriate configuration."""
     app = Flask(__name__, instance_relative_config=True)
+    app.json = OrjsonProvider(app)
     
     # Determine which configuration to use based on environment
     if config_class is None:
@@ -39,22 +46,16 @@ def create_app(config_class=None):
             config_class = DevelopmentConfig
     
     app.config.from_object(config_class)
-    print(f"Instance path: {app.instance_path}")
-    app.logger.setLevel(logging.INFO)
-    if not app.debug and not app.testing:  # Avoid double logging in dev
-        if not app.logger.handlers:  # Check if handlers are already added
-            app.logger.setLevel(logging.INFO)
-            # Example: Add a stream handler if none exist
-            # stream_handler = logging.StreamHandler()
-            # stream_handler.setFormatter(logging.Formatter(
-            #     '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'))
-            # app.logger.addHandler(stream_handler)
-            app.logger.info('Flask logger configured for INFO level.')
+    missing = [name for name in app.config.get('REQUIRED_SETTINGS', ()) if not app.config.get(name)]
+    if missing:
+        raise ValueError(f"No {', '.join(missing)} set. Please set it in your environment variables.")
+    configure_logging(app)
+    app.logger.info("Instance path: %s", app.instance_path, extra=NO_SAMPLE)
 
     try:
         if not os.path.exists(app.instance_path): os.makedirs(app.instance_path)
     except OSError as e:
-        print(f"Error creating instance folder: {app.instance_path} - {e}")
+        app.logger.error("Error creating instance folder: %s - %s", app.instance_path, e)
 
     # --- Database URI Configuration ---
     # Prioritize DATABASE_URL (set by Render)
@@ -76,7 +77,8 @@ def create_app(config_class=None):
             final_db_uri = f"sqlite:///{absolute_db_path}"
 
     app.config['SQLALCHEMY_DATABASE_URI'] = final_db_uri
-    print(f"Final Database URI set to: {app.config['SQLALCHEMY_DATABASE_URI']}")
+    app.logger.info("Final Database URI set to: %s", make_url(final_db_uri).render_as_string(hide_password=True),
+                    extra=NO_SAMPLE)
     # --- End Database URI Configuration ---
 
     # Initialize Firebase Admin SDK
@@ -86,35 +88,41 @@ def create_app(config_class=None):
             cred = credentials.Certificate(cred_path)
             if not firebase_admin._apps:
                 firebase_admin.initialize_app(cred)
-                print("Firebase Admin SDK initialized successfully.")
+                app.logger.info("Firebase Admin SDK initialized successfully.", extra=NO_SAMPLE)
             else:
-                print("Firebase Admin SDK already initialized.")
+                app.logger.info("Firebase Admin SDK already initialized.", extra=NO_SAMPLE)
         elif os.getenv('FIREBASE_CONFIG_JSON'):  # Alternative for Render env var group
             cred_json_str = os.getenv('FIREBASE_CONFIG_JSON')
             cred_dict = json.loads(cred_json_str)
             cred = credentials.Certificate(cred_dict)
             if not firebase_admin._apps:
                 firebase_admin.initialize_app(cred)
-                print("Firebase Admin SDK initialized from FIREBASE_CONFIG_JSON successfully.")
+                app.logger.info("Firebase Admin SDK initialized from FIREBASE_CONFIG_JSON successfully.", extra=NO_SAMPLE)
             else:
-                print("Firebase Admin SDK already initialized.")
+                app.logger.info("Firebase Admin SDK already initialized.", extra=NO_SAMPLE)
         else:
-            print("Warning: Firebase credentials (GOOGLE_APPLICATION_CREDENTIALS or FIREBASE_CONFIG_JSON) not found.")
+            app.logger.warning("Firebase credentials (GOOGLE_APPLICATION_CREDENTIALS or FIREBASE_CONFIG_JSON) not found.")
     except Exception as e:
-        print(f"Error initializing Firebase Admin SDK: {e}")
+        app.logger.error("Error initializing Firebase Admin SDK: %s", e)
 
     # Configure CORS
     CORS(app, resources={r"/api/*": {"origins": app.config.get('ALLOWED_ORIGINS')}})
 
     # Initialize extensions with app
     db.init_app(app)
+    init_sharding(app)
     migrate.init_app(app, db)
     bcrypt.init_app(app)
     jwt.init_app(app)
     limiter.init_app(app)
+    sock.init_app(app)
+    init_request_metrics(app)
+    init_query_stats(app)
+    init_profiling(app)
+    init_compression(app)
     
     # Initialize Talisman (security headers)
-    Talisman(
+    talisman.init_app(
         app,
         content_security_policy=None,  # Configure CSP separately if needed
         force_https=app.config.get('FORCE_HTTPS', True),  # Force HTTPS in production
@@ -129,11 +137,11 @@ def create_app(config_class=None):
     if openai_api_key:
         try:
             app.openai_client = OpenAI(api_key=openai_api_key)
-            print("OpenAI client initialized successfully.")
+            app.logger.info("OpenAI client initialized successfully.", extra=NO_SAMPLE)
         except Exception as e:
-            print(f"Error initializing OpenAI client: {e}")
+            app.logger.error("Error initializing OpenAI client: %s", e)
     else:
-        print("ERROR: OPENAI_API_KEY not configured.")
+        app.logger.error("OPENAI_API_KEY not configured.")
 
     # --- Persona Prompts Loading ---
     app.persona_prompts_content = {}
@@ -141,20 +149,37 @@ def create_app(config_class=None):
         try:
             with open(path, 'r') as f:
                 app.persona_prompts_content[persona_id] = f.read()
-            app.logger.info(f"System prompt for persona '{persona_id}' loaded successfully from {path}.")
+            app.logger.info("System prompt for persona '%s' loaded successfully from %s.", persona_id, path,
+                            extra=NO_SAMPLE)
         except Exception as e:
-            app.logger.error(f"Error reading system prompt file for persona '{persona_id}' from {path}: {e}")
+            app.logger.error("Error reading system prompt file for persona '%s' from %s: %s", persona_id, path, e)
     app.DEFAULT_PERSONA_ID = app.config['DEFAULT_PERSONA_ID']
     # For backward compatibility, set app.system_prompt to the default persona's prompt
     app.system_prompt = app.persona_prompts_content.get(app.DEFAULT_PERSONA_ID, "Default fallback prompt if socrates.txt is missing.")
 
     from .auth.routes import auth_bp
     from .dialogue.routes import dialogue_bp
+    from .dialogue import websocket  # noqa: F401 - adds the WebSocket route to dialogue_bp
     from .transcription.routes import transcription_bp
+    from .metrics.routes import metrics_bp
+    from .admin.routes import admin_bp
+    from .health.routes import health_bp
     app.register_blueprint(auth_bp)
     app.register_blueprint(dialogue_bp)
     app.register_blueprint(transcription_bp, url_prefix='/api')
-    print("Blueprints registered.")
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(admin_bp)
+    app.register_blueprint(health_bp)
+    app.logger.info("Blueprints registered.", extra=NO_SAMPLE)
+
+    from .jobs.commands import jobs_cli
+    from .archive.commands import archive_cli
+    from .shards.commands import shards_cli
+    from .usage.commands import usage_cli
+    app.cli.add_command(jobs_cli)
+    app.cli.add_command(archive_cli)
+    app.cli.add_command(shards_cli)
+    app.cli.add_command(usage_cli)
 
     @app.route('/')
     def index():
@@ -0,0 +1,49 @@
+# backend/app/admin/routes.py
+# Operator-only endpoints, protected by the X-Admin-Token header
+
+import os
+from flask import Blueprint, jsonify, current_app, request, send_from_directory
+from ..auth.utils import admin_required
+from ..services.profiling_service import PROFILE_SUFFIX
+from ..services.usage_service import usage_report, GROUPINGS
+
+admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
+
+
+@admin_bp.route('/profiles', methods=['GET'])
+@admin_required
+def list_profiles():
+    """Lists captured request profiles, newest first."""
+    store = getattr(current_app, 'profile_store', None)
+    if store is None:
+        return jsonify({"error": "Profiling is disabled."}), 404
+    return jsonify({"profiles": store.list()})
+
+
+@admin_bp.route('/profiles/<string:name>', methods=['GET'])
+@admin_required
+def download_profile(name: str):
+    """Downloads a profile in collapsed-stack format (open it in speedscope or flamegraph.pl)."""
+    store = getattr(current_app, 'profile_store', None)
+    if store is None:
+        return jsonify({"error": "Profiling is disabled."}), 404
+    if not name.endswith(PROFILE_SUFFIX) or os.path.basename(name) != name:
+        return jsonify({"error": "Profile not found."}), 404
+    return send_from_directory(store.directory, name, mimetype='text/plain', as_attachment=True)
+
+
+@admin_bp.route('/usage', methods=['GET'])
+@admin_required
+def usage_summary():
+    """
+    Latency percentiles and token use of recent completions (see usage_service.usage_report).
+
+    Query params:
+    - days: look-back window (default 7)
+    - by: "persona", "model" or "persona_model" (default)
+    """
+    days = request.args.get('days', 7, type=int)
+    group_by = request.args.get('by', 'persona_model')
+    if group_by not in GROUPINGS or not days or days < 1:
+        return jsonify({"error": f"Use days >= 1 and by one of: {', '.join(GROUPINGS)}."}), 400
+    return jsonify({"days": days, "by": group_by, "usage": usage_report(days=days, group_by=group_by)})
@@ -0,0 +1,52 @@
+# backend/app/archive/commands.py
+# `flask archive ...` commands for moving idle conversations to compressed storage
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from ..extensions import db
+from ..models import Conversation
+from ..sharding import each_shard
+from ..services.archive_service import archive_idle_conversations, restore_conversation, archive_stats
+
+archive_cli = AppGroup('archive', help="Cold storage for idle conversations.")
+
+
+@archive_cli.command('run')
+@click.option('--idle-days', type=int, default=None, help="Archive conversations idle this many days (default: ARCHIVE_IDLE_DAYS).")
+@click.option('--batch-size', type=int, default=None, help="Conversations per transaction (default: ARCHIVE_BATCH_SIZE).")
+def run_command(idle_days, batch_size):
+    """Archive every conversation that has been idle long enough."""
+    archived = archive_idle_conversations(
+        idle_days if idle_days is not None else current_app.config.get('ARCHIVE_IDLE_DAYS', 180),
+        batch_size or current_app.config.get('ARCHIVE_BATCH_SIZE', 200),
+    )
+    click.echo(f"Archived {archived} conversations.")
+
+
+@archive_cli.command('restore')
+@click.argument('conversation_id', type=int, required=False)
+@click.option('--all', 'restore_all', is_flag=True, help="Restore every archived conversation.")
+def restore_command(conversation_id, restore_all):
+    """Move archived messages back into the message table."""
+    if not conversation_id and not restore_all:
+        raise click.UsageError("Give a CONVERSATION_ID or --all.")
+    query = db.select(Conversation).where(Conversation.archived_at.is_not(None))
+    if not restore_all:
+        query = query.where(Conversation.id == conversation_id)
+    restored = 0
+    for _ in each_shard():
+        for conversation in db.session.scalars(query).all():
+            restore_conversation(conversation)
+            db.session.commit()
+            restored += 1
+    click.echo(f"Restored {restored} conversations.")
+
+
+@archive_cli.command('stats')
+def stats_command():
+    """Show how much is archived and the compression achieved."""
+    stats = archive_stats()
+    ratio = stats["raw_bytes"] / stats["stored_bytes"] if stats["stored_bytes"] else 0
+    click.echo(f"{stats['conversations']} conversations, {stats['messages']} messages, "
+               f"{stats['raw_bytes']} bytes raw, {stats['stored_bytes']} bytes stored ({ratio:.1f}x)")
@@ -1,10 +1,17 @@
 # backend/app/auth/routes.py
 # Routes removed as Firebase handles login/register on frontend
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 import firebase_admin
 from firebase_admin import auth
-import logging
+from ..extensions import db
+from ..logging_setup import NO_SAMPLE
+from ..models import User
+from ..sharding import delete_user_from_shard
+from ..services.idempotency_service import delete_records as delete_idempotency_records
+from ..services.memory_service import get_memory_service
+from ..services.transcription_service import delete_transcriptions
+from ..services.upload_service import discard_upload
 
 # Create Blueprint
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
@@ -40,15 +47,30 @@ def delete_account():
         decoded_token = auth.verify_id_token(id_token)
         uid = decoded_token['uid']
         
+        # Purge local data first, so a failure here can be retried with the same token.
+        # ON DELETE CASCADE removes the user's conversations and messages in the same statement.
+        # Transcripts and stored responses are keyed by UID, not User.id, so they go explicitly.
+        try:
+            user_id = db.session.execute(db.delete(User).where(User.firebase_uid == uid).returning(User.id),
+                                         execution_options={"synchronize_session": False}).scalar()
+            if user_id is not None:
+                delete_user_from_shard(user_id)
+            transcription_ids = delete_transcriptions(uid)
+            delete_idempotency_records(uid)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        for transcription_id in transcription_ids:
+            discard_upload(transcription_id)
+        memory = get_memory_service()
+        if memory and user_id is not None:
+            memory.forget(user_id)
+        
         # Delete the user from Firebase Authentication
         auth.delete_user(uid)
         
-        # TODO: Delete any user data from local database if you have one
-        # Example:
-        # db.session.query(User).filter_by(firebase_uid=uid).delete()
-        # db.session.commit()
-        
-        logging.info(f"Successfully deleted user account: {uid}")
+        current_app.logger.info("Successfully deleted user account: %s", uid, extra=NO_SAMPLE)
         return jsonify({"message": "Account deleted successfully"}), 200
         
     except auth.InvalidIdTokenError:
@@ -56,6 +78,6 @@ def delete_account():
     except auth.UserNotFoundError:
         return jsonify({"error": "User not found"}), 404
     except Exception as e:
-        logging.error(f"Error deleting user account: {str(e)}")
+        current_app.logger.error("Error deleting user account: %s", e)
         return jsonify({"error": "Internal server error"}), 500
 
@@ -1,34 +1,53 @@
 # backend/app/auth/utils.py
+import hmac
+from functools import wraps
 import firebase_admin.auth
-from flask import request, current_app
+from flask import request, current_app, g, jsonify
+from ..services.metrics_service import observe_stage
 
 def verify_token():
     """
     Verifies the Firebase ID token from the Authorization header.
+    The result is memoized on ``g``, so calling this again in the same request is free.
 
     Returns:
         dict: Decoded token payload (including 'uid') if valid.
         None: If no token is present or verification fails.
     """
-    id_token = None
+    if 'decoded_token' not in g:
+        g.decoded_token = _verify_token_from_header()
+    return g.decoded_token
+
+
+def _verify_token_from_header():
+    # 1. Extract token from "Bearer <token>" header
+    auth_header = request.headers.get('Authorization')
+    if auth_header and auth_header.startswith('Bearer '):
+        return verify_id_token(auth_header.split('Bearer ')[1])
+    # No valid Bearer token found
+    return None # Proceed as guest
+
+
+def verify_id_token(id_token: str):
+    """
+    Verifies a raw Firebase ID token (e.g. one sent in a WebSocket auth frame).
+
+    Returns:
+        dict: Decoded token payload (including 'uid') if valid.
+        None: If verification fails.
+    """
     decoded_token = None
     user_uid = None
 
     try:
-        # 1. Extract token from "Bearer <token>" header
-        auth_header = request.headers.get('Authorization')
-        if auth_header and auth_header.startswith('Bearer '):
-            id_token = auth_header.split('Bearer ')[1]
-        else:
-            # No valid Bearer token found
-            return None # Proceed as guest
-
         # 2. Verify token using Firebase Admin SDK
         if id_token:
-            decoded_token = firebase_admin.auth.verify_id_token(id_token)
+            with observe_stage('token_verification'):
+                decoded_token = firebase_admin.auth.verify_id_token(id_token)
             user_uid = decoded_token.get('uid')
             if user_uid:
-                 current_app.logger.info(f"Firebase token verified successfully for UID: {user_uid}")
+                 g.firebase_uid = user_uid  # Picked up by the request log context
+                 current_app.logger.info("Firebase token verified successfully for UID: %s", user_uid)
                  return decoded_token # Return decoded payload on success
             else:
                  current_app.logger.warning("Token verified but UID missing in decoded token.")
@@ -41,11 +60,34 @@ def verify_token():
         current_app.logger.warning("Firebase token verification failed: Token expired.")
         return None # Treat expired token as guest/unauthenticated
     except firebase_admin.auth.InvalidIdTokenError as e:
-        current_app.logger.warning(f"Firebase token verification failed: Invalid token - {e}")
+        current_app.logger.warning("Firebase token verification failed: Invalid token - %s", e)
         return None # Treat invalid token as guest/unauthenticated
     except Exception as e:
         # Catch any other unexpected errors during verification
-        current_app.logger.error(f"Unexpected error during Firebase token verification: {e}", exc_info=True)
+        current_app.logger.error("Unexpected error during Firebase token verification: %s", e, exc_info=True)
         return None # Treat as guest/unauthenticated on unexpected errors
 
     return None # Default return if something goes wrong
+
+
+def is_admin_request() -> bool:
+    """
+    Checks the X-Admin-Token header against the configured ADMIN_API_TOKEN.
+
+    Returns:
+        bool: True only if an admin token is configured and the header matches it.
+    """
+    expected_token = current_app.config.get('ADMIN_API_TOKEN')
+    provided_token = request.headers.get('X-Admin-Token', '')
+    return bool(expected_token) and hmac.compare_digest(provided_token, expected_token)
+
+
+def admin_required(view):
+    """Decorator that rejects requests without a valid X-Admin-Token header."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_admin_request():
+            current_app.logger.warning("Admin endpoint %s - Unauthorized request.", request.path)
+            return jsonify({"error": "Admin authorization required."}), 401
+        return view(*args, **kwargs)
+    return wrapper
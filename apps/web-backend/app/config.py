@@ -24,6 +24,16 @@ class Config:
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # --- Sharding (optional; see app/sharding.py) ---
+    # Comma-separated database URLs. When set, conversations and messages are spread over these
+    # by a hash of User.id, and DATABASE_URL keeps users, jobs and idempotency records.
+    # The list is append-only: a shard's position fixes its id offset.
+    SHARD_DATABASE_URLS = [url.strip() for url in os.getenv("SHARD_DATABASE_URLS", "").split(",") if url.strip()]
+    SQLALCHEMY_BINDS = {f"shard{index}": url for index, url in enumerate(SHARD_DATABASE_URLS)}
+    # Conversation and message ids are interleaved across shards (id % stride == shard index + 1),
+    # so a user's rows keep their ids when rebalanced. Also the maximum number of shards.
+    SHARD_ID_STRIDE = int(os.getenv("SHARD_ID_STRIDE", "16"))
+
     # --- CORS ---
     ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*")
 
@@ -40,6 +50,21 @@ class Config:
     # --- Audio Transcription Settings ---
     MAX_AUDIO_FILE_SIZE = int(os.getenv("MAX_AUDIO_FILE_SIZE", "25000000"))  # 25MB
     ALLOWED_AUDIO_FORMATS = os.getenv("ALLOWED_AUDIO_FORMATS", "audio/mpeg,audio/wav,audio/m4a,audio/mp4,audio/webm").split(",")
+    # Uploads are re-encoded to 16 kHz mono Opus before going to Whisper (see app/services/audio_service.py),
+    # so with ffmpeg installed files up to MAX_AUDIO_UPLOAD_SIZE are accepted; without it, MAX_AUDIO_FILE_SIZE
+    AUDIO_NORMALIZATION_ENABLED = os.getenv("AUDIO_NORMALIZATION_ENABLED", "True").lower() == "true"
+    FFMPEG_PATH = os.getenv("FFMPEG_PATH")  # defaults to ffmpeg on the PATH
+    MAX_AUDIO_UPLOAD_SIZE = int(os.getenv("MAX_AUDIO_UPLOAD_SIZE", "100000000"))  # 100MB
+    AUDIO_COMPACT_BITRATE_KBPS = int(os.getenv("AUDIO_COMPACT_BITRATE_KBPS", "48"))  # uploaded as-is at or below this
+    AUDIO_TARGET_BITRATE = os.getenv("AUDIO_TARGET_BITRATE", "24k")
+    AUDIO_SILENCE_THRESHOLD_DB = int(os.getenv("AUDIO_SILENCE_THRESHOLD_DB", "-50"))
+    AUDIO_NORMALIZE_TIMEOUT_SECONDS = int(os.getenv("AUDIO_NORMALIZE_TIMEOUT_SECONDS", "120"))
+    # Resumable uploads (POST /api/transcribe/uploads): chunks are appended to files here, so every
+    # request for one upload must reach the same instance (a shared disk, or a single web instance).
+    # The audio of queued async transcriptions is kept here too, for job workers to read.
+    # Required in production; elsewhere it defaults to <tmp>/cogito-uploads
+    TRANSCRIPTION_UPLOAD_DIR = os.getenv("TRANSCRIPTION_UPLOAD_DIR")
+    TRANSCRIPTION_UPLOAD_TTL_HOURS = float(os.getenv("TRANSCRIPTION_UPLOAD_TTL_HOURS", "24"))  # since the last chunk
 
     # --- Security Settings ---
     # Force HTTPS in production
@@ -52,6 +77,144 @@ class Config:
     # --- App Specific ---
     MAX_HISTORY_MSGS = int(os.getenv("MAX_HISTORY_MSGS", "20"))
     MAX_HISTORY_ITEMS = int(os.getenv("MAX_HISTORY_ITEMS", "10"))
+    # Per-worker cache of /api/history payloads (validated against User.history_version)
+    HISTORY_CACHE_MAX_USERS = int(os.getenv("HISTORY_CACHE_MAX_USERS", "1000"))
+    HISTORY_CACHE_MAX_ENTRIES_PER_USER = int(os.getenv("HISTORY_CACHE_MAX_ENTRIES_PER_USER", "20"))
+
+    # --- Incremental sync (GET /api/sync) ---
+    SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", "500"))
+    # The sync window trails real time by this much so in-flight commits are not skipped
+    SYNC_LAG_SECONDS = float(os.getenv("SYNC_LAG_SECONDS", "2"))
+    SYNC_TOMBSTONE_RETENTION_DAYS = int(os.getenv("SYNC_TOMBSTONE_RETENTION_DAYS", "90"))
+
+    # --- Idempotency (POST /api/dialogue with an Idempotency-Key header) ---
+    IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "3600"))
+    # How long a duplicate waits for the original request before answering 409
+    IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))
+    # A key whose request has not finished after this long is taken for abandoned (the worker was
+    # killed) and the next retry runs it again; keep it above the slowest request
+    IDEMPOTENCY_LEASE_SECONDS = float(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "120"))
+
+    # --- Semantic memory (cross-conversation recall in POST /api/dialogue) ---
+    # Off by default: with the openai embedder every turn waits on an embeddings round trip
+    MEMORY_ENABLED = os.getenv("MEMORY_ENABLED", "False").lower() == "true"
+    MEMORY_EMBEDDER = os.getenv("MEMORY_EMBEDDER", "openai")  # "openai" or "hashing" (local, no network)
+    MEMORY_EMBEDDING_MODEL = os.getenv("MEMORY_EMBEDDING_MODEL", "text-embedding-3-small")
+    MEMORY_EMBEDDING_DIMENSIONS = int(os.getenv("MEMORY_EMBEDDING_DIMENSIONS", "256"))
+    MEMORY_DIR = os.getenv("MEMORY_DIR")  # Defaults to <instance>/memory; required in production (persistent disk)
+    MEMORY_TOP_K = int(os.getenv("MEMORY_TOP_K", "4"))
+    MEMORY_MIN_SCORE = float(os.getenv("MEMORY_MIN_SCORE", "0.35"))
+    MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "300"))
+    MEMORY_QUEUE_SIZE = int(os.getenv("MEMORY_QUEUE_SIZE", "1000"))
+
+    # --- Archiving (conversations idle this long move to compressed cold storage) ---
+    ARCHIVE_IDLE_DAYS = int(os.getenv("ARCHIVE_IDLE_DAYS", "180"))
+    ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "200"))
+    ARCHIVE_COMPRESSION_LEVEL = int(os.getenv("ARCHIVE_COMPRESSION_LEVEL", "9"))
+
+    # --- WebSocket dialogue sessions (/api/dialogue/ws) ---
+    WS_AUTH_TIMEOUT_SECONDS = float(os.getenv("WS_AUTH_TIMEOUT_SECONDS", "10"))
+    WS_IDLE_TIMEOUT_SECONDS = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "300"))
+    # Each open session holds one of the worker's GUNICORN_THREADS threads. Sessions past this many
+    # per worker process are closed with code 1013 (try again later); clients fall back to HTTP.
+    # Transcription result polls with ?wait= hold a thread too; past their limit they answer at once
+    LONG_REQUEST_LIMITS = {
+        "websocket": int(os.getenv("WS_MAX_SESSIONS_PER_WORKER", str(max(1, int(os.getenv("GUNICORN_THREADS", "8")) // 4)))),
+        "long_poll": int(os.getenv("TRANSCRIPTION_MAX_WAITING_POLLS_PER_WORKER",
+                                   str(max(1, int(os.getenv("GUNICORN_THREADS", "8")) // 4)))),
+    }
+    # Server pings keep idle connections open through proxies and detect dead clients
+    SOCK_SERVER_OPTIONS = {"ping_interval": int(os.getenv("WS_PING_INTERVAL_SECONDS", "25"))}
+
+    # --- Admission control for OpenAI calls (see app/services/admission_service.py) ---
+    ADMISSION_CONTROL_ENABLED = os.getenv("ADMISSION_CONTROL_ENABLED", "True").lower() == "true"
+    # Concurrent calls per upstream in each worker process; workers x limit should stay under
+    # what the OpenAI rate limits sustain
+    ADMISSION_LIMITS = {
+        "chat": int(os.getenv("ADMISSION_CHAT_CONCURRENCY", "4")),
+        "transcription": int(os.getenv("ADMISSION_TRANSCRIPTION_CONCURRENCY", "2")),
+        "embedding": int(os.getenv("ADMISSION_EMBEDDING_CONCURRENCY", "4")),  # memory recall and indexing
+    }
+    ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "16"))
+    ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "10"))
+
+    # --- Panel mode (POST /api/dialogue/panel) ---
+    # Threads per worker process for concurrent persona completions, shared by all panel requests
+    PANEL_MAX_WORKERS = int(os.getenv("PANEL_MAX_WORKERS", "16"))
+    PANEL_TIMEOUT_SECONDS = float(os.getenv("PANEL_TIMEOUT_SECONDS", "60"))
+
+    # --- Background jobs (run by `flask jobs worker`) ---
+    JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+    JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "10"))
+    # A running job's worker renews its lock every quarter of this; a lock not renewed for this
+    # long means the worker died, and the job is handed to another one
+    JOB_LOCK_TIMEOUT_SECONDS = float(os.getenv("JOB_LOCK_TIMEOUT_SECONDS", "300"))
+    JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "1.0"))
+    JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "7"))
+    # Async transcription (POST /api/transcribe?async=true, then GET /api/transcribe/<job_id>)
+    TRANSCRIPTION_JOB_MAX_ATTEMPTS = int(os.getenv("TRANSCRIPTION_JOB_MAX_ATTEMPTS", "3"))
+    # Longest a result poll may wait (GET /api/transcribe/<job_id>?wait=N); keep it under proxy timeouts.
+    # At most LONG_REQUEST_LIMITS["long_poll"] polls per worker wait at a time
+    TRANSCRIPTION_MAX_WAIT_SECONDS = float(os.getenv("TRANSCRIPTION_MAX_WAIT_SECONDS", "25"))
+    TRANSCRIPTION_POLL_INTERVAL_SECONDS = float(os.getenv("TRANSCRIPTION_POLL_INTERVAL_SECONDS", "0.5"))
+    # LLM titles for new conversations (needs a job worker running)
+    TITLE_GENERATION_ENABLED = os.getenv("TITLE_GENERATION_ENABLED", "True").lower() == "true"
+    TITLE_MODEL = os.getenv("TITLE_MODEL")  # Defaults to OPENAI_MODEL
+
+    # --- Response compression ---
+    COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "True").lower() == "true"
+    # Bodies smaller than this are sent as-is; compressing them costs more than it saves
+    COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+    COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+    COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+    # --- Logging ---
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" or "text"
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    # Fraction of INFO/DEBUG lines kept; WARNING and above, and audit lines logged with
+    # extra=NO_SAMPLE (account and history deletes, job, archive and shard outcomes), are never sampled
+    LOG_INFO_SAMPLE_RATE = float(os.getenv("LOG_INFO_SAMPLE_RATE", "1.0"))
+    LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))
+
+    # --- Admin ---
+    # Shared secret for operator-only endpoints, sent as the X-Admin-Token header (admin routes are disabled when unset)
+    ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")
+
+    # --- Profiling ---
+    PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "True").lower() == "true"
+    # Fraction of requests profiled without an admin X-Profile header
+    PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0.0"))
+    PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", "5"))
+    PROFILING_MAX_FILES = int(os.getenv("PROFILING_MAX_FILES", "50"))
+    PROFILING_DIR = os.getenv("PROFILING_DIR")  # Defaults to <instance>/profiles
+
+    # --- Warm-up and health probes (/healthz/live, /healthz/ready) ---
+    WARMUP_DB_CONNECTIONS = int(os.getenv("WARMUP_DB_CONNECTIONS", "4"))
+    # /healthz/ready reports unready when a database round trip takes longer than this
+    HEALTH_DB_MAX_LATENCY_MS = float(os.getenv("HEALTH_DB_MAX_LATENCY_MS", "1000"))
+    HEALTH_UPSTREAM_CACHE_SECONDS = float(os.getenv("HEALTH_UPSTREAM_CACHE_SECONDS", "30"))
+    HEALTH_UPSTREAM_TIMEOUT_SECONDS = float(os.getenv("HEALTH_UPSTREAM_TIMEOUT_SECONDS", "5"))
+
+    # --- Query counting (see app/services/query_stats_service.py) ---
+    QUERY_STATS_ENABLED = os.getenv("QUERY_STATS_ENABLED", "True").lower() == "true"
+    # Return X-DB-Queries and Server-Timing headers on every response (admin requests always get them)
+    QUERY_STATS_HEADER = os.getenv("QUERY_STATS_HEADER", "False").lower() == "true"
+    # A statement run this many times in one request is logged as a possible N+1
+    QUERY_REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", "5"))
+    # Per-endpoint overrides of @query_budget, e.g. "dialogue.get_history=4,dialogue.handle_dialogue=12"
+    QUERY_BUDGETS = {
+        endpoint.strip(): int(budget)
+        for endpoint, _, budget in (item.partition("=") for item in os.getenv("QUERY_BUDGETS", "").split(",") if item)
+    }
+    # Fail requests over budget instead of logging them (on in tests, so regressions break the build)
+    QUERY_BUDGET_STRICT = os.getenv("QUERY_BUDGET_STRICT", "False").lower() == "true"
+
+    # --- Metrics ---
+    # Bearer token required to scrape /metrics (leave unset to allow open scraping on a private network)
+    METRICS_AUTH_TOKEN = os.getenv("METRICS_AUTH_TOKEN")
+    # Refuse to serve /metrics at all while METRICS_AUTH_TOKEN is unset (on in production)
+    METRICS_REQUIRE_AUTH = os.getenv("METRICS_REQUIRE_AUTH", "False").lower() == "true"
     
     # Use Render secret files - these environment variables are set by Render when secret files are uploaded
     PROMPT_FILE_PATH = os.getenv('SOCRATES_PROMPT_FILE_PATH')
@@ -80,13 +243,20 @@ class Config:
 class DevelopmentConfig(Config):
     """Development configuration."""
     DEBUG = True
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
     FORCE_HTTPS = False
     SESSION_COOKIE_SECURE = False
+    QUERY_STATS_HEADER = True
 
 
 class ProductionConfig(Config):
     """Production configuration."""
     DEBUG = False
+    LOG_INFO_SAMPLE_RATE = float(os.getenv("LOG_INFO_SAMPLE_RATE", "0.25"))
+    METRICS_REQUIRE_AUTH = os.getenv("METRICS_REQUIRE_AUTH", "True").lower() == "true"
+    # Checked by create_app: storage that must outlive a deploy (and be shared by every web instance
+    # and job worker) has to be configured explicitly
+    REQUIRED_SETTINGS = ("TRANSCRIPTION_UPLOAD_DIR",) + (("MEMORY_DIR",) if Config.MEMORY_ENABLED else ())
     FORCE_HTTPS = True
     SESSION_COOKIE_SECURE = True
 
@@ -98,4 +268,7 @@ class TestingConfig(Config):
     FORCE_HTTPS = False
     SESSION_COOKIE_SECURE = False
     SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
+    MEMORY_EMBEDDER = "hashing"
+    QUERY_STATS_HEADER = True
+    QUERY_BUDGET_STRICT = True
 
@@ -0,0 +1,101 @@
+# backend/app/dialogue/pipeline.py
+# Shared request pipeline for the dialogue routes: authentication, user and conversation
+# lookup and body validation, each done once per request by a decorator
+
+from functools import wraps
+from flask import current_app, jsonify, request
+from pydantic import BaseModel, ValidationError
+from ..auth.utils import verify_token
+from ..extensions import db
+from ..models import User, Conversation
+from ..sharding import route_to_user, sharding_enabled
+from ..services.metrics_service import observe_stage
+
+
+def get_user(firebase_uid: str) -> User | None:
+    """Looks up an existing user and routes the request's conversation queries to their shard."""
+    user = db.session.scalars(db.select(User).filter_by(firebase_uid=firebase_uid)).first()
+    if user:
+        route_to_user(user.id)
+    return user
+
+
+def get_user_and_conversation(firebase_uid: str, conversation_id: int) -> tuple[User | None, Conversation | None]:
+    """
+    The user and, only if they own it, the conversation, in one joined query.
+    With sharding on this takes two: the conversation's shard is only known from the user.
+    """
+    if sharding_enabled():
+        user = get_user(firebase_uid)
+        if not user:
+            return None, None
+        return user, db.session.scalars(
+            db.select(Conversation).filter_by(id=conversation_id, user_id=user.id)
+        ).first()
+    row = db.session.execute(
+        db.select(User, Conversation)
+        .outerjoin(Conversation, db.and_(Conversation.user_id == User.id, Conversation.id == conversation_id))
+        .where(User.firebase_uid == firebase_uid)
+    ).first()
+    return (row.User, row.Conversation) if row else (None, None)
+
+
+def authenticated(verified_email: bool = True, load_conversation: bool = False):
+    """
+    Decorator for routes that need a signed-in user.
+
+    Answers 401 without a valid token and 403 if ``verified_email`` is required but the email is
+    unverified. The view gets ``user`` (None if the user has no record yet) and, with
+    ``load_conversation``, ``conversation`` for its ``conversation_id`` (None unless the user owns it).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            decoded_token = verify_token()
+            if not decoded_token or not decoded_token.get('uid'):
+                current_app.logger.warning("%s %s - Unauthorized: Missing or invalid token.", request.method, request.path)
+                return jsonify({"error": "Authorization required: Invalid or missing token."}), 401
+            firebase_uid = decoded_token['uid']
+            if verified_email and not decoded_token.get('email_verified', False):
+                current_app.logger.warning("%s %s - Access denied for unverified user UID: %s",
+                                           request.method, request.path, firebase_uid)
+                return jsonify({"error": "Email verification required to access chat history."}), 403
+            with observe_stage('user_lookup'):
+                if load_conversation:
+                    kwargs['user'], kwargs['conversation'] = get_user_and_conversation(
+                        firebase_uid, kwargs['conversation_id'])
+                else:
+                    kwargs['user'] = get_user(firebase_uid)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def format_validation_error(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in detail['loc'])}: {detail['msg']}" if detail['loc'] else detail['msg']
+        for detail in error.errors(include_url=False)
+    )
+
+
+def json_body(schema: type[BaseModel], error: str = "Invalid request data"):
+    """
+    Decorator that validates the JSON body against ``schema`` and passes the model to the view as ``body``.
+    Pydantic parses the raw bytes itself (model_validate_json), with no intermediate dict of the body.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            raw_body = request.get_data(cache=True)
+            if not raw_body:
+                current_app.logger.warning("%s %s - Bad request: Missing request body.", request.method, request.path)
+                return jsonify({"error": "Missing request body."}), 400
+            try:
+                with observe_stage('validation'):
+                    kwargs['body'] = schema.model_validate_json(raw_body)
+            except ValidationError as e:
+                current_app.logger.warning("%s %s - Validation error: %s", request.method, request.path, e)
+                return jsonify({"error": f"{error}: {format_validation_error(e)}"}), 400
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
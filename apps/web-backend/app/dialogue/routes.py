@@ -1,68 +1,109 @@
 # backend/app/dialogue/routes.py
 # v12: Added DELETE /api/history/<id> endpoint
 
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, g, stream_with_context
 from openai import OpenAIError
 from ..auth.utils import verify_token
+from .pipeline import authenticated, json_body, get_user
 from ..extensions import db, limiter
-from ..models import User, Conversation, Message  # Ensure models are imported
+from ..logging_setup import NO_SAMPLE
+from ..models import User, Conversation  # Ensure models are imported
+from ..sharding import route_to_user
+from ..services.metrics_service import observe_stage, record_openai_usage, OPENAI_REQUEST_SECONDS
+from ..services.idempotency_service import idempotent
+from ..services.admission_service import admit, caller_priority, overloaded_response, AdmissionRejected
+from ..services.archive_service import conversation_messages
+from ..services.dialogue_service import persona_system_prompt, recall_memory, save_turn, save_panel
+from ..services.export_service import EXPORT_FORMATS, generate_history_export
+from ..services.memory_service import get_memory_service
+from ..services.panel_service import ask_panel
+from ..services.query_stats_service import query_budget
+from ..services.search_service import search_history, SearchNotSupportedError, MAX_QUERY_LENGTH
+from ..services.sync_service import (
+    collect_changes,
+    decode_cursor,
+    record_tombstones,
+    CursorError,
+    CursorExpiredError,
+)
+from ..services.history_cache import (
+    cached_history_response,
+    store_history_response,
+    bump_history_version,
+    invalidate_history_cache,
+)
+import time
 from datetime import datetime, timezone, timedelta
-from pydantic import BaseModel, Field, constr, validator
-from typing import List, Optional, Literal
+from pydantic import BaseModel, Field, StringConstraints
+from typing import Annotated, List, Optional, Literal
 
 dialogue_bp = Blueprint('dialogue', __name__, url_prefix='/api')
 
-# Pydantic validation schemas
+# Turns per client IP, shared by POST /api/dialogue and the WebSocket transport (see websocket.py)
+DIALOGUE_RATE_LIMIT = "10 per minute"
+DIALOGUE_RATE_SCOPE = "dialogue"
+
+# Pydantic validation schemas. Constraints are declared on the fields rather than in Python
+# validators, so pydantic-core checks them while parsing the raw JSON (see json_body).
 class MessageSchema(BaseModel):
     role: Literal['user', 'assistant'] = Field(..., description="Message role (user or assistant)")
-    content: constr(min_length=1, max_length=5000) = Field(..., description="Message content")
+    content: Annotated[str, StringConstraints(min_length=1, max_length=5000)] = Field(..., description="Message content")
 
 class DialogueRequestSchema(BaseModel):
-    history: List[MessageSchema] = Field(..., description="Conversation history")
+    # At least one message, at most 50
+    history: List[MessageSchema] = Field(..., min_length=1, max_length=50, description="Conversation history")
     conversation_id: Optional[int] = Field(None, description="Conversation ID for continuing an existing conversation")
     persona_id: Optional[str] = Field(None, description="Persona ID for the AI character")
-    
-    @validator('history')
-    def validate_history(cls, v):
-        if not v:
-            raise ValueError("History cannot be empty")
-        if len(v) > 50:  # Set a reasonable maximum
-            raise ValueError("History too long (maximum 50 messages)")
-        return v
+
+class PanelRequestSchema(BaseModel):
+    message: Annotated[str, StringConstraints(min_length=1, max_length=5000)] = Field(..., description="Question for every persona")
+    persona_ids: List[str] = Field(..., min_length=1, max_length=8, description="Personas on the panel")
 
 # NEW: Schema for conversation title update
 class ConversationTitleUpdateSchema(BaseModel):
-    title: constr(min_length=1, max_length=100) = Field(..., description="New conversation title")
+    title: Annotated[str, StringConstraints(min_length=1, max_length=100)] = Field(..., description="New conversation title")
 
-# --- Helper Function: Get or Create User (Keep as is) ---
+# --- Helper Function: Get or Create User ---
 def get_or_create_user(firebase_uid: str, email: str | None = None, display_name: str | None = None) -> User | None:
     if not firebase_uid:
         current_app.logger.error("get_or_create_user called with empty or None firebase_uid")
         return None
-    user = db.session.scalars(db.select(User).filter_by(firebase_uid=firebase_uid)).first()
+    user = get_user(firebase_uid)
     if not user:
-        current_app.logger.info(f"Creating new user record for firebase_uid: {firebase_uid}")
-        current_app.logger.info(f"User details for creation - Email: {email}, Name: {display_name}")
+        current_app.logger.info("Creating new user record for firebase_uid: %s", firebase_uid)
         user = User(firebase_uid=firebase_uid, email=email, display_name=display_name)
         db.session.add(user)
         try:
             db.session.commit()
-            current_app.logger.info(f"Successfully created user with ID: {user.id} for firebase_uid: {firebase_uid}")
+            current_app.logger.info("Successfully created user with ID: %s for firebase_uid: %s", user.id, firebase_uid,
+                                    extra=NO_SAMPLE)
         except Exception as e:
             db.session.rollback()
-            current_app.logger.error(f"Failed to create user record for {firebase_uid}: {e}", exc_info=True)
+            current_app.logger.error("Failed to create user record for %s: %s", firebase_uid, e, exc_info=True)
             return None
+        route_to_user(user.id)
     return user
 
 
+def conversation_summary(conv: Conversation) -> dict:
+    """Serializes a conversation for history lists and sync payloads."""
+    return {"id": conv.id, "title": conv.title or f"Conversation from {conv.created_at.strftime('%Y-%m-%d %H:%M')}",
+            "updated_at": conv.updated_at, "persona_id": conv.persona_id,
+            "message_count": conv.message_count, "last_message_preview": conv.last_message_preview,
+            "last_role": conv.last_role, "prompt_tokens_total": conv.prompt_tokens_total,
+            "completion_tokens_total": conv.completion_tokens_total, "archived": conv.archived_at is not None}
+
+
 # --- End Helper ---
 
 
 @dialogue_bp.route('/dialogue', methods=['POST'])
-@limiter.limit("10 per minute")  # Stricter limit for AI chat endpoint
-def handle_dialogue():
+@query_budget(15)  # Continuing an archived conversation restores it first
+@idempotent  # Outside the rate limit, so replayed retries don't use up the caller's quota
+@limiter.shared_limit(DIALOGUE_RATE_LIMIT, scope=DIALOGUE_RATE_SCOPE)  # Stricter limit for AI chat endpoint
+@json_body(DialogueRequestSchema)
+def handle_dialogue(body: DialogueRequestSchema):
     decoded_token = verify_token()
-    current_app.logger.debug(f"POST /dialogue - Decoded token content: {decoded_token}")
 
     current_user_id = decoded_token.get('uid') if decoded_token else None
     user_email = decoded_token.get('email') if decoded_token else None
@@ -71,7 +112,8 @@ def handle_dialogue():
                                                                      False) if decoded_token else False
 
     current_app.logger.debug(
-        f"POST /dialogue - Extracted from token - UID: {current_user_id}, Email: {user_email}, Name: {user_name}, Email Verified in Token: {is_email_verified_in_token}")
+        "POST /dialogue - Extracted from token - UID: %s, Email Verified in Token: %s",
+        current_user_id, is_email_verified_in_token)
 
     user_log_id = f"user ID: {current_user_id}" if current_user_id else "guest user"
     openai_user_param = str(current_user_id) if current_user_id else f"guest_session_{request.remote_addr}"
@@ -79,56 +121,43 @@ def handle_dialogue():
     db_user: User | None = None
     if current_user_id:
         try:
-            current_app.logger.debug(f"POST /dialogue - Attempting get_or_create_user with UID: {current_user_id}")
-            db_user = get_or_create_user(current_user_id, user_email, user_name)
+            current_app.logger.debug("POST /dialogue - Attempting get_or_create_user with UID: %s", current_user_id)
+            with observe_stage('user_lookup'):
+                db_user = get_or_create_user(current_user_id, user_email, user_name)
             if not db_user:
-                current_app.logger.error(
-                    f"POST /dialogue - get_or_create_user returned None for UID: {current_user_id}")
+                current_app.logger.error("POST /dialogue - get_or_create_user returned None for UID: %s",
+                                         current_user_id)
                 return jsonify({"error": "Could not process user information due to a database issue."}), 500
         except Exception as e:
             current_app.logger.error(
-                f"POST /dialogue - Exception during get_or_create_user call for UID {current_user_id}: {e}",
-                exc_info=True)
+                "POST /dialogue - Exception during get_or_create_user call for UID %s: %s",
+                current_user_id, e, exc_info=True)
             return jsonify({"error": "Could not process user information."}), 500
 
     current_app.logger.info(
-        f"POST /dialogue - Request received from {user_log_id} (DB User ID: {db_user.id if db_user else 'N/A'})")
+        "POST /dialogue - Request received from %s (DB User ID: %s)",
+        user_log_id, db_user.id if db_user else 'N/A')
 
     client = current_app.openai_client
     system_prompt = current_app.system_prompt
     max_history = current_app.config.get('MAX_HISTORY_MSGS', 20)
 
     if not client:
-        current_app.logger.error(f"POST /dialogue - OpenAI client not initialized for {user_log_id}")
+        current_app.logger.error("POST /dialogue - OpenAI client not initialized for %s", user_log_id)
         return jsonify({"error": "OpenAI client not initialized. Check API key."}), 503
 
     try:
-        # Parse and validate the request data using Pydantic
-        try:
-            raw_data = request.get_json()
-            if not raw_data:
-                current_app.logger.warning(f"POST /dialogue - Invalid JSON received from {user_log_id}")
-                return jsonify({"error": "Invalid JSON request body"}), 400
-            
-            # Validate with Pydantic schema
-            data = DialogueRequestSchema(**raw_data)
-        except Exception as e:
-            current_app.logger.warning(f"POST /dialogue - Validation error: {str(e)}")
-            return jsonify({"error": f"Invalid request data: {str(e)}"}), 400
-
-        conversation_history = data.history
-        incoming_conversation_id = data.conversation_id
+        conversation_history = body.history
+        incoming_conversation_id = body.conversation_id
         # --- Persona support ---
-        incoming_persona_id = data.persona_id or current_app.DEFAULT_PERSONA_ID
-        system_prompt_content = current_app.persona_prompts_content.get(
-            incoming_persona_id,
-            current_app.persona_prompts_content.get(current_app.DEFAULT_PERSONA_ID)
-        )
+        incoming_persona_id, system_prompt_content = persona_system_prompt(body.persona_id)
         if not system_prompt_content:
-            current_app.logger.error(f"System prompt for persona '{incoming_persona_id}' or default not found.")
+            current_app.logger.error("System prompt for persona '%s' or default not found.", incoming_persona_id)
             return jsonify({"error": "Internal server error: Persona configuration issue."}), 500
         # --- End persona support ---
-        current_app.logger.info(f"POST /dialogue - Incoming conversation_id from payload: {incoming_conversation_id}, persona_id: {incoming_persona_id}")
+        current_app.logger.info(
+            "POST /dialogue - Incoming conversation_id from payload: %s, persona_id: %s",
+            incoming_conversation_id, incoming_persona_id)
 
         latest_user_message_content = None
         if conversation_history and conversation_history[-1].role == 'user':
@@ -141,111 +170,206 @@ def handle_dialogue():
 
         messages_for_openai = [{"role": "system", "content": system_prompt_content}]
         # Convert Pydantic models to dictionaries for OpenAI
-        messages_for_openai.extend([msg.dict() for msg in conversation_history_for_openai])
-
+        messages_for_openai.extend([msg.model_dump() for msg in conversation_history_for_openai])
+
+        # --- Cross-conversation memory ---
+        query_vector = None
+        if db_user and latest_user_message_content:
+            query_vector, memory_context = recall_memory(db_user.id, latest_user_message_content,
+                                                         exclude_conversation_id=incoming_conversation_id,
+                                                         priority=caller_priority(decoded_token))
+            if memory_context:
+                messages_for_openai.insert(1, {"role": "system", "content": memory_context})
+        # --- End cross-conversation memory ---
+
+        openai_model = current_app.config.get('OPENAI_MODEL', 'gpt-4-turbo')
         try:
-            completion = client.chat.completions.create(
-                model=current_app.config.get('OPENAI_MODEL', 'gpt-4-turbo'),
-                messages=messages_for_openai,
-                temperature=current_app.config.get('OPENAI_TEMPERATURE', 0.7),
-                max_tokens=current_app.config.get('OPENAI_MAX_TOKENS', 256),
-                user=openai_user_param
-            )
+            with admit('chat', caller_priority(decoded_token)):
+                openai_start = time.perf_counter()
+                completion = client.chat.completions.create(
+                    model=openai_model,
+                    messages=messages_for_openai,
+                    temperature=current_app.config.get('OPENAI_TEMPERATURE', 0.7),
+                    max_tokens=current_app.config.get('OPENAI_MAX_TOKENS', 256),
+                    user=openai_user_param
+                )
+                openai_seconds = time.perf_counter() - openai_start
+                OPENAI_REQUEST_SECONDS.labels('chat', openai_model).observe(openai_seconds)
+            completion_usage = getattr(completion, 'usage', None)
+            record_openai_usage(openai_model, completion_usage)
             ai_response_content = completion.choices[0].message.content.strip()
-            current_app.logger.info(f"POST /dialogue - Received OpenAI response for {user_log_id}")
+            current_app.logger.info("POST /dialogue - Received OpenAI response for %s", user_log_id)
 
+        except AdmissionRejected as e:
+            return overloaded_response(e)
         except OpenAIError as e:
-            current_app.logger.error(f"POST /dialogue - OpenAI API Error for {user_log_id}: {e}", exc_info=True)
+            current_app.logger.error("POST /dialogue - OpenAI API Error for %s: %s", user_log_id, e, exc_info=True)
             return jsonify({"error": "Error communicating with AI service."}), 502
         except Exception as e:
-            current_app.logger.error(f"POST /dialogue - Unexpected error during OpenAI call for {user_log_id}: {e}",
-                                     exc_info=True)
+            current_app.logger.error(
+                "POST /dialogue - Unexpected error during OpenAI call for %s: %s",
+                user_log_id, e, exc_info=True)
             return jsonify({"error": "An unexpected error occurred while processing your request."}), 500
 
         active_conversation: Conversation | None = None
         if db_user and latest_user_message_content and ai_response_content:
             try:
-                if incoming_conversation_id is not None:
-                    current_app.logger.info(
-                        f"POST /dialogue - Attempting to use existing conversation_id: {incoming_conversation_id} for user {db_user.id}")
-                    active_conversation = db.session.scalars(
-                        db.select(Conversation)
-                        .filter_by(id=incoming_conversation_id, user_id=db_user.id)
-                    ).first()
-                    if active_conversation:
-                        current_app.logger.info(
-                            f"POST /dialogue - Found and will append to existing conversation {active_conversation.id}")
-                    else:
-                        current_app.logger.warning(
-                            f"POST /dialogue - Conversation ID {incoming_conversation_id} not found for user {db_user.id} or invalid. Creating new conversation.")
-
-                if not active_conversation:
-                    current_app.logger.info(f"POST /dialogue - Creating new conversation for user {db_user.id}")
-                    active_conversation = Conversation(user_id=db_user.id, title=latest_user_message_content[:80], persona_id=incoming_persona_id)
-                    db.session.add(active_conversation)
-                    db.session.flush()
-
-                user_msg_record = Message(conversation_id=active_conversation.id, role='user',
-                                          content=latest_user_message_content)
-                db.session.add(user_msg_record)
-                assistant_msg_record = Message(conversation_id=active_conversation.id, role='assistant',
-                                               content=ai_response_content)
-                db.session.add(assistant_msg_record)
-                active_conversation.updated_at = datetime.now(timezone.utc)
-                db.session.commit()
-                current_app.logger.info(
-                    f"POST /dialogue - Saved messages to conversation {active_conversation.id} for user {db_user.id}")
+                active_conversation = save_turn(
+                    db_user.id, incoming_conversation_id, incoming_persona_id,
+                    latest_user_message_content, ai_response_content,
+                    usage=completion_usage, query_vector=query_vector,
+                    model=openai_model, latency=openai_seconds,
+                )
             except Exception as e:
                 db.session.rollback()
-                current_app.logger.error(f"POST /dialogue - Failed to save history for {user_log_id}: {e}",
-                                         exc_info=True)
+                active_conversation = None
+                current_app.logger.error(
+                    "POST /dialogue - Failed to save history for %s: %s",
+                    user_log_id, e, exc_info=True)
 
         response_payload = {"response": ai_response_content}
         if active_conversation:
             response_payload["conversation_id"] = active_conversation.id
             response_payload["persona_id"] = active_conversation.persona_id
 
-        return jsonify(response_payload)
+        with observe_stage('serialization'):
+            return jsonify(response_payload)
 
     except Exception as e:
-        current_app.logger.error(f"POST /dialogue - Error handling request / JSON parsing for {user_log_id}: {e}",
-                                 exc_info=True)
+        current_app.logger.error(
+            "POST /dialogue - Error handling request / JSON parsing for %s: %s",
+            user_log_id, e, exc_info=True)
         return jsonify({"error": "An internal server error occurred"}), 500
 
 
+# --- Panel: one question, several personas ---
+@dialogue_bp.route('/dialogue/panel', methods=['POST'])
+@query_budget(48)  # Five writes per persona on SQLite (batched on PostgreSQL), at most 8 personas
+@limiter.limit("5 per minute")  # Each request makes one completion per persona
+@json_body(PanelRequestSchema)
+def handle_panel(body: PanelRequestSchema):
+    """
+    Puts one question to several personas; their completions run concurrently (see panel_service),
+    so the answers take as long as the slowest persona. Signed-in users' answers are saved in one
+    transaction, each in a new conversation that can be continued with POST /api/dialogue.
+
+    Responds with {"answers": [...]} in the requested persona order. With ?stream=true it streams
+    NDJSON instead, one "answer" or "error" line per persona as each finishes, then a "done" line
+    with the saved conversation ids.
+    """
+    persona_ids = list(dict.fromkeys(body.persona_ids))
+    unknown = [persona_id for persona_id in persona_ids if persona_id not in current_app.persona_prompts_content]
+    if unknown:
+        return jsonify({"error": f"Unknown persona_id: {', '.join(unknown)}"}), 400
+    client = current_app.openai_client
+    if not client:
+        current_app.logger.error("POST /dialogue/panel - OpenAI client not initialized")
+        return jsonify({"error": "OpenAI client not initialized. Check API key."}), 503
+
+    decoded_token = verify_token()
+    current_user_id = decoded_token.get('uid') if decoded_token else None
+    db_user: User | None = None
+    if current_user_id:
+        with observe_stage('user_lookup'):
+            db_user = get_or_create_user(current_user_id, decoded_token.get('email'),
+                                         decoded_token.get('name') or decoded_token.get('displayName'))
+        if not db_user:
+            return jsonify({"error": "Could not process user information due to a database issue."}), 500
+    openai_user_param = str(current_user_id) if current_user_id else f"guest_session_{request.remote_addr}"
+    current_app.logger.info("POST /dialogue/panel - %s personas for %s", len(persona_ids),
+                            f"user ID: {current_user_id}" if current_user_id else "guest user")
+
+    # Recalled once and shared by the whole panel
+    query_vector, memory_context = (recall_memory(db_user.id, body.message, priority=caller_priority(decoded_token))
+                                    if db_user else (None, None))
+    prompts = {}
+    for persona_id in persona_ids:
+        messages = [{"role": "system", "content": current_app.persona_prompts_content[persona_id]}]
+        if memory_context:
+            messages.append({"role": "system", "content": memory_context})
+        messages.append({"role": "user", "content": body.message})
+        prompts[persona_id] = messages
+    results = ask_panel(client, prompts, openai_user_param, priority=caller_priority(decoded_token))
+
+    def persist(answers: list[dict]) -> dict[str, int]:
+        if not db_user or not answers:
+            return {}
+        try:
+            return save_panel(db_user.id, body.message, answers, query_vector=query_vector)
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error("POST /dialogue/panel - Failed to save answers for user ID %s: %s",
+                                     current_user_id, e, exc_info=True)
+            return {}
+
+    if request.args.get('stream', '').lower() in ('1', 'true'):
+        def generate():
+            answers = []
+            for result in results:
+                if "error" in result:
+                    line = {"type": "error", "persona_id": result["persona_id"], "error": result["error"]}
+                    if "retry_after" in result:
+                        line["retry_after"] = result["retry_after"]
+                else:
+                    answers.append(result)
+                    line = {"type": "answer", "persona_id": result["persona_id"], "response": result["content"]}
+                yield current_app.json.dumps(line) + "\n"
+            yield current_app.json.dumps({"type": "done", "conversations": persist(answers)}) + "\n"
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                        headers={"Cache-Control": "no-store"})
+
+    finished = {result["persona_id"]: result for result in results}
+    conversations = persist([finished[persona_id] for persona_id in persona_ids if "content" in finished[persona_id]])
+    with observe_stage('serialization'):
+        answers = [
+            {"persona_id": persona_id, "response": finished[persona_id]["content"],
+             "conversation_id": conversations.get(persona_id)}
+            if "content" in finished[persona_id] else
+            {"persona_id": persona_id, "error": finished[persona_id]["error"]}
+            for persona_id in persona_ids
+        ]
+        response = jsonify({"answers": answers})
+    # An error status only if no persona answered; partial panels are still useful
+    if not any("response" in answer for answer in answers):
+        retry_after = [result["retry_after"] for result in finished.values() if "retry_after" in result]
+        if len(retry_after) == len(finished):
+            response.status_code = 503
+            response.headers['Retry-After'] = str(max(retry_after))
+        else:
+            response.status_code = 502
+    return response
+# --- End Panel ---
+
+
 # --- Get Conversation History List (Keep as is) ---
 @dialogue_bp.route('/history', methods=['GET'])
+@query_budget(3)
 @limiter.limit("30 per minute")
-def get_history_list():
-    # ... (logic remains the same as v9/v10) ...
-    decoded_token = verify_token()
-    if not decoded_token:
-        return jsonify({"error": "Authorization required: Invalid or missing token."}), 401
-    firebase_uid = decoded_token.get('uid')
-    is_email_verified = decoded_token.get('email_verified', False)
-    if not firebase_uid:
-        return jsonify({"error": "Invalid token payload."}), 401
-    if not is_email_verified:  # Keep email verification for history access
-        current_app.logger.warning(f"GET /history - Access denied for unverified user UID: {firebase_uid}")
-        return jsonify({"error": "Email verification required to access chat history."}), 403
-    user = db.session.scalars(db.select(User).filter_by(firebase_uid=firebase_uid)).first()
+@authenticated()
+def get_history_list(user: User | None):
+    firebase_uid = g.firebase_uid
     if not user:
-        current_app.logger.info(f"GET /history - No user found in DB for UID: {firebase_uid}. Returning empty history.")
+        current_app.logger.info(
+            "GET /history - No user found in DB for UID: %s. Returning empty history.",
+            firebase_uid)
         return jsonify({"history": []})
+    cached_response = cached_history_response(user, 'list')
+    if cached_response is not None:
+        return cached_response
     conversations = db.session.scalars(
         db.select(Conversation)
         .filter_by(user_id=user.id)
         .order_by(Conversation.updated_at.desc())
         .limit(current_app.config.get('MAX_HISTORY_ITEMS', 10))
     ).all()
-    history_list = [
-        {"id": conv.id, "title": conv.title or f"Conversation from {conv.created_at.strftime('%Y-%m-%d %H:%M')}",
-         "updated_at": conv.updated_at.isoformat(), "persona_id": conv.persona_id}
-        for conv in conversations
-    ]
+    with observe_stage('serialization'):
+        history_list = [conversation_summary(conv) for conv in conversations]
+        response = store_history_response(user, 'list', {"history": history_list})
     current_app.logger.info(
-        f"GET /history - Returning {len(history_list)} conversation summaries for user UID: {firebase_uid}")
-    return jsonify({"history": history_list})
+        "GET /history - Returning %s conversation summaries for user UID: %s",
+        len(history_list), firebase_uid)
+    return response
 
 
 # --- End Get History List ---
@@ -253,44 +377,36 @@ def get_history_list():
 
 # --- Get Specific Conversation Messages (Keep as is) ---
 @dialogue_bp.route('/history/<int:conversation_id>', methods=['GET'])
+@query_budget(4)
 @limiter.limit("30 per minute")
-def get_conversation_messages(conversation_id: int):
-    # ... (logic remains the same as v9/v10) ...
-    decoded_token = verify_token()
-    if not decoded_token:
-        return jsonify({"error": "Authorization required: Invalid or missing token."}), 401
-    firebase_uid = decoded_token.get('uid')
-    is_email_verified = decoded_token.get('email_verified', False)
-    if not firebase_uid:
-        return jsonify({"error": "Invalid token payload."}), 401
-    if not is_email_verified:
-        current_app.logger.warning(
-            f"GET /history/{conversation_id} - Access denied for unverified user UID: {firebase_uid}")
-        return jsonify({"error": "Email verification required to access chat history."}), 403
-    user = db.session.scalars(db.select(User).filter_by(firebase_uid=firebase_uid)).first()
+@authenticated(load_conversation=True)
+def get_conversation_messages(conversation_id: int, user: User | None, conversation: Conversation | None):
+    firebase_uid = g.firebase_uid
     if not user:
-        current_app.logger.warning(f"GET /history/{conversation_id} - No user found in DB for UID: {firebase_uid}")
+        current_app.logger.warning("GET /history/%s - No user found in DB for UID: %s", conversation_id, firebase_uid)
         return jsonify({"error": "User not found."}), 404
-    conversation = db.session.scalars(
-        db.select(Conversation)
-        .filter_by(id=conversation_id, user_id=user.id)
-    ).first()
+    cached_response = cached_history_response(user, f"conversation-{conversation_id}")
+    if cached_response is not None:
+        return cached_response
     if not conversation:
         current_app.logger.warning(
-            f"GET /history/{conversation_id} - Conversation not found or not owned by user UID: {firebase_uid}")
+            "GET /history/%s - Conversation not found or not owned by user UID: %s",
+            conversation_id, firebase_uid)
         return jsonify({"error": "Conversation not found or access denied."}), 404
-    messages = db.session.scalars(
-        db.select(Message)
-        .filter_by(conversation_id=conversation.id)
-        .order_by(Message.timestamp.asc())
-    ).all()
-    message_list = [
-        {"role": msg.role, "content": msg.content, "timestamp": msg.timestamp.isoformat()}
-        for msg in messages
-    ]
+    # Transparently decompressed when the conversation has been archived
+    messages = conversation_messages(conversation)
+    with observe_stage('serialization'):
+        # Datetimes are left to the JSON provider, which formats them like isoformat() in C
+        message_list = [
+            {"role": msg["role"], "content": msg["content"], "timestamp": msg["timestamp"]}
+            for msg in messages
+        ]
+        response = store_history_response(user, f"conversation-{conversation_id}",
+                                          {"messages": message_list, "persona_id": conversation.persona_id})
     current_app.logger.info(
-        f"GET /history/{conversation_id} - Returning {len(message_list)} messages for user UID: {firebase_uid}")
-    return jsonify({"messages": message_list, "persona_id": conversation.persona_id})
+        "GET /history/%s - Returning %s messages for user UID: %s",
+        conversation_id, len(message_list), firebase_uid)
+    return response
 
 
 # --- End Get Specific Conversation ---
@@ -298,107 +414,263 @@ def get_conversation_messages(conversation_id: int):
 
 # --- NEW: Delete Specific Conversation ---
 @dialogue_bp.route('/history/<int:conversation_id>', methods=['DELETE'])
+@query_budget(6)
 @limiter.limit("10 per minute")
-def delete_conversation(conversation_id: int):
+# Email verification isn't required to delete, only a valid token
+@authenticated(verified_email=False, load_conversation=True)
+def delete_conversation(conversation_id: int, user: User | None, conversation: Conversation | None):
     """Deletes a specific conversation and its messages for the authenticated user."""
-    decoded_token = verify_token()
-    current_app.logger.info(f'token content:  {decoded_token}')
-    if not decoded_token:
-        current_app.logger.warning(f"DELETE /history/{conversation_id} - Unauthorized: Missing or invalid token.")
-        return jsonify({"error": "Authorization required: Invalid or missing token."}), 401
-
-    firebase_uid = decoded_token.get('uid')
-    # Email verification might not be strictly necessary for deletion, but ensure user is authenticated
-    if not firebase_uid:
-        current_app.logger.warning(f"DELETE /history/{conversation_id} - Unauthorized: Invalid token payload.")
-        return jsonify({"error": "Invalid token payload."}), 401
-
-    user = db.session.scalars(db.select(User).filter_by(firebase_uid=firebase_uid)).first()
+    firebase_uid = g.firebase_uid
     if not user:
-        current_app.logger.warning(f"DELETE /history/{conversation_id} - User not found in DB for UID: {firebase_uid}")
+        current_app.logger.warning(
+            "DELETE /history/%s - User not found in DB for UID: %s",
+            conversation_id, firebase_uid)
         # Even if user record doesn't exist, the conversation definitely won't belong to them
         return jsonify({"error": "User not found or conversation access denied."}), 403  # Or 404
 
-    conversation_to_delete = db.session.scalars(
-        db.select(Conversation)
-        .filter_by(id=conversation_id, user_id=user.id)  # Crucial: Ensure user owns the conversation
-    ).first()
-
-    if not conversation_to_delete:
+    if not conversation:
         current_app.logger.warning(
-            f"DELETE /history/{conversation_id} - Conversation not found or not owned by user UID: {firebase_uid}")
+            "DELETE /history/%s - Conversation not found or not owned by user UID: %s",
+            conversation_id, firebase_uid)
         return jsonify({"error": "Conversation not found or access denied."}), 404
 
     try:
         current_app.logger.info(
-            f"DELETE /history/{conversation_id} - Deleting conversation ID: {conversation_id} for user UID: {firebase_uid}")
-        db.session.delete(conversation_to_delete)
-        db.session.commit()
+            "DELETE /history/%s - Deleting conversation ID: %s for user UID: %s",
+            conversation_id, conversation_id, firebase_uid)
+        record_tombstones(user.id, [conversation_id])
+        db.session.delete(conversation)
+        bump_history_version(user.id)
+        with observe_stage('db_commit'):
+            db.session.commit()
+        invalidate_history_cache(user.id)
         current_app.logger.info(
-            f"DELETE /history/{conversation_id} - Successfully deleted conversation ID: {conversation_id}")
+            "DELETE /history/%s - Successfully deleted conversation ID: %s",
+            conversation_id, conversation_id, extra=NO_SAMPLE)
         return jsonify({"message": "Conversation deleted successfully."}), 200  # Or 204 No Content
     except Exception as e:
         db.session.rollback()
-        current_app.logger.error(f"DELETE /history/{conversation_id} - Error deleting conversation: {e}", exc_info=True)
+        current_app.logger.error(
+            "DELETE /history/%s - Error deleting conversation: %s",
+            conversation_id, e, exc_info=True)
         return jsonify({"error": "Failed to delete conversation."}), 500
 # --- End Delete Specific Conversation ---
 
 
-# --- NEW: Update Conversation Title ---
-@dialogue_bp.route('/history/<int:conversation_id>', methods=['PATCH'])
-@limiter.limit("10 per minute")
-def update_conversation_title(conversation_id: int):
-    """Updates the title of a specific conversation for the authenticated user."""
-    decoded_token = verify_token()
-    if not decoded_token:
-        current_app.logger.warning(f"PATCH /history/{conversation_id} - Unauthorized: Missing or invalid token.")
-        return jsonify({"error": "Authorization required: Invalid or missing token."}), 401
-
-    firebase_uid = decoded_token.get('uid')
-    if not firebase_uid:
-        current_app.logger.warning(f"PATCH /history/{conversation_id} - Unauthorized: Invalid token payload.")
-        return jsonify({"error": "Invalid token payload."}), 401
+# --- Delete All Conversations ---
+@dialogue_bp.route('/history', methods=['DELETE'])
+@query_budget(6)
+@limiter.limit("5 per minute")
+@authenticated(verified_email=False)
+def delete_all_conversations(user: User | None):
+    """Deletes every conversation (and, via ON DELETE CASCADE, every message) for the authenticated user."""
+    firebase_uid = g.firebase_uid
+    if not user:
+        # Nothing stored for this user, so there is nothing to clear
+        return jsonify({"message": "All conversations deleted successfully.", "deleted": 0}), 200
 
-    # Get JSON data from request and validate with Pydantic
     try:
-        raw_data = request.get_json()
-        if not raw_data:
-            current_app.logger.warning(f"PATCH /history/{conversation_id} - Bad request: Missing request body.")
-            return jsonify({"error": "Missing request body."}), 400
-        
-        data = ConversationTitleUpdateSchema(**raw_data)
-        new_title = data.title
+        record_tombstones(user.id)
+        result = db.session.execute(
+            db.delete(Conversation).where(Conversation.user_id == user.id),
+            execution_options={"synchronize_session": False},
+        )
+        bump_history_version(user.id)
+        with observe_stage('db_commit'):
+            db.session.commit()
+        invalidate_history_cache(user.id)
+        memory = get_memory_service()
+        if memory:
+            memory.forget(user.id)
+        current_app.logger.info("DELETE /history - Deleted %s conversations for user UID: %s",
+                                result.rowcount, firebase_uid, extra=NO_SAMPLE)
+        return jsonify({"message": "All conversations deleted successfully.", "deleted": result.rowcount}), 200
     except Exception as e:
-        current_app.logger.warning(f"PATCH /history/{conversation_id} - Validation error: {str(e)}")
-        return jsonify({"error": f"Invalid title data: {str(e)}"}), 400
+        db.session.rollback()
+        current_app.logger.error("DELETE /history - Error deleting conversations: %s", e, exc_info=True)
+        return jsonify({"error": "Failed to delete conversations."}), 500
+# --- End Delete All Conversations ---
+
+
+# --- Full-Text History Search ---
+@dialogue_bp.route('/history/search', methods=['GET'])
+@query_budget(3)
+@limiter.limit("30 per minute")
+@authenticated()
+def search_conversations(user: User | None):
+    """
+    Ranked full-text search over the user's messages and conversation titles.
+
+    Query params:
+    - q: search text (required)
+    - page: 1-based page number (default 1)
+    - per_page: results per page (default 20, max 50)
+    """
+    firebase_uid = g.firebase_uid
+    query = (request.args.get('q') or '').strip()
+    if not query or len(query) > MAX_QUERY_LENGTH:
+        return jsonify({"error": f"Query parameter 'q' is required (max {MAX_QUERY_LENGTH} characters)."}), 400
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 20, type=int)
+    if page < 1 or not 1 <= per_page <= 50:
+        return jsonify({"error": "Invalid pagination parameters."}), 400
 
-    user = db.session.scalars(db.select(User).filter_by(firebase_uid=firebase_uid)).first()
     if not user:
-        current_app.logger.warning(f"PATCH /history/{conversation_id} - User not found in DB for UID: {firebase_uid}")
-        return jsonify({"error": "User not found or conversation access denied."}), 403
+        return jsonify({"results": [], "page": page, "per_page": per_page, "has_more": False})
 
-    conversation_to_update = db.session.scalars(
-        db.select(Conversation)
-        .filter_by(id=conversation_id, user_id=user.id)  # Ensure user owns the conversation
-    ).first()
+    try:
+        # Fetch one extra row to know whether another page exists
+        hits = search_history(user.id, query, limit=per_page + 1, offset=(page - 1) * per_page)
+    except SearchNotSupportedError as e:
+        current_app.logger.error("GET /history/search - No full-text index for database dialect %s", e)
+        return jsonify({"error": "Search is not available."}), 501
+
+    with observe_stage('serialization'):
+        results = [
+            {"type": hit["kind"], "conversation_id": hit["conversation_id"], "message_id": hit["message_id"],
+             "title": hit["title"], "persona_id": hit["persona_id"], "role": hit["role"],
+             "snippet": hit["snippet"], "rank": hit["rank"],
+             "timestamp": hit["timestamp"] or hit["updated_at"]}
+            for hit in hits[:per_page]
+        ]
+        response = jsonify({"results": results, "page": page, "per_page": per_page,
+                            "has_more": len(hits) > per_page})
+    current_app.logger.info("GET /history/search - Returning %s results for user UID: %s", len(results), firebase_uid)
+    return response
+# --- End Full-Text History Search ---
+
+
+# --- History Export ---
+@dialogue_bp.route('/history/export', methods=['GET'])
+@query_budget(2)  # Before streaming starts; the export itself is not counted
+@limiter.limit("5 per hour")
+@authenticated()
+def export_history(user: User | None):
+    """
+    Streams every conversation and message of the user as NDJSON (one JSON object per line).
+
+    Query params:
+    - format: "ndjson" (default) or "ndjson.gz" for gzip-compressed output
+    """
+    firebase_uid = g.firebase_uid
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unsupported format. Use one of: {', '.join(EXPORT_FORMATS)}."}), 400
+
+    if not user:
+        return jsonify({"error": "User not found."}), 404
+
+    current_app.logger.info("GET /history/export - Starting %s export for user UID: %s", export_format, firebase_uid)
+    filename = f"cogito-history-{datetime.now(timezone.utc).strftime('%Y%m%d')}.{export_format}"
+    return Response(
+        stream_with_context(generate_history_export(user.id, export_format)),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"},
+    )
+# --- End History Export ---
 
-    if not conversation_to_update:
+
+# --- Incremental Sync ---
+@dialogue_bp.route('/sync', methods=['GET'])
+@query_budget(5)
+@limiter.limit("30 per minute")
+@authenticated()
+def sync_history(user: User | None):
+    """
+    Returns conversations, messages and deleted conversation ids changed after ``since``.
+
+    Query params:
+    - since: cursor from the previous response (omit for a full sync)
+
+    Clients should upsert by id: the window trails real time slightly, so the last few
+    changes may be delivered twice. Messages of archived conversations are not included;
+    load those with GET /history/<id> when the conversation is opened.
+    Repeat with the returned cursor while has_more is true.
+    """
+    firebase_uid = g.firebase_uid
+    try:
+        since, after_message_id = decode_cursor(request.args.get('since'))
+    except CursorError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if not user:
+        return jsonify({"conversations": [], "messages": [], "deleted_conversation_ids": [],
+                        "cursor": request.args.get('since') or "0", "has_more": False})
+
+    try:
+        changes = collect_changes(
+            user.id, since,
+            page_size=current_app.config.get('SYNC_PAGE_SIZE', 500),
+            lag_seconds=current_app.config.get('SYNC_LAG_SECONDS', 2.0),
+            retention_days=current_app.config.get('SYNC_TOMBSTONE_RETENTION_DAYS', 90),
+            after_message_id=after_message_id,
+        )
+    except CursorExpiredError:
+        return jsonify({"error": "Sync cursor has expired. Discard local history and sync from scratch.",
+                        "code": "CURSOR_EXPIRED"}), 410
+
+    with observe_stage('serialization'):
+        response = jsonify({
+            "conversations": [conversation_summary(conv) for conv in changes["conversations"]],
+            "messages": [
+                {"id": msg.id, "conversation_id": msg.conversation_id, "role": msg.role,
+                 "content": msg.content, "timestamp": msg.timestamp}
+                for msg in changes["messages"]
+            ],
+            "deleted_conversation_ids": changes["deleted_conversation_ids"],
+            "cursor": changes["cursor"],
+            "has_more": changes["has_more"],
+        })
+    current_app.logger.info(
+        "GET /sync - Returning %s conversations, %s messages, %s deletes for user UID: %s",
+        len(changes["conversations"]), len(changes["messages"]), len(changes["deleted_conversation_ids"]),
+        firebase_uid)
+    return response
+# --- End Incremental Sync ---
+
+
+# --- NEW: Update Conversation Title ---
+@dialogue_bp.route('/history/<int:conversation_id>', methods=['PATCH'])
+@query_budget(5)
+@limiter.limit("10 per minute")
+@authenticated(verified_email=False, load_conversation=True)
+@json_body(ConversationTitleUpdateSchema, error="Invalid title data")
+def update_conversation_title(conversation_id: int, user: User | None, conversation: Conversation | None,
+                              body: ConversationTitleUpdateSchema):
+    """Updates the title of a specific conversation for the authenticated user."""
+    firebase_uid = g.firebase_uid
+    new_title = body.title
+    if not user:
         current_app.logger.warning(
-            f"PATCH /history/{conversation_id} - Conversation not found or not owned by user UID: {firebase_uid}")
+            "PATCH /history/%s - User not found in DB for UID: %s",
+            conversation_id, firebase_uid)
+        return jsonify({"error": "User not found or conversation access denied."}), 403
+
+    if not conversation:
+        current_app.logger.warning(
+            "PATCH /history/%s - Conversation not found or not owned by user UID: %s",
+            conversation_id, firebase_uid)
         return jsonify({"error": "Conversation not found or access denied."}), 404
 
     try:
         current_app.logger.info(
-            f"PATCH /history/{conversation_id} - Updating title for conversation ID: {conversation_id}, User UID: {firebase_uid}")
-        conversation_to_update.title = new_title
-        conversation_to_update.updated_at = datetime.now(timezone.utc)
-        db.session.commit()
+            "PATCH /history/%s - Updating title for conversation ID: %s, User UID: %s",
+            conversation_id, conversation_id, firebase_uid)
+        conversation.title = new_title
+        conversation.updated_at = datetime.now(timezone.utc)
+        bump_history_version(user.id)
+        with observe_stage('db_commit'):
+            db.session.commit()
+        invalidate_history_cache(user.id)
         current_app.logger.info(
-            f"PATCH /history/{conversation_id} - Successfully updated title for conversation ID: {conversation_id}")
+            "PATCH /history/%s - Successfully updated title for conversation ID: %s",
+            conversation_id, conversation_id)
         return jsonify({"message": "Conversation title updated successfully."}), 200
     except Exception as e:
         db.session.rollback()
-        current_app.logger.error(f"PATCH /history/{conversation_id} - Error updating conversation title: {e}", exc_info=True)
+        current_app.logger.error(
+            "PATCH /history/%s - Error updating conversation title: %s",
+            conversation_id, e, exc_info=True)
         return jsonify({"error": "Failed to update conversation title."}), 500
 # --- End Update Conversation Title ---
 
@@ -0,0 +1,256 @@
+# backend/app/dialogue/websocket.py
+# WebSocket dialogue sessions: authenticate once, then stream any number of turns
+
+import time
+from flask import current_app
+from flask_limiter.util import get_remote_address
+from limits import parse
+from openai import OpenAIError
+from pydantic import ValidationError
+from simple_websocket import ConnectionClosed
+from ..auth.utils import verify_token, verify_id_token
+from ..extensions import db, limiter, sock
+from ..models import Conversation
+from ..services.admission_service import admit, caller_priority, long_request_slot, AdmissionRejected, PRIORITY_GUEST
+from ..services.archive_service import conversation_messages
+from ..services.dialogue_service import persona_system_prompt, recall_memory, save_turn
+from ..services.metrics_service import observe_stage, record_openai_usage, OPENAI_REQUEST_SECONDS, OPENAI_TTFT_SECONDS, RATE_LIMITED_TOTAL
+from .routes import dialogue_bp, get_or_create_user, MessageSchema, DIALOGUE_RATE_LIMIT, DIALOGUE_RATE_SCOPE
+
+# The bucket POST /api/dialogue uses: a client has one budget of turns across both transports
+TURN_RATE_LIMIT = parse(DIALOGUE_RATE_LIMIT)
+# WebSocket close code for "try again later", sent when the worker has no session slot free
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+class DialogueSession:
+    """
+    State for one WebSocket connection.
+
+    Client frames (JSON):
+    - {"type": "auth", "token": "<Firebase ID token>"}: required first unless the upgrade request
+      carried an Authorization header; send again to refresh an expiring token.
+    - {"type": "start", "conversation_id": 12, "persona_id": "kant"}: optional; continue an existing
+      conversation (its recent messages are loaded once) or pick a persona for a new one.
+    - {"type": "message", "content": "..."}: one user turn. Only the new message is sent; the
+      session keeps the history.
+    - {"type": "ping"}
+
+    Server frames: "ready", "token" (streamed content deltas), "done", "pong" and "error"
+    (with "retry_after" seconds when the turn was shed under load, code OVERLOADED).
+    """
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.user_id: int | None = None
+        self.firebase_uid: str | None = None
+        self.token_expires_at: float = 0
+        self.priority = PRIORITY_GUEST  # Admission priority, from the last token
+        self.conversation_id: int | None = None
+        self.persona_id, self.system_prompt = persona_system_prompt(None)
+        self.history: list[dict] = []
+
+    def send(self, payload: dict) -> None:
+        self.ws.send(current_app.json.dumps(payload))
+
+    def error(self, message: str, code: str) -> None:
+        self.send({"type": "error", "error": message, "code": code})
+
+    def receive(self, timeout: float) -> dict | None:
+        raw = self.ws.receive(timeout=timeout)
+        if raw is None:
+            return None
+        try:
+            frame = current_app.json.loads(raw)
+        except ValueError:
+            frame = None
+        if not isinstance(frame, dict):
+            self.error("Frames must be JSON objects.", "BAD_FRAME")
+            return {}
+        return frame
+
+    # --- Authentication ---
+    def authenticate(self, decoded_token: dict | None) -> bool:
+        if not decoded_token or not decoded_token.get('uid'):
+            self.error("Authorization required: Invalid or missing token.", "UNAUTHORIZED")
+            return False
+        if self.firebase_uid and decoded_token['uid'] != self.firebase_uid:
+            self.error("Token belongs to a different user.", "UNAUTHORIZED")
+            return False
+        if self.user_id is None:
+            with observe_stage('user_lookup'):
+                user = get_or_create_user(decoded_token['uid'], decoded_token.get('email'),
+                                          decoded_token.get('name') or decoded_token.get('displayName'))
+            if not user:
+                self.error("Could not process user information.", "USER_ERROR")
+                return False
+            self.user_id = user.id
+            self.firebase_uid = decoded_token['uid']
+        self.token_expires_at = decoded_token.get('exp') or time.time() + 3600
+        self.priority = caller_priority(decoded_token)
+        return True
+
+    def ready(self) -> None:
+        self.send({"type": "ready", "conversation_id": self.conversation_id, "persona_id": self.persona_id})
+
+    # --- Conversation selection ---
+    def start(self, frame: dict) -> None:
+        conversation_id = frame.get('conversation_id')
+        if conversation_id is None:
+            self.conversation_id, self.history = None, []
+            self.persona_id, self.system_prompt = persona_system_prompt(frame.get('persona_id'))
+            self.ready()
+            return
+        if not isinstance(conversation_id, int):
+            self.error("conversation_id must be an integer.", "BAD_FRAME")
+            return
+        conversation = db.session.scalars(
+            db.select(Conversation).filter_by(id=conversation_id, user_id=self.user_id)
+        ).first()
+        if not conversation:
+            self.error("Conversation not found or access denied.", "NOT_FOUND")
+            return
+        recent = conversation_messages(conversation, limit=current_app.config.get('MAX_HISTORY_MSGS', 20))
+        self.conversation_id = conversation.id
+        self.persona_id, self.system_prompt = persona_system_prompt(conversation.persona_id)
+        self.history = [{"role": msg["role"], "content": msg["content"]} for msg in recent]
+        db.session.commit()  # Don't hold a transaction open while the client is idle
+        self.ready()
+
+    # --- Turns ---
+    def turn(self, frame: dict) -> None:
+        if time.time() >= self.token_expires_at:
+            self.error("Token expired. Send a fresh auth frame.", "TOKEN_EXPIRED")
+            return
+        try:
+            content = MessageSchema(role='user', content=frame.get('content')).content
+        except ValidationError as e:
+            self.error(f"Invalid message: {e.errors()[0]['msg']}", "BAD_FRAME")
+            return
+        if not limiter.limiter.hit(TURN_RATE_LIMIT, get_remote_address(), DIALOGUE_RATE_SCOPE):
+            RATE_LIMITED_TOTAL.labels('dialogue.ws').inc()
+            self.error("Rate limit exceeded. Try again shortly.", "RATE_LIMITED")
+            return
+        client = current_app.openai_client
+        if not client:
+            self.error("OpenAI client not initialized.", "UNAVAILABLE")
+            return
+        if not self.system_prompt:
+            self.error("Internal server error: Persona configuration issue.", "SERVER_ERROR")
+            return
+
+        max_history = current_app.config.get('MAX_HISTORY_MSGS', 20)
+        history = (self.history + [{"role": "user", "content": content}])[-max_history:]
+        messages_for_openai = [{"role": "system", "content": self.system_prompt}]
+        query_vector, memory_context = recall_memory(self.user_id, content, exclude_conversation_id=self.conversation_id,
+                                                     priority=self.priority)
+        if memory_context:
+            messages_for_openai.append({"role": "system", "content": memory_context})
+        messages_for_openai.extend(history)
+
+        model = current_app.config.get('OPENAI_MODEL', 'gpt-4-turbo')
+        parts, usage, ttft = [], None, None
+        try:
+            with admit('chat', self.priority):
+                start = time.perf_counter()
+                stream = client.chat.completions.create(
+                    model=model,
+                    messages=messages_for_openai,
+                    temperature=current_app.config.get('OPENAI_TEMPERATURE', 0.7),
+                    max_tokens=current_app.config.get('OPENAI_MAX_TOKENS', 256),
+                    user=self.firebase_uid,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+                for chunk in stream:
+                    if chunk.usage is not None:
+                        usage = chunk.usage
+                    if not chunk.choices or not chunk.choices[0].delta.content:
+                        continue
+                    if not parts:
+                        ttft = time.perf_counter() - start
+                        OPENAI_TTFT_SECONDS.labels(model).observe(ttft)
+                    parts.append(chunk.choices[0].delta.content)
+                    self.send({"type": "token", "content": parts[-1]})
+                latency = time.perf_counter() - start
+                OPENAI_REQUEST_SECONDS.labels('chat_stream', model).observe(latency)
+            record_openai_usage(model, usage)
+        except AdmissionRejected as e:
+            self.send({"type": "error", "error": "The AI service is busy. Please try again shortly.",
+                       "code": "OVERLOADED", "retry_after": e.retry_after})
+            return
+        except OpenAIError as e:
+            current_app.logger.error("WS /dialogue - OpenAI API Error for user %s: %s", self.user_id, e, exc_info=True)
+            self.error("Error communicating with AI service.", "UPSTREAM_ERROR")
+            return
+
+        ai_response_content = "".join(parts).strip()
+        if not ai_response_content:
+            self.error("The AI service returned an empty response.", "UPSTREAM_ERROR")
+            return
+        try:
+            conversation = save_turn(self.user_id, self.conversation_id, self.persona_id, content,
+                                     ai_response_content, usage=usage, query_vector=query_vector,
+                                     model=model, latency=latency, ttft=ttft)
+            self.conversation_id = conversation.id
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error("WS /dialogue - Failed to save history for user %s: %s", self.user_id, e,
+                                     exc_info=True)
+        self.history = (history + [{"role": "assistant", "content": ai_response_content}])[-max_history:]
+        self.send({"type": "done", "conversation_id": self.conversation_id, "persona_id": self.persona_id})
+
+
+@sock.route('/dialogue/ws', bp=dialogue_bp)
+def dialogue_socket(ws):
+    """Persistent dialogue session; see DialogueSession for the frame protocol."""
+    with long_request_slot('websocket') as admitted:
+        if not admitted:
+            try:
+                ws.close(CLOSE_TRY_AGAIN_LATER, "Too many open sessions. Try again later or use POST /api/dialogue.")
+            except ConnectionClosed:
+                pass
+            return
+        _run_session(ws)
+
+
+def _run_session(ws) -> None:
+    session = DialogueSession(ws)
+    idle_timeout = current_app.config.get('WS_IDLE_TIMEOUT_SECONDS', 300)
+    try:
+        header_token = verify_token()
+        if header_token:
+            if not session.authenticate(header_token):
+                return
+        else:
+            frame = session.receive(timeout=current_app.config.get('WS_AUTH_TIMEOUT_SECONDS', 10))
+            if not frame or frame.get('type') != 'auth':
+                session.error("Authorization required: send an auth frame first.", "UNAUTHORIZED")
+                return
+            if not session.authenticate(verify_id_token(frame.get('token'))):
+                return
+        current_app.logger.info("WS /dialogue - Session opened for user %s", session.user_id)
+        session.ready()
+
+        while True:
+            frame = session.receive(timeout=idle_timeout)
+            if frame is None:
+                session.error("Session closed after inactivity.", "IDLE_TIMEOUT")
+                break
+            frame_type = frame.get('type')
+            if frame_type == 'message':
+                session.turn(frame)
+            elif frame_type == 'start':
+                session.start(frame)
+            elif frame_type == 'auth':
+                if session.authenticate(verify_id_token(frame.get('token'))):
+                    session.ready()
+            elif frame_type == 'ping':
+                session.send({"type": "pong"})
+            elif frame:
+                session.error(f"Unknown frame type: {frame_type}", "BAD_FRAME")
+    except ConnectionClosed:
+        pass
+    finally:
+        db.session.remove()
+        current_app.logger.info("WS /dialogue - Session closed for user %s", session.user_id)
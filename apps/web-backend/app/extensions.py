@@ -6,13 +6,21 @@ from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from flask_sock import Sock
+from flask_talisman import Talisman
+from .sharding import RoutingSession
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import sqlite3
 
 # Create extension instances without initializing them with the app yet
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})  # Routes conversation data when sharded
 cors = CORS()  # CORS instance
 migrate = Migrate()
 bcrypt = Bcrypt()
 jwt = JWTManager()
+sock = Sock()  # WebSocket routes (see app/dialogue/websocket.py)
+talisman = Talisman()  # Security headers; also used as a per-view decorator
 
 # Rate limiter - will be initialized in app/__init__.py
 limiter = Limiter(
@@ -20,3 +28,12 @@ limiter = Limiter(
     default_limits=["200 per day", "50 per hour"],
     storage_uri="memory://",
 )
+
+
+# SQLite ignores ON DELETE CASCADE unless foreign keys are switched on per connection
+@event.listens_for(Engine, "connect")
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
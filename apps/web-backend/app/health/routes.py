@@ -0,0 +1,26 @@
+from flask import Blueprint, jsonify
+from app.extensions import limiter, talisman
+from app.services.health_service import readiness
+
+# Create blueprint
+health_bp = Blueprint('health', __name__, url_prefix='/healthz')
+
+
+@health_bp.route('/live', methods=['GET'])
+@limiter.exempt
+@talisman(force_https=False)  # Probes come from the platform over plain HTTP
+def live():
+    """Liveness probe: the worker is up and serving requests. Checks no dependencies."""
+    return jsonify({"status": "ok"})
+
+
+@health_bp.route('/ready', methods=['GET'])
+@limiter.exempt
+@talisman(force_https=False)
+def ready():
+    """
+    Readiness probe: 200 while the database answers within HEALTH_DB_MAX_LATENCY_MS, else 503.
+    The body reports per-dependency latency and the worker's warm-up results.
+    """
+    is_ready, report = readiness()
+    return jsonify(report), 200 if is_ready else 503
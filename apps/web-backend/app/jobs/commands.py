@@ -0,0 +1,41 @@
+# backend/app/jobs/commands.py
+# `flask jobs ...` commands for the background job queue
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from prometheus_client import start_http_server
+from ..services.job_service import run_worker, queue_stats, prune_finished_jobs
+from ..services import archive_service, title_service, transcription_service  # noqa: F401 - register job handlers
+
+jobs_cli = AppGroup('jobs', help="Background job queue.")
+
+
+@jobs_cli.command('worker')
+@click.option('--poll-interval', type=float, default=None,
+              help="Seconds to wait when the queue is empty (default: JOB_POLL_INTERVAL_SECONDS).")
+@click.option('--burst', is_flag=True, help="Exit once the queue is empty instead of waiting for more jobs.")
+@click.option('--metrics-port', type=int, default=None, help="Serve Prometheus metrics for this worker on this port.")
+def worker_command(poll_interval, burst, metrics_port):
+    """Run queued jobs until stopped."""
+    if metrics_port:
+        start_http_server(metrics_port)
+    run_worker(poll_interval or current_app.config.get('JOB_POLL_INTERVAL_SECONDS', 1.0), burst=burst)
+
+
+@jobs_cli.command('stats')
+def stats_command():
+    """Show job counts by kind and status."""
+    rows = queue_stats()
+    if not rows:
+        click.echo("No jobs.")
+    for kind, status, count in rows:
+        click.echo(f"{kind:<30} {status:<10} {count}")
+
+
+@jobs_cli.command('prune')
+@click.option('--days', type=int, default=None, help="Keep finished jobs this many days (default: JOB_RETENTION_DAYS).")
+def prune_command(days):
+    """Delete finished jobs older than the retention period."""
+    deleted = prune_finished_jobs(days if days is not None else current_app.config.get('JOB_RETENTION_DAYS', 7))
+    click.echo(f"Deleted {deleted} finished jobs.")
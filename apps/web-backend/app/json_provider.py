@@ -0,0 +1,37 @@
+import decimal
+import orjson
+from flask.json.provider import JSONProvider
+
+_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj):
+    # Types orjson doesn't handle natively (datetimes, dataclasses, UUIDs and enums it does)
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(JSONProvider):
+    """
+    JSON provider backed by orjson. Serializes datetimes natively (RFC 3339, the same text as
+    ``isoformat()``), so payloads can hold datetime objects instead of pre-formatted strings.
+    Keys are not sorted and output is always compact.
+    """
+
+    mimetype = "application/json"
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=_default, option=_OPTIONS).decode('utf-8')
+
+    def dumps_bytes(self, obj) -> bytes:
+        return orjson.dumps(obj, default=_default, option=_OPTIONS)
+
+    def loads(self, s: str | bytes, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj), mimetype=self.mimetype)
@@ -0,0 +1,190 @@
+# backend/app/logging_setup.py
+# Structured, sampled, non-blocking logging for the Flask app
+
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from flask import g, has_request_context, request
+from flask.logging import default_handler
+
+# Pass as ``extra=NO_SAMPLE`` for INFO/DEBUG lines that must never be dropped by sampling
+NO_SAMPLE = {'sample': False}
+
+REDACTED = '[REDACTED]'
+_EMAIL_RE = re.compile(r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+')
+_BEARER_RE = re.compile(r'(Bearer\s+)\S+', re.IGNORECASE)
+_JWT_RE = re.compile(r'eyJ[\w-]+\.[\w-]+\.[\w-]+')
+_REQUEST_ID_RE = re.compile(r'^[\w.-]{1,128}$')
+_SENSITIVE_KEYS = {'email', 'token', 'id_token', 'decoded_token', 'authorization', 'password', 'api_key'}
+
+# Attributes present on every LogRecord; anything else was passed through ``extra``
+_RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {
+    'message', 'asctime', 'request_id', 'uid', 'sample',
+}
+
+_listener: QueueListener | None = None
+
+
+def redact(text: str) -> str:
+    """Mask e-mail addresses, bearer tokens and JWTs in a log message."""
+    text = _BEARER_RE.sub(r'\1' + REDACTED, text)
+    text = _JWT_RE.sub(REDACTED, text)
+    return _EMAIL_RE.sub(REDACTED, text)
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamps records with the current request id and Firebase UID (runs in the request thread)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if has_request_context():
+            record.request_id = getattr(g, 'request_id', None)
+            record.uid = getattr(g, 'firebase_uid', None)
+        else:
+            record.request_id = None
+            record.uid = None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a fraction of records at the configured levels.
+
+    Levels without a rate (WARNING and above by default) are always kept, as are
+    records logged with ``extra=NO_SAMPLE``.
+    """
+
+    def __init__(self, rates: dict[int, float]):
+        super().__init__()
+        self.rates = {level: rate for level, rate in rates.items() if rate < 1.0}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.levelno)
+        if rate is None or getattr(record, 'sample', True) is False:
+            return True
+        return random.random() < rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread with only their message interpolated.
+
+    The message is rendered in the caller's thread, as the stock QueueHandler does,
+    because the arguments may be ORM objects or dicts that change (or can no longer be
+    loaded) by the time the listener runs. Redaction and JSON encoding are still deferred
+    to the listener. If the queue is full the record is dropped rather than blocking
+    the request.
+    """
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """Renders a record as a single redacted JSON line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': redact(record.getMessage()),
+        }
+        if getattr(record, 'request_id', None):
+            payload['request_id'] = record.request_id
+        if getattr(record, 'uid', None):
+            payload['uid'] = record.uid
+        for key, value in record.__dict__.items():
+            if key in _RESERVED_ATTRS or key.startswith('_'):
+                continue
+            if key in _SENSITIVE_KEYS:
+                value = REDACTED
+            elif isinstance(value, str):
+                value = redact(value)
+            payload[key] = value
+        if record.exc_info:
+            payload['exc_info'] = redact(self.formatException(record.exc_info))
+        return json.dumps(payload, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable format for local development, with the same redaction."""
+
+    def __init__(self):
+        super().__init__('[%(asctime)s] %(levelname)s in %(module)s: %(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        return redact(super().format(record))
+
+
+def configure_logging(app) -> None:
+    """
+    Route the app's loggers through a bounded queue to a background listener thread.
+
+    Every module logger under the ``app`` package (``current_app.logger`` and
+    ``logging.getLogger(__name__)``) shares the same handler.
+    """
+    global _listener
+
+    level = logging.getLevelName(app.config.get('LOG_LEVEL', 'INFO').upper())
+    app.logger.setLevel(level)
+    app.logger.removeHandler(default_handler)
+    app.logger.propagate = False
+
+    if _listener is None:
+        stream_handler = logging.StreamHandler(sys.stdout)
+        if app.config.get('LOG_FORMAT', 'json') == 'json':
+            stream_handler.setFormatter(JsonFormatter())
+        else:
+            stream_handler.setFormatter(TextFormatter())
+        log_queue = queue.Queue(maxsize=app.config.get('LOG_QUEUE_SIZE', 10000))
+        _listener = QueueListener(log_queue, stream_handler)
+        _listener.start()
+        atexit.register(_listener.stop)
+    else:
+        log_queue = _listener.queue
+
+    if not any(isinstance(h, NonBlockingQueueHandler) for h in app.logger.handlers):
+        queue_handler = NonBlockingQueueHandler(log_queue)
+        queue_handler.addFilter(SamplingFilter({
+            logging.DEBUG: app.config.get('LOG_DEBUG_SAMPLE_RATE', 1.0),
+            logging.INFO: app.config.get('LOG_INFO_SAMPLE_RATE', 1.0),
+        }))
+        queue_handler.addFilter(RequestContextFilter())
+        app.logger.addHandler(queue_handler)
+
+    @app.before_request
+    def _assign_request_id():
+        incoming_id = request.headers.get('X-Request-ID', '')
+        g.request_id = incoming_id if _REQUEST_ID_RE.match(incoming_id) else uuid.uuid4().hex
+        g.log_request_start = time.perf_counter()
+
+    @app.after_request
+    def _log_request(response):
+        response.headers['X-Request-ID'] = g.get('request_id', '')
+        start = g.get('log_request_start')
+        latency_ms = round((time.perf_counter() - start) * 1000, 2) if start is not None else None
+        app.logger.info(
+            '%s %s %s', request.method, request.path, response.status_code,
+            extra={'method': request.method, 'path': request.path,
+                   'status': response.status_code, 'latency_ms': latency_ms})
+        return response
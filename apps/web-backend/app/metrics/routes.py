@@ -0,0 +1,29 @@
+import hmac
+from flask import Blueprint, Response, request, current_app, jsonify
+from app.extensions import limiter
+from app.services.metrics_service import generate_metrics
+
+# Create blueprint
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+@limiter.exempt
+def metrics():
+    """
+    Prometheus scrape endpoint
+
+    If METRICS_AUTH_TOKEN is configured, the scraper must send it as a Bearer token.
+    With METRICS_REQUIRE_AUTH (production) the endpoint is not served at all without one.
+    """
+    expected_token = current_app.config.get('METRICS_AUTH_TOKEN')
+    if not expected_token and current_app.config.get('METRICS_REQUIRE_AUTH', False):
+        return jsonify({'error': 'Not found'}), 404
+    if expected_token:
+        auth_header = request.headers.get('Authorization', '')
+        provided_token = auth_header[len('Bearer '):] if auth_header.startswith('Bearer ') else ''
+        if not hmac.compare_digest(provided_token, expected_token):
+            return jsonify({'error': 'Unauthorized'}), 401
+
+    payload, content_type = generate_metrics()
+    return Response(payload, content_type=content_type)
@@ -3,6 +3,9 @@
 
 from .extensions import db # Assuming db = SQLAlchemy() is initialized in extensions.py
 from datetime import datetime, timezone
+from sqlalchemy import DDL, event
+
+LAST_MESSAGE_PREVIEW_LENGTH = 200
 
 # --- User Model ---
 class User(db.Model):
@@ -13,8 +16,11 @@ class User(db.Model):
     # --- Add timezone=True ---
     created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
     # --- End Change ---
+    # Bumped on every change to the user's conversations; used for history ETags and cache invalidation
+    history_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
-    conversations = db.relationship('Conversation', backref='user', lazy='dynamic', cascade="all, delete-orphan")
+    # passive_deletes: the database's ON DELETE CASCADE removes children, so the ORM never loads them to delete
+    conversations = db.relationship('Conversation', backref='user', lazy='dynamic', cascade="all, delete-orphan", passive_deletes=True)
 
     def __repr__(self):
         return f'<User {self.firebase_uid}>'
@@ -23,15 +29,28 @@ class User(db.Model):
 # --- Conversation Model ---
 class Conversation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False, index=True)
     title = db.Column(db.String(100), nullable=True)
     persona_id = db.Column(db.String(50), nullable=False, default='socrates', index=True)
     # --- Add timezone=True ---
     created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
     updated_at = db.Column(db.DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), index=True)
     # --- End Change ---
+    # --- Denormalized stats, maintained by record_messages() in the write transaction ---
+    message_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_message_preview = db.Column(db.String(LAST_MESSAGE_PREVIEW_LENGTH), nullable=True)
+    last_role = db.Column(db.String(10), nullable=True)
+    prompt_tokens_total = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    completion_tokens_total = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Set while the messages live compressed in ConversationArchive instead of the message table
+    archived_at = db.Column(db.DateTime(timezone=True), nullable=True)
+
+    messages = db.relationship('Message', backref='conversation', lazy='dynamic', order_by='Message.timestamp', cascade="all, delete-orphan", passive_deletes=True)
 
-    messages = db.relationship('Message', backref='conversation', lazy='dynamic', order_by='Message.timestamp', cascade="all, delete-orphan")
+    # Lets GET /history read a user's most recent conversations with one index range scan
+    __table_args__ = (
+        db.Index('ix_conversation_user_id_updated_at', 'user_id', 'updated_at'),
+    )
 
     def __repr__(self):
         return f'<Conversation {self.id} by User {self.user_id}>'
@@ -39,17 +58,218 @@ class Conversation(db.Model):
     def get_message_summary(self, count=5):
         return self.messages.limit(count).all()
 
+    def record_messages(self, new_messages, prompt_tokens: int = 0, completion_tokens: int = 0):
+        """
+        Update the denormalized stats for messages added in the current transaction.
+        Counters are incremented in SQL, so concurrent turns on the same conversation don't lose updates.
+        The conversation must already be flushed.
+        """
+        last_message = new_messages[-1]
+        self.message_count = Conversation.message_count + len(new_messages)
+        self.last_message_preview = last_message.content[:LAST_MESSAGE_PREVIEW_LENGTH]
+        self.last_role = last_message.role
+        self.prompt_tokens_total = Conversation.prompt_tokens_total + (prompt_tokens or 0)
+        self.completion_tokens_total = Conversation.completion_tokens_total + (completion_tokens or 0)
+
 
 # --- Message Model ---
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False, index=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id', ondelete='CASCADE'), nullable=False, index=True)
     role = db.Column(db.String(10), nullable=False)
     content = db.Column(db.Text, nullable=False)
     # --- Add timezone=True ---
     timestamp = db.Column(db.DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc), index=True)
     # --- End Change ---
 
+    # Serves both per-conversation reads and the /sync "messages since" scan per conversation
+    __table_args__ = (
+        db.Index('ix_message_conversation_id_timestamp', 'conversation_id', 'timestamp'),
+    )
+
     def __repr__(self):
         return f'<Message {self.id} in Conv {self.conversation_id} Role {self.role}>'
 
+
+# --- Conversation Archive Model ---
+class ConversationArchive(db.Model):
+    """The messages of an idle conversation, moved out of the message table as one compressed blob."""
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id', ondelete='CASCADE'), primary_key=True)
+    codec = db.Column(db.String(10), nullable=False, default='zlib')
+    message_count = db.Column(db.Integer, nullable=False)
+    raw_size = db.Column(db.Integer, nullable=False)  # Uncompressed size, for storage reporting
+    messages_blob = db.Column(db.LargeBinary, nullable=False)
+    archived_at = db.Column(db.DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        return f'<ConversationArchive {self.conversation_id} ({self.message_count} messages)>'
+
+
+# --- Conversation Tombstone Model ---
+class ConversationTombstone(db.Model):
+    """Records a deleted conversation so /api/sync can tell offline clients to drop it."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    conversation_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        db.Index('ix_conversation_tombstone_user_id_deleted_at', 'user_id', 'deleted_at'),
+    )
+
+    def __repr__(self):
+        return f'<ConversationTombstone {self.conversation_id} for User {self.user_id}>'
+
+
+# --- Message Usage Model ---
+class MessageUsage(db.Model):
+    """
+    Token counts and upstream latency of the completion behind one assistant message.
+    A side table rather than message columns: it survives archiving (which moves messages into
+    a blob), and usage reports scan it without reading message content.
+    """
+    message_id = db.Column(db.Integer, primary_key=True)  # No foreign key, for the same reason
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id', ondelete='CASCADE'), nullable=False, index=True)
+    persona_id = db.Column(db.String(50), nullable=False)
+    model = db.Column(db.String(100), nullable=False)
+    prompt_tokens = db.Column(db.Integer, nullable=True)
+    completion_tokens = db.Column(db.Integer, nullable=True)
+    cached_tokens = db.Column(db.Integer, nullable=True)  # Prompt tokens served from OpenAI's prompt cache
+    latency_ms = db.Column(db.Integer, nullable=True)  # Whole upstream call
+    ttft_ms = db.Column(db.Integer, nullable=True)  # Time to first token; streamed turns only
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc), index=True)
+
+    def __repr__(self):
+        return f'<MessageUsage {self.message_id} ({self.model}, {self.persona_id})>'
+
+
+# --- Idempotency Record Model ---
+class IdempotencyRecord(db.Model):
+    """Stored outcome of a request sent with an Idempotency-Key header, replayed to retries."""
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(160), nullable=False)  # Firebase UID, or guest:<ip>
+    key = db.Column(db.String(255), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='in_progress')  # in_progress | completed
+    response_status = db.Column(db.Integer, nullable=True)
+    response_body = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+    expires_at = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('scope', 'key', name='uq_idempotency_record_scope_key'),
+    )
+
+    def __repr__(self):
+        return f'<IdempotencyRecord {self.key} {self.status}>'
+
+
+# --- Background Job Model ---
+class Job(db.Model):
+    """A unit of deferred work, claimed and run by `flask jobs worker` (see app/services/job_service.py)."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued | running | succeeded | failed
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    max_attempts = db.Column(db.Integer, nullable=False, default=5, server_default='5')
+    run_at = db.Column(db.DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+    locked_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    locked_by = db.Column(db.String(100), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+    finished_at = db.Column(db.DateTime(timezone=True), nullable=True)
+
+    # Workers claim the oldest due job in a status with one index range scan
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
+
+
+# --- Transcription Job Model ---
+class TranscriptionJob(db.Model):
+    """
+    An audio upload transcribed by a job worker (POST /api/transcribe?async=true). The audio is
+    kept in TRANSCRIPTION_UPLOAD_DIR, which workers share with the web service, and removed once
+    transcribed; the row is deleted along with its queue job.
+    """
+    id = db.Column(db.String(32), primary_key=True)  # Random, so knowing it is what lets a guest poll
+    job_id = db.Column(db.Integer, db.ForeignKey('job.id', ondelete='CASCADE'), nullable=False, index=True)
+    owner_uid = db.Column(db.String(128), nullable=True)  # Firebase UID of the uploader; None for guests
+    filename = db.Column(db.String(255), nullable=False)
+    suffix = db.Column(db.String(10), nullable=False)  # Extension the upload is saved with for Whisper
+    priority = db.Column(db.Integer, nullable=False)  # Admission priority of the uploader
+    audio_size = db.Column(db.Integer, nullable=False)
+    audio_path = db.Column(db.String(255), nullable=True)  # Relative to TRANSCRIPTION_UPLOAD_DIR; None once transcribed
+    transcript = db.Column(db.Text, nullable=True)
+    error_code = db.Column(db.String(30), nullable=True)  # Set when the audio itself was rejected
+    error = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+    finished_at = db.Column(db.DateTime(timezone=True), nullable=True)
+
+    job = db.relationship('Job')
+
+    def __repr__(self):
+        return f'<TranscriptionJob {self.id} (Job {self.job_id})>'
+
+
+# --- Full-text search indexes ---
+# Not mapped on the models: PostgreSQL keeps generated tsvector columns with GIN indexes, SQLite
+# keeps FTS5 tables synced by triggers. Migrations 7b1c2e9f4d30 and 9a3e5c7b1d28 create the same
+# objects; these listeners cover databases built with db.create_all() (local dev and tests).
+# Archived messages are indexed per conversation, written by archive_service when it archives
+# (their text is only in the compressed blob) and dropped with the archive row.
+POSTGRES_SEARCH_DDL = {
+    'message': [
+        "ALTER TABLE message ADD COLUMN search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('english', content)) STORED",
+        "CREATE INDEX ix_message_search_vector ON message USING GIN (search_vector)",
+    ],
+    'conversation': [
+        "ALTER TABLE conversation ADD COLUMN search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('english', coalesce(title, ''))) STORED",
+        "CREATE INDEX ix_conversation_search_vector ON conversation USING GIN (search_vector)",
+    ],
+    'conversation_archive': [
+        "ALTER TABLE conversation_archive ADD COLUMN search_vector tsvector",
+        "CREATE INDEX ix_conversation_archive_search_vector ON conversation_archive USING GIN (search_vector)",
+    ],
+}
+SQLITE_SEARCH_DDL = {
+    'message': [
+        "CREATE VIRTUAL TABLE message_fts USING fts5(content, content='message', content_rowid='id')",
+        "CREATE TRIGGER message_fts_ai AFTER INSERT ON message BEGIN "
+        "INSERT INTO message_fts(rowid, content) VALUES (new.id, new.content); END",
+        "CREATE TRIGGER message_fts_ad AFTER DELETE ON message BEGIN "
+        "INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+        "CREATE TRIGGER message_fts_au AFTER UPDATE OF content ON message BEGIN "
+        "INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+        "INSERT INTO message_fts(rowid, content) VALUES (new.id, new.content); END",
+    ],
+    'conversation': [
+        "CREATE VIRTUAL TABLE conversation_fts USING fts5(title, content='conversation', content_rowid='id')",
+        "CREATE TRIGGER conversation_fts_ai AFTER INSERT ON conversation BEGIN "
+        "INSERT INTO conversation_fts(rowid, title) VALUES (new.id, coalesce(new.title, '')); END",
+        "CREATE TRIGGER conversation_fts_ad AFTER DELETE ON conversation BEGIN "
+        "INSERT INTO conversation_fts(conversation_fts, rowid, title) VALUES ('delete', old.id, coalesce(old.title, '')); END",
+        "CREATE TRIGGER conversation_fts_au AFTER UPDATE OF title ON conversation BEGIN "
+        "INSERT INTO conversation_fts(conversation_fts, rowid, title) VALUES ('delete', old.id, coalesce(old.title, '')); "
+        "INSERT INTO conversation_fts(rowid, title) VALUES (new.id, coalesce(new.title, '')); END",
+    ],
+    'conversation_archive': [
+        "CREATE VIRTUAL TABLE conversation_archive_fts USING fts5(content)",
+        "CREATE TRIGGER conversation_archive_fts_ad AFTER DELETE ON conversation_archive BEGIN "
+        "DELETE FROM conversation_archive_fts WHERE rowid = old.conversation_id; END",
+    ],
+}
+
+for _model in (Message, Conversation, ConversationArchive):
+    _table = _model.__table__
+    for _statement in POSTGRES_SEARCH_DDL[_table.name]:
+        event.listen(_table, 'after_create', DDL(_statement).execute_if(dialect='postgresql'))
+    for _statement in SQLITE_SEARCH_DDL[_table.name]:
+        event.listen(_table, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+    event.listen(_table, 'before_drop', DDL(f"DROP TABLE IF EXISTS {_table.name}_fts").execute_if(dialect='sqlite'))
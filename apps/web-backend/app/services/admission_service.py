@@ -0,0 +1,188 @@
+import math
+import time
+import heapq
+import logging
+import itertools
+import threading
+from contextlib import contextmanager, nullcontext
+from flask import current_app, jsonify
+from app.services.metrics_service import ADMISSION_TOTAL, ADMISSION_WAIT_SECONDS, LONG_REQUESTS_REJECTED_TOTAL
+
+logger = logging.getLogger(__name__)
+
+# Lower values are served first
+PRIORITY_VERIFIED = 0  # Signed in with a verified email
+PRIORITY_SIGNED_IN = 1
+PRIORITY_GUEST = 2  # No token; OpenAI sees these as guest_session_* users
+PRIORITY_NAMES = {PRIORITY_VERIFIED: 'verified', PRIORITY_SIGNED_IN: 'signed_in', PRIORITY_GUEST: 'guest'}
+
+
+class AdmissionRejected(Exception):
+    """An upstream call was shed because the upstream is saturated; retry after ``retry_after`` seconds."""
+
+    def __init__(self, upstream: str, reason: str, retry_after: int):
+        super().__init__(f"{upstream} is overloaded ({reason})")
+        self.upstream = upstream
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ('event', 'state')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.state: str | None = None  # Set once: admitted, evicted or timeout
+
+
+class AdmissionController:
+    """
+    Caps the concurrent calls this process makes to one upstream.
+
+    - At most ``limit`` calls run at once; the rest wait in a queue of at most ``queue_size``.
+    - Waiters get freed slots by priority, then arrival order.
+    - When the queue is full, a caller ranked above the lowest queued waiter takes its place
+      (that waiter is shed); otherwise the caller is shed at once.
+    - A waiter still queued after ``max_wait`` seconds is shed.
+
+    Shed calls raise AdmissionRejected, with a Retry-After estimate from recent call durations.
+    """
+
+    def __init__(self, upstream: str, limit: int, queue_size: int, max_wait: float):
+        self.upstream = upstream
+        self.limit = limit
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self._active = 0
+        self._queue: list[tuple[int, int, _Waiter]] = []  # Heap of (priority, arrival, waiter)
+        self._arrivals = itertools.count()
+        self._average_seconds = 1.0  # Moving average of call duration
+        self._lock = threading.Lock()
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog should have drained."""
+        backlog = self._active + len(self._queue)
+        return max(1, math.ceil(self._average_seconds * backlog / self.limit))
+
+    @contextmanager
+    def admit(self, priority: int = PRIORITY_GUEST):
+        """Hold a slot for the duration of the block; raises AdmissionRejected if none comes free in time."""
+        self._acquire(priority)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(time.perf_counter() - start)
+
+    def _reject(self, priority: int, reason: str) -> AdmissionRejected:
+        ADMISSION_TOTAL.labels(self.upstream, PRIORITY_NAMES[priority], reason).inc()
+        logger.warning("Shedding %s call from a %s caller: %s", self.upstream, PRIORITY_NAMES[priority], reason)
+        return AdmissionRejected(self.upstream, reason, self.retry_after())
+
+    def _acquire(self, priority: int) -> None:
+        label = PRIORITY_NAMES[priority]
+        with self._lock:
+            if self._active < self.limit and not self._queue:
+                self._active += 1
+                ADMISSION_TOTAL.labels(self.upstream, label, 'admitted').inc()
+                ADMISSION_WAIT_SECONDS.labels(self.upstream, label).observe(0)
+                return
+            if len(self._queue) >= self.queue_size:
+                lowest = max(self._queue, default=None)  # Lowest priority, latest arrival
+                if lowest is None or lowest[0] <= priority:
+                    raise self._reject(priority, 'shed')
+                self._queue.remove(lowest)
+                heapq.heapify(self._queue)
+                lowest[2].state = 'evicted'
+                lowest[2].event.set()
+            waiter = _Waiter()
+            entry = (priority, next(self._arrivals), waiter)
+            heapq.heappush(self._queue, entry)
+
+        start = time.perf_counter()
+        waiter.event.wait(self.max_wait)
+        with self._lock:
+            if waiter.state is None:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                waiter.state = 'timeout'
+        if waiter.state != 'admitted':
+            raise self._reject(priority, waiter.state)
+        ADMISSION_TOTAL.labels(self.upstream, label, 'admitted').inc()
+        ADMISSION_WAIT_SECONDS.labels(self.upstream, label).observe(time.perf_counter() - start)
+
+    def _release(self, seconds: float) -> None:
+        with self._lock:
+            self._average_seconds = 0.8 * self._average_seconds + 0.2 * seconds
+            if self._queue:
+                # The slot passes straight to the next waiter, so _active stays the same
+                _, _, waiter = heapq.heappop(self._queue)
+                waiter.state = 'admitted'
+                waiter.event.set()
+            else:
+                self._active -= 1
+
+
+# One controller per upstream in each worker process
+_controllers: dict[str, AdmissionController] = {}
+_controllers_lock = threading.Lock()
+
+
+def get_admission_controller(upstream: str) -> AdmissionController:
+    with _controllers_lock:
+        if upstream not in _controllers:
+            _controllers[upstream] = AdmissionController(
+                upstream,
+                limit=current_app.config['ADMISSION_LIMITS'][upstream],
+                queue_size=current_app.config.get('ADMISSION_QUEUE_SIZE', 16),
+                max_wait=current_app.config.get('ADMISSION_MAX_WAIT_SECONDS', 10),
+            )
+        return _controllers[upstream]
+
+
+def admit(upstream: str, priority: int):
+    """
+    Context manager around one call to ``upstream`` ("chat", "transcription" or "embedding"); a no-op
+    when ADMISSION_CONTROL_ENABLED is off. Needs the app context to be created, not to be entered.
+    """
+    if not current_app.config.get('ADMISSION_CONTROL_ENABLED', True):
+        return nullcontext()
+    return get_admission_controller(upstream).admit(priority)
+
+
+def caller_priority(decoded_token: dict | None) -> int:
+    if not decoded_token or not decoded_token.get('uid'):
+        return PRIORITY_GUEST
+    return PRIORITY_VERIFIED if decoded_token.get('email_verified') else PRIORITY_SIGNED_IN
+
+
+def overloaded_response(error: AdmissionRejected, **extra):
+    """503 with Retry-After for a shed request; ``extra`` adds fields such as an error code."""
+    response = jsonify({"error": "The AI service is busy. Please try again shortly.", **extra})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+# --- Long-lived requests ---
+# A WebSocket session or a waiting result poll holds one of the worker's gunicorn threads for as
+# long as it stays open, so each kind gets a few slots per process (LONG_REQUEST_LIMITS) and
+# ordinary requests, health probes included, always find a free thread
+_long_request_slots: dict[str, threading.BoundedSemaphore] = {}
+
+
+@contextmanager
+def long_request_slot(kind: str):
+    """Hold one of this process's ``kind`` slots for the block; yields False, without waiting, if none is free."""
+    with _controllers_lock:
+        if kind not in _long_request_slots:
+            _long_request_slots[kind] = threading.BoundedSemaphore(current_app.config['LONG_REQUEST_LIMITS'][kind])
+        slots = _long_request_slots[kind]
+    if not slots.acquire(blocking=False):
+        LONG_REQUESTS_REJECTED_TOTAL.labels(kind).inc()
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        slots.release()
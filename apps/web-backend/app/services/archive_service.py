@@ -0,0 +1,210 @@
+import zlib
+import logging
+from datetime import datetime, timezone, timedelta
+import orjson
+from flask import current_app
+from sqlalchemy.orm.attributes import set_committed_value
+from app.extensions import db
+from app.logging_setup import NO_SAMPLE
+from app.models import Conversation, ConversationArchive, Message
+from app.sharding import each_shard
+from app.services.history_cache import bump_history_version, invalidate_history_cache
+from app.services.job_service import job_handler, enqueue
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FORMAT_VERSION = 1
+
+
+def _compress(messages: list[list], level: int) -> tuple[bytes, int]:
+    raw = orjson.dumps({"v": ARCHIVE_FORMAT_VERSION, "messages": messages})
+    return zlib.compress(raw, level), len(raw)
+
+
+def _decompress(archive: ConversationArchive) -> list[dict]:
+    if archive.codec != 'zlib':
+        raise ValueError(f"Unknown archive codec: {archive.codec}")
+    data = orjson.loads(zlib.decompress(archive.messages_blob))
+    # Timestamps stay as the ISO strings they were archived as: the same text the JSON
+    # provider writes for a live datetime, so archived and hot reads serialize identically
+    return [{"id": message_id, "role": role, "content": content, "timestamp": timestamp}
+            for message_id, role, content, timestamp in data["messages"]]
+
+
+def archived_messages(conversation_id: int) -> list[dict]:
+    archive = db.session.get(ConversationArchive, conversation_id)
+    return _decompress(archive) if archive is not None else []
+
+
+def archived_messages_by_conversation(user_id: int, conversation_ids) -> dict[int, list[dict]]:
+    """The archived messages of those of ``conversation_ids`` the user owns, loaded in one query."""
+    archives = db.session.scalars(
+        db.select(ConversationArchive)
+        .join(Conversation, Conversation.id == ConversationArchive.conversation_id)
+        .where(ConversationArchive.conversation_id.in_(list(conversation_ids)), Conversation.user_id == user_id)
+    )
+    return {archive.conversation_id: _decompress(archive) for archive in archives}
+
+
+def conversation_messages(conversation: Conversation, limit: int | None = None) -> list[dict]:
+    """
+    A conversation's messages in order as dicts with id, role, content and timestamp, read
+    from the archive blob when the conversation is archived. ``limit`` keeps the most recent.
+    """
+    query = (
+        db.select(Message.id, Message.role, Message.content, Message.timestamp)
+        .filter_by(conversation_id=conversation.id)
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    messages = [row._asdict() for row in reversed(db.session.execute(query).all())]
+    if conversation.archived_at is not None:
+        # Messages written while the conversation was being archived stay in the hot table
+        messages = archived_messages(conversation.id) + messages
+        if limit is not None:
+            messages = messages[-limit:]
+    return messages
+
+
+def _index_archive(conversation_id: int, messages: list[list]) -> None:
+    # The message rows leave the full-text index with them, so the archive is indexed instead
+    # (see the conversation_archive entries of models.*_SEARCH_DDL); search_service reads the
+    # blob back for snippets
+    text = "\n".join(content for _, _, content, _ in messages)
+    dialect = db.session.get_bind(mapper=ConversationArchive).dialect.name
+    if dialect == 'postgresql':
+        db.session.execute(
+            db.text("UPDATE conversation_archive SET search_vector = to_tsvector('english', :text) "
+                    "WHERE conversation_id = :conversation_id"),
+            {"text": text, "conversation_id": conversation_id}, bind_arguments={"mapper": ConversationArchive})
+    elif dialect == 'sqlite':
+        db.session.execute(
+            db.text("INSERT INTO conversation_archive_fts(rowid, content) VALUES (:conversation_id, :text)"),
+            {"text": text, "conversation_id": conversation_id}, bind_arguments={"mapper": ConversationArchive})
+
+
+def archive_conversation(conversation_id: int, idle_before: datetime, level: int = 9) -> bool:
+    """
+    Move an idle conversation's messages into a compressed ConversationArchive row, in the
+    caller's transaction, and bump the owner's history version (``archived`` changes in
+    /api/history); invalidate their history cache after committing. Returns False if the
+    conversation was touched since ``idle_before`` or is already archived.
+    """
+    conversation = db.session.scalars(
+        db.select(Conversation)
+        .where(Conversation.id == conversation_id, Conversation.archived_at.is_(None),
+               Conversation.updated_at < idle_before)
+        .with_for_update()
+    ).first()
+    if conversation is None:
+        return False
+    rows = db.session.execute(
+        db.select(Message.id, Message.role, Message.content, Message.timestamp)
+        .filter_by(conversation_id=conversation_id)
+        .order_by(Message.timestamp, Message.id)
+    ).all()
+    messages = [[row.id, row.role, row.content, row.timestamp] for row in rows]
+    blob, raw_size = _compress(messages, level)
+    db.session.add(ConversationArchive(conversation_id=conversation_id, codec='zlib', message_count=len(rows),
+                                       raw_size=raw_size, messages_blob=blob))
+    db.session.flush()
+    _index_archive(conversation_id, messages)
+    if rows:
+        # Bounded by id, so a message that slipped in after the read above is kept, not lost
+        db.session.execute(
+            db.delete(Message).where(Message.conversation_id == conversation_id,
+                                     Message.id <= max(row.id for row in rows)),
+            execution_options={"synchronize_session": False},
+        )
+    # updated_at is pinned so archiving doesn't reorder the history list or show up in /sync
+    db.session.execute(
+        db.update(Conversation).where(Conversation.id == conversation_id)
+        .values(archived_at=datetime.now(timezone.utc), updated_at=Conversation.updated_at),
+        execution_options={"synchronize_session": False},
+    )
+    bump_history_version(conversation.user_id)
+    return True
+
+
+def restore_conversation(conversation: Conversation) -> int:
+    """
+    Move an archived conversation's messages back into the message table (keeping their ids
+    and timestamps), in the caller's transaction. Used before a conversation is written to again.
+    Bumps the owner's history version; invalidate their history cache after committing.
+    """
+    archive = db.session.get(ConversationArchive, conversation.id)
+    messages = _decompress(archive) if archive is not None else []
+    if messages:
+        db.session.execute(db.insert(Message), [
+            {"id": message["id"], "conversation_id": conversation.id, "role": message["role"],
+             "content": message["content"], "timestamp": datetime.fromisoformat(message["timestamp"])}
+            for message in messages
+        ])
+    if archive is not None:
+        db.session.delete(archive)
+    # As with archiving, updated_at is left alone; a new turn sets it itself
+    db.session.execute(
+        db.update(Conversation).where(Conversation.id == conversation.id)
+        .values(archived_at=None, updated_at=Conversation.updated_at),
+        execution_options={"synchronize_session": False},
+    )
+    set_committed_value(conversation, 'archived_at', None)
+    bump_history_version(conversation.user_id)
+    return len(messages)
+
+
+def archive_idle_conversations(idle_days: int, batch_size: int, max_batches: int | None = None) -> int:
+    """
+    Archive conversations not updated for ``idle_days``, committing every ``batch_size``.
+    ``max_batches`` applies per shard.
+    """
+    idle_before = datetime.now(timezone.utc) - timedelta(days=idle_days)
+    level = current_app.config.get('ARCHIVE_COMPRESSION_LEVEL', 9)
+    archived = 0
+    for _ in each_shard():
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            candidates = db.session.execute(
+                db.select(Conversation.id, Conversation.user_id)
+                .where(Conversation.archived_at.is_(None), Conversation.updated_at < idle_before)
+                .order_by(Conversation.updated_at)
+                .limit(batch_size)
+            ).all()
+            if not candidates:
+                break
+            user_ids = set()
+            for conversation_id, user_id in candidates:
+                if archive_conversation(conversation_id, idle_before, level):
+                    archived += 1
+                    user_ids.add(user_id)
+            db.session.commit()
+            for user_id in user_ids:
+                invalidate_history_cache(user_id)
+            batches += 1
+            logger.info("Archived %s conversations idle for %s days so far", archived, idle_days, extra=NO_SAMPLE)
+    return archived
+
+
+def archive_stats() -> dict:
+    stats = {"conversations": 0, "messages": 0, "raw_bytes": 0, "stored_bytes": 0}
+    for _ in each_shard():
+        count, messages, raw_size, stored_size = db.session.execute(
+            db.select(db.func.count(), db.func.coalesce(db.func.sum(ConversationArchive.message_count), 0),
+                      db.func.coalesce(db.func.sum(ConversationArchive.raw_size), 0),
+                      db.func.coalesce(db.func.sum(db.func.length(ConversationArchive.messages_blob)), 0))
+        ).one()
+        stats["conversations"] += count
+        stats["messages"] += messages
+        stats["raw_bytes"] += raw_size
+        stats["stored_bytes"] += stored_size
+    return stats
+
+
+@job_handler('archive_idle_conversations')
+def archive_idle_conversations_job(idle_days: int | None = None, batch_size: int | None = None) -> None:
+    # One batch per run keeps each job short; the job re-queues itself while work remains
+    idle_days = idle_days or current_app.config.get('ARCHIVE_IDLE_DAYS', 180)
+    batch_size = batch_size or current_app.config.get('ARCHIVE_BATCH_SIZE', 200)
+    if archive_idle_conversations(idle_days, batch_size, max_batches=1) >= batch_size:
+        enqueue('archive_idle_conversations', {"idle_days": idle_days, "batch_size": batch_size})
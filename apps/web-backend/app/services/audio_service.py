@@ -0,0 +1,103 @@
+import os
+import re
+import shutil
+import logging
+import subprocess
+from flask import current_app
+from app.services.metrics_service import observe_stage
+
+logger = logging.getLogger(__name__)
+
+# What Whisper gets after normalization: Opus in Ogg, 16 kHz mono (Whisper resamples to 16 kHz anyway)
+NORMALIZED_SUFFIX = ".ogg"
+NORMALIZED_SAMPLE_RATE = 16000
+
+# From the header ffmpeg prints for an input, e.g.
+#   Duration: 00:01:02.50, start: 0.000000, bitrate: 1411 kb/s
+#   Stream #0:0: Audio: pcm_s16le ([1][0][0][0] / 0x0001), 44100 Hz, stereo, s16, 1411 kb/s
+_DURATION_RE = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+_BITRATE_RE = re.compile(r"Duration: .*?bitrate: (\d+) kb/s")
+_AUDIO_STREAM_RE = re.compile(r"Stream #\S+.*?: Audio: (\w+).*?, (\d+) Hz, ([^,]+)")
+
+
+def ffmpeg_path() -> str | None:
+    """The ffmpeg binary to use, or None when normalization is disabled or ffmpeg is not installed."""
+    if not current_app.config.get('AUDIO_NORMALIZATION_ENABLED', True):
+        return None
+    return current_app.config.get('FFMPEG_PATH') or shutil.which('ffmpeg')
+
+
+def probe_audio(ffmpeg: str, path: str) -> dict | None:
+    """
+    Codec, sample rate, channel layout, duration (seconds) and bitrate (kb/s) of an audio file,
+    read from ffmpeg's input header so no ffprobe is needed. None if ffmpeg finds no audio.
+    """
+    result = subprocess.run([ffmpeg, '-hide_banner', '-i', path], capture_output=True, text=True,
+                            timeout=current_app.config.get('AUDIO_NORMALIZE_TIMEOUT_SECONDS', 120))
+    # ffmpeg exits non-zero here (no output file given); the header is on stderr either way
+    stream = _AUDIO_STREAM_RE.search(result.stderr)
+    if not stream:
+        return None
+    duration = _DURATION_RE.search(result.stderr)
+    bitrate = _BITRATE_RE.search(result.stderr)
+    return {
+        "codec": stream.group(1),
+        "sample_rate": int(stream.group(2)),
+        "channels": stream.group(3).strip(),
+        "duration": (int(duration.group(1)) * 3600 + int(duration.group(2)) * 60 + float(duration.group(3)))
+        if duration else None,
+        "bitrate": int(bitrate.group(1)) if bitrate else None,
+    }
+
+
+def _silence_filter(threshold_db: int) -> str:
+    # Drops leading silence, and shortens every pause longer than 2s (trailing silence included)
+    # to 0.5s. Streams through the file, unlike trimming the end with areverse, which buffers it all.
+    return (f"silenceremove=start_periods=1:start_threshold={threshold_db}dB:start_silence=0.2"
+            f":stop_periods=-1:stop_duration=2:stop_threshold={threshold_db}dB:stop_silence=0.5")
+
+
+def normalize_audio(path: str) -> str:
+    """
+    Re-encode the audio at ``path`` for upload to Whisper: silence trimmed, downmixed to mono,
+    resampled to 16 kHz and compressed with Opus. Returns the path of the file to upload, which
+    is ``path`` itself when ffmpeg is unavailable, the input is already compact (at most
+    AUDIO_COMPACT_BITRATE_KBPS) or re-encoding would not make it smaller. The normalized file is
+    written next to the input, so it is cleaned up with it.
+    """
+    ffmpeg = ffmpeg_path()
+    if not ffmpeg:
+        return path
+    timeout = current_app.config.get('AUDIO_NORMALIZE_TIMEOUT_SECONDS', 120)
+    try:
+        with observe_stage('audio_normalization'):
+            info = probe_audio(ffmpeg, path)
+            if info is None:
+                logger.warning("No audio stream found by ffmpeg in %s; uploading it unchanged", path)
+                return path
+            compact = (info["bitrate"] is not None
+                       and info["bitrate"] <= current_app.config.get('AUDIO_COMPACT_BITRATE_KBPS', 48))
+            if compact:
+                return path
+            output = os.path.splitext(path)[0] + ".normalized" + NORMALIZED_SUFFIX
+            subprocess.run(
+                [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y', '-i', path, '-vn',
+                 '-af', _silence_filter(current_app.config.get('AUDIO_SILENCE_THRESHOLD_DB', -50)),
+                 '-ac', '1', '-ar', str(NORMALIZED_SAMPLE_RATE),
+                 '-c:a', 'libopus', '-b:a', current_app.config.get('AUDIO_TARGET_BITRATE', '24k'),
+                 '-application', 'voip', output],
+                capture_output=True, text=True, timeout=timeout, check=True,
+            )
+    except subprocess.TimeoutExpired:
+        logger.warning("Audio normalization timed out after %ss; uploading %s unchanged", timeout, path)
+        return path
+    except subprocess.CalledProcessError as e:
+        logger.warning("Audio normalization failed for %s; uploading it unchanged: %s", path, e.stderr.strip())
+        return path
+
+    original_size, normalized_size = os.path.getsize(path), os.path.getsize(output)
+    if normalized_size >= original_size:
+        return path
+    logger.info("Normalized audio %s (%s, %s Hz, %s, %s kb/s): %s -> %s bytes", os.path.basename(path),
+                info["codec"], info["sample_rate"], info["channels"], info["bitrate"], original_size, normalized_size)
+    return output
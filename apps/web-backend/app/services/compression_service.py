@@ -0,0 +1,63 @@
+import gzip
+import logging
+from flask import request
+from app.services.metrics_service import observe_stage
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip is always available
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/x-ndjson',
+    'text/plain',
+    'text/html',
+    'text/csv',
+}
+
+
+def _compress(body: bytes, encoding: str, app) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=app.config.get('COMPRESSION_BROTLI_QUALITY', 4))
+    return gzip.compress(body, compresslevel=app.config.get('COMPRESSION_GZIP_LEVEL', 6), mtime=0)
+
+
+def init_compression(app) -> None:
+    """
+    Compress eligible responses according to the request's Accept-Encoding.
+
+    Only buffered responses with a compressible mimetype and a body of at least
+    COMPRESSION_MIN_SIZE bytes are compressed. Streamed responses (SSE, exports) and
+    responses that already carry a Content-Encoding pass through untouched.
+    """
+    if not app.config.get('COMPRESSION_ENABLED', True):
+        return
+    encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+    min_size = app.config.get('COMPRESSION_MIN_SIZE', 1024)
+
+    @app.after_request
+    def _compress_response(response):
+        if (response.direct_passthrough or response.is_streamed
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES
+                or response.status_code < 200 or response.status_code in (204, 206, 304)
+                or 'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+        if response.content_length is not None and response.content_length < min_size:
+            return response
+        encoding = request.accept_encodings.best_match(encodings)
+        if encoding is None:
+            return response
+        body = response.get_data()
+        if len(body) < min_size:
+            return response
+        with observe_stage('compression'):
+            compressed = _compress(body, encoding, app)
+        if len(compressed) >= len(body):
+            return response
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        return response
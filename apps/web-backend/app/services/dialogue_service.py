@@ -0,0 +1,161 @@
+import logging
+from datetime import datetime, timezone
+from flask import current_app
+from app.extensions import db
+from app.logging_setup import NO_SAMPLE
+from app.models import Conversation, Message
+from app.sharding import ensure_user_on_shard
+from app.services.admission_service import PRIORITY_GUEST
+from app.services.archive_service import restore_conversation
+from app.services.history_cache import bump_history_version, invalidate_history_cache
+from app.services.job_service import enqueue
+from app.services.memory_service import get_memory_service, format_memory_context
+from app.services.metrics_service import observe_stage
+from app.services.title_service import placeholder_title
+from app.services.usage_service import record_usage
+
+logger = logging.getLogger(__name__)
+
+# Shared by the HTTP (POST /api/dialogue, /api/dialogue/panel) and WebSocket (/api/dialogue/ws) transports.
+
+
+def persona_system_prompt(persona_id: str | None) -> tuple[str, str | None]:
+    """Resolve a requested persona to (persona_id, system prompt), falling back to the default persona."""
+    persona_id = persona_id or current_app.DEFAULT_PERSONA_ID
+    prompt = current_app.persona_prompts_content.get(
+        persona_id,
+        current_app.persona_prompts_content.get(current_app.DEFAULT_PERSONA_ID),
+    )
+    return persona_id, prompt
+
+
+def recall_memory(user_id: int, text: str, exclude_conversation_id: int | None = None,
+                  priority: int = PRIORITY_GUEST):
+    """
+    Best-effort cross-conversation recall. Returns (query vector, system prompt block);
+    either may be None. The vector should be passed on to save_turn() so the message is
+    not embedded twice. ``priority`` is the caller's admission priority for the embeddings call.
+    """
+    memory = get_memory_service()
+    if not memory:
+        return None, None
+    try:
+        with observe_stage('memory_recall'):
+            query_vector = memory.embed_query(text, priority)
+            memories = memory.recall(
+                user_id, query_vector,
+                k=current_app.config.get('MEMORY_TOP_K', 4),
+                min_score=current_app.config.get('MEMORY_MIN_SCORE', 0.35),
+                exclude_conversation_id=exclude_conversation_id,
+            )
+            return query_vector, format_memory_context(memories, current_app.config.get('MEMORY_TOKEN_BUDGET', 300))
+    except Exception as e:
+        # Memory is best-effort; the turn goes ahead without it
+        logger.warning("Memory recall failed for user %s: %s", user_id, e)
+        return None, None
+
+
+def _new_conversations(user_id: int, persona_ids: list[str], user_content: str) -> list[Conversation]:
+    logger.info("Creating %s new conversation(s) for user %s", len(persona_ids), user_id)
+    ensure_user_on_shard(user_id)
+    conversations = [Conversation(user_id=user_id, title=placeholder_title(user_content), persona_id=persona_id)
+                     for persona_id in persona_ids]
+    db.session.add_all(conversations)
+    db.session.flush()  # One batched INSERT, however many personas
+    if current_app.config.get('TITLE_GENERATION_ENABLED', True):
+        # Committed with the conversation; a job worker swaps in a generated title
+        for conversation in conversations:
+            enqueue('generate_title', {"conversation_id": conversation.id, "user_id": user_id})
+    return conversations
+
+
+def _add_exchange(conversation: Conversation, user_content: str, ai_content: str, usage=None) -> tuple[Message, Message]:
+    user_message = Message(conversation_id=conversation.id, role='user', content=user_content)
+    assistant_message = Message(conversation_id=conversation.id, role='assistant', content=ai_content)
+    db.session.add_all([user_message, assistant_message])
+    conversation.record_messages(
+        [user_message, assistant_message],
+        prompt_tokens=getattr(usage, 'prompt_tokens', 0),
+        completion_tokens=getattr(usage, 'completion_tokens', 0),
+    )
+    conversation.updated_at = datetime.now(timezone.utc)
+    return user_message, assistant_message
+
+
+def save_turn(user_id: int, conversation_id: int | None, persona_id: str, user_content: str,
+              ai_content: str, usage=None, query_vector=None, model: str | None = None,
+              latency: float | None = None, ttft: float | None = None) -> Conversation:
+    """
+    Store one user/assistant exchange and commit it.
+
+    Appends to ``conversation_id`` when it exists and belongs to the user, otherwise starts a
+    new conversation (and queues its title job). With ``model``, the completion's usage, latency
+    and time to first token (seconds) go to the usage ledger in the same transaction.
+    Raises on database errors; the caller rolls back.
+    """
+    conversation = None
+    if conversation_id is not None:
+        conversation = db.session.scalars(
+            db.select(Conversation).filter_by(id=conversation_id, user_id=user_id)
+        ).first()
+        if conversation and conversation.archived_at is not None:
+            restored = restore_conversation(conversation)
+            logger.info("Restored %s archived messages to conversation %s", restored, conversation.id, extra=NO_SAMPLE)
+        if not conversation:
+            logger.warning("Conversation ID %s not found for user %s or invalid. Creating new conversation.",
+                           conversation_id, user_id)
+
+    if not conversation:
+        conversation = _new_conversations(user_id, [persona_id], user_content)[0]
+    user_message, assistant_message = _add_exchange(conversation, user_content, ai_content, usage)
+    if model:
+        db.session.flush()
+        record_usage(assistant_message, persona_id, model, usage, latency=latency, ttft=ttft)
+    bump_history_version(user_id)
+    with observe_stage('db_commit'):
+        db.session.commit()
+    invalidate_history_cache(user_id)
+
+    memory = get_memory_service()
+    if memory:
+        memory.remember(user_id, conversation.id, [
+            (user_message.id, user_content, query_vector),
+            (assistant_message.id, ai_content, None),
+        ])
+    logger.info("Saved messages to conversation %s for user %s", conversation.id, user_id)
+    return conversation
+
+
+def save_panel(user_id: int, user_content: str, answers: list[dict], query_vector=None) -> dict[str, int]:
+    """
+    Store a panel question and every persona's answer (results of panel_service.ask_panel) in
+    one transaction, usage ledger included. Each persona gets a new conversation, so any of them
+    can be continued one-on-one. Returns the conversation ids by persona. Raises on database
+    errors; the caller rolls back.
+    """
+    conversations = _new_conversations(user_id, [answer["persona_id"] for answer in answers], user_content)
+    exchanges = [_add_exchange(conversation, user_content, answer["content"], answer.get("usage"))
+                 for conversation, answer in zip(conversations, answers)]
+    db.session.flush()
+    for answer, (_, assistant_message) in zip(answers, exchanges):
+        record_usage(assistant_message, answer["persona_id"], answer["model"], answer.get("usage"),
+                     latency=answer.get("latency"))
+    # Read now: the commit expires every object, and reloading them costs a SELECT per row
+    conversation_ids = [conversation.id for conversation in conversations]
+    message_ids = [(user_message.id, assistant_message.id) for user_message, assistant_message in exchanges]
+    bump_history_version(user_id)
+    with observe_stage('db_commit'):
+        db.session.commit()
+    invalidate_history_cache(user_id)
+
+    memory = get_memory_service()
+    if memory:
+        for index, (answer, conversation_id, (user_message_id, assistant_message_id)) in enumerate(
+                zip(answers, conversation_ids, message_ids)):
+            # The question is remembered once, so recall doesn't return it once per panelist
+            messages = [(assistant_message_id, answer["content"], None)]
+            if index == 0:
+                messages.insert(0, (user_message_id, user_content, query_vector))
+            memory.remember(user_id, conversation_id, messages)
+    logger.info("Saved panel answers from %s personas for user %s", len(answers), user_id)
+    return {answer["persona_id"]: conversation_id for answer, conversation_id in zip(answers, conversation_ids)}
@@ -0,0 +1,89 @@
+import zlib
+import logging
+from datetime import datetime, timezone
+from typing import Iterator
+import orjson
+from app.extensions import db
+from app.models import Conversation, Message
+from app.services.archive_service import archived_messages
+
+logger = logging.getLogger(__name__)
+
+EXPORT_VERSION = 1
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "ndjson.gz": "application/gzip",
+}
+# Rows fetched per round trip from the server-side cursor
+EXPORT_BATCH_ROWS = 1000
+# Output is buffered to about this many bytes before each yield
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+
+def _export_rows(user_id: int):
+    """
+    One row per message (or per empty conversation), ordered so each conversation's rows are
+    contiguous. Plain columns rather than ORM objects keep the identity map empty, and
+    yield_per streams from a server-side cursor, so memory stays flat however big the history is.
+    """
+    statement = (
+        db.select(
+            Conversation.id, Conversation.title, Conversation.persona_id,
+            Conversation.created_at, Conversation.updated_at, Conversation.archived_at,
+            Message.id.label('message_id'), Message.role, Message.content, Message.timestamp,
+        )
+        .outerjoin(Message, Message.conversation_id == Conversation.id)
+        .where(Conversation.user_id == user_id)
+        .order_by(Conversation.id, Message.timestamp, Message.id)
+        .execution_options(yield_per=EXPORT_BATCH_ROWS)
+    )
+    return db.session.execute(statement)
+
+
+def _export_lines(user_id: int) -> Iterator[bytes]:
+    # orjson emits bytes and formats datetimes itself, the same text as isoformat()
+    yield orjson.dumps({"type": "export", "version": EXPORT_VERSION,
+                        "exported_at": datetime.now(timezone.utc)}, option=orjson.OPT_APPEND_NEWLINE)
+    current_conversation_id = None
+    for row in _export_rows(user_id):
+        if row.id != current_conversation_id:
+            current_conversation_id = row.id
+            yield orjson.dumps({"type": "conversation", "id": row.id, "title": row.title,
+                                "persona_id": row.persona_id, "created_at": row.created_at,
+                                "updated_at": row.updated_at}, option=orjson.OPT_APPEND_NEWLINE)
+            if row.archived_at is not None:
+                # Older than any message still in the hot table, so they go first
+                for message in archived_messages(row.id):
+                    yield orjson.dumps({"type": "message", "id": message["id"], "conversation_id": row.id,
+                                        "role": message["role"], "content": message["content"],
+                                        "timestamp": message["timestamp"]}, option=orjson.OPT_APPEND_NEWLINE)
+        if row.message_id is not None:
+            yield orjson.dumps({"type": "message", "id": row.message_id, "conversation_id": row.id,
+                                "role": row.role, "content": row.content,
+                                "timestamp": row.timestamp}, option=orjson.OPT_APPEND_NEWLINE)
+
+
+def generate_history_export(user_id: int, export_format: str = "ndjson") -> Iterator[bytes]:
+    """
+    Yield the user's history as NDJSON chunks: an export header line, then each conversation
+    line followed by its messages in order. With ``ndjson.gz`` the same stream is gzipped
+    incrementally.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if export_format == "ndjson.gz" else None
+    buffer, size = [], 0
+    for line in _export_lines(user_id):
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            chunk = b"".join(buffer)
+            buffer, size = [], 0
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+    chunk = b"".join(buffer)
+    if compressor is not None:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+    logger.info("Finished history export for user %s", user_id)
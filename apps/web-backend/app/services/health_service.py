@@ -0,0 +1,151 @@
+import time
+import logging
+import threading
+import openai
+import firebase_admin
+from firebase_admin import auth as firebase_auth
+from google.auth.transport import requests as google_requests
+from flask import current_app
+from app.extensions import db
+from app.logging_setup import NO_SAMPLE
+from app.services.memory_service import get_memory_service
+
+logger = logging.getLogger(__name__)
+
+# Public keys that Firebase ID tokens are signed with
+FIREBASE_CERT_URI = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+
+# Result of the last warm_up() in this process; reported by /healthz/ready
+_warmup: dict = {"complete": False, "steps": {}}
+
+# Upstream checks cost a network round trip (and, for OpenAI, quota), so probes reuse
+# recent results instead of calling out every few seconds
+_upstream_results: dict[str, tuple[float, dict]] = {}
+_upstream_lock = threading.Lock()
+
+
+def _timed(check) -> dict:
+    start = time.perf_counter()
+    try:
+        check()
+        result = {"ok": True}
+    except Exception as e:
+        result = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+    result["latency_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return result
+
+
+def _check_database() -> None:
+    db.session.execute(db.text("SELECT 1"))
+    db.session.rollback()
+
+
+def _warm_database_pool(connections: int) -> None:
+    # Check out several connections at once so the pool really opens that many
+    opened = []
+    try:
+        for _ in range(connections):
+            connection = db.engine.connect()
+            opened.append(connection)
+            connection.execute(db.text("SELECT 1"))
+    finally:
+        for connection in opened:
+            connection.close()
+
+
+def _check_openai() -> None:
+    client = current_app.openai_client
+    if not client:
+        raise RuntimeError("OpenAI client not initialized")
+    timeout = current_app.config.get('HEALTH_UPSTREAM_TIMEOUT_SECONDS', 5)
+    try:
+        # A cheap authenticated GET that leaves a warm TLS connection in the client's pool
+        client.with_options(timeout=timeout, max_retries=0).models.retrieve(
+            current_app.config.get('OPENAI_MODEL', 'gpt-4-turbo'))
+    except (openai.AuthenticationError, openai.APIConnectionError):
+        raise
+    except openai.APIStatusError:
+        pass  # Any other HTTP answer still means the API is reachable with our key
+
+
+def _check_firebase() -> None:
+    if not firebase_admin._apps:
+        raise RuntimeError("Firebase Admin SDK not initialized")
+    # verify_id_token() fetches Google's signing certificates on first use and then serves
+    # them from an HTTP cache; fetching them through the SDK's own cached request keeps that
+    # off the first request. There is no public API for it, so requirements.txt pins
+    # firebase-admin to the major version checked; if the internals still move, fall back to
+    # checking that the certificates can be fetched at all.
+    try:
+        fetch = firebase_auth._get_client(firebase_admin.get_app())._token_verifier.request
+    except AttributeError:
+        logger.warning("firebase-admin internals changed; Firebase certificates are not pre-cached")
+        fetch = google_requests.Request()
+    response = fetch(FIREBASE_CERT_URI)
+    if response.status != 200:
+        raise RuntimeError(f"Firebase certificates returned HTTP {response.status}")
+
+
+def _cached_upstream_check(name: str, check) -> dict:
+    ttl = current_app.config.get('HEALTH_UPSTREAM_CACHE_SECONDS', 30)
+    now = time.monotonic()
+    with _upstream_lock:
+        cached = _upstream_results.get(name)
+    if cached is not None and now - cached[0] < ttl:
+        return cached[1]
+    result = _timed(check)
+    with _upstream_lock:
+        _upstream_results[name] = (now, result)
+    return result
+
+
+def warm_up(app) -> dict:
+    """
+    Open the connections the first requests would otherwise pay for: the DB pool, the OpenAI
+    HTTP pool and Firebase's certificate cache, then run one request through the app.
+    Called from gunicorn's post_worker_init hook, before the worker accepts connections.
+    Failures are logged and reported by /healthz/ready but never stop the worker from booting.
+    """
+    start = time.perf_counter()
+    steps = {}
+    with app.app_context():
+        steps["database"] = _timed(lambda: _warm_database_pool(app.config.get('WARMUP_DB_CONNECTIONS', 4)))
+        steps["openai"] = _timed(_check_openai)
+        steps["firebase"] = _timed(_check_firebase)
+        steps["memory"] = _timed(get_memory_service)
+        db.session.remove()
+    steps["first_request"] = _timed(lambda: app.test_client().get('/healthz/live'))
+    with _upstream_lock:
+        _upstream_results["openai"] = (time.monotonic(), steps["openai"])
+        _upstream_results["firebase"] = (time.monotonic(), steps["firebase"])
+
+    _warmup["steps"] = steps
+    _warmup["complete"] = True
+    _warmup["duration_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    failed = [name for name, step in steps.items() if not step["ok"]]
+    if failed:
+        logger.warning("Warm-up finished in %sms with failures: %s", _warmup["duration_ms"], steps)
+    else:
+        logger.info("Warm-up finished in %sms: %s", _warmup["duration_ms"], steps, extra=NO_SAMPLE)
+    return _warmup
+
+
+def readiness() -> tuple[bool, dict]:
+    """
+    Check the dependencies a request needs. The database is checked live and gates readiness
+    (including its latency); OpenAI and Firebase are checked at most every
+    HEALTH_UPSTREAM_CACHE_SECONDS and only mark the instance degraded, since an upstream outage
+    affects every instance alike and pulling them all out of rotation would not help.
+    """
+    checks = {
+        "database": _timed(_check_database),
+        "openai": _cached_upstream_check("openai", _check_openai),
+        "firebase": _cached_upstream_check("firebase", _check_firebase),
+    }
+    max_latency_ms = current_app.config.get('HEALTH_DB_MAX_LATENCY_MS', 1000)
+    if checks["database"]["ok"] and checks["database"]["latency_ms"] > max_latency_ms:
+        checks["database"]["ok"] = False
+        checks["database"]["error"] = f"Latency above {max_latency_ms}ms"
+    ready = checks["database"]["ok"]
+    status = "ok" if ready and all(check["ok"] for check in checks.values()) else ("degraded" if ready else "unavailable")
+    return ready, {"status": status, "checks": checks, "warmup": _warmup}
@@ -0,0 +1,118 @@
+import threading
+from collections import OrderedDict
+from flask import request, current_app, make_response
+from app.extensions import db
+from app.models import User
+from app.services.metrics_service import record_cache_lookup
+
+# Bump when the shape of the /api/history payloads changes so clients drop old ETags
+HISTORY_PAYLOAD_VERSION = 3
+
+
+class HistoryCache:
+    """
+    Small per-process LRU of history payloads.
+
+    Entries hold the encoded JSON body, so a hit skips serialization entirely.
+    They are keyed by user and tagged with the user's ``history_version``. Every write
+    to a user's conversations bumps that column in the database, so a worker that did not
+    see the write still notices the version change on its next lookup and drops the entry.
+    """
+
+    def __init__(self, max_users: int = 1000, max_entries_per_user: int = 20):
+        self.max_users = max_users
+        self.max_entries_per_user = max_entries_per_user
+        self._users: OrderedDict[int, tuple[int, OrderedDict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, version: int, key: str) -> bytes | None:
+        with self._lock:
+            cached = self._users.get(user_id)
+            if cached is None or cached[0] != version:
+                return None
+            self._users.move_to_end(user_id)
+            return cached[1].get(key)
+
+    def set(self, user_id: int, version: int, key: str, payload: bytes) -> None:
+        with self._lock:
+            cached = self._users.get(user_id)
+            if cached is None or cached[0] != version:
+                cached = (version, OrderedDict())
+                self._users[user_id] = cached
+            entries = cached[1]
+            entries[key] = payload
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries_per_user:
+                entries.popitem(last=False)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._users.pop(user_id, None)
+
+
+# Global instance to be used across the application
+history_cache = None
+
+
+def get_history_cache() -> HistoryCache:
+    """Get or create the history cache instance"""
+    global history_cache
+    if history_cache is None:
+        history_cache = HistoryCache(
+            max_users=current_app.config.get('HISTORY_CACHE_MAX_USERS', 1000),
+            max_entries_per_user=current_app.config.get('HISTORY_CACHE_MAX_ENTRIES_PER_USER', 20),
+        )
+    return history_cache
+
+
+def history_etag(user: User, key: str) -> str:
+    return f"h{HISTORY_PAYLOAD_VERSION}-{user.id}-{user.history_version}-{key}"
+
+
+def cached_history_response(user: User, key: str):
+    """
+    Serve a history read without touching the conversation/message tables if possible.
+
+    Returns a 304 when the client's If-None-Match still matches, a 200 from the cache
+    when this worker has the payload for the current version, or None on a miss.
+    """
+    etag = history_etag(user, key)
+    if request.if_none_match.contains_weak(etag):
+        record_cache_lookup('history', True)
+        return _with_etag(make_response('', 304), etag)
+    body = get_history_cache().get(user.id, user.history_version, key)
+    record_cache_lookup('history', body is not None)
+    if body is None:
+        return None
+    return _with_etag(current_app.response_class(body, mimetype='application/json'), etag)
+
+
+def store_history_response(user: User, key: str, payload: dict):
+    """Serialize a freshly built payload, cache the body and return it as a response carrying its ETag."""
+    response = current_app.json.response(payload)
+    get_history_cache().set(user.id, user.history_version, key, response.get_data())
+    return _with_etag(response, history_etag(user, key))
+
+
+def _with_etag(response, etag: str):
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def bump_history_version(user_id: int) -> None:
+    """
+    Mark the user's history as changed. Call inside the write transaction, before commit;
+    the increment is done in SQL so concurrent writers never lose a bump.
+    """
+    db.session.execute(
+        db.update(User).where(User.id == user_id).values(history_version=User.history_version + 1)
+    )
+
+
+def invalidate_history_cache(user_id: int) -> None:
+    """Drop this worker's cached payloads for the user (call after the write commits)."""
+    get_history_cache().invalidate(user_id)
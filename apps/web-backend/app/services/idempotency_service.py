@@ -0,0 +1,166 @@
+import time
+import random
+import hashlib
+import logging
+import threading
+from functools import wraps
+from datetime import datetime, timezone, timedelta
+from flask import request, current_app, jsonify, make_response
+from sqlalchemy.exc import IntegrityError
+from app.auth.utils import verify_token
+from app.extensions import db
+from app.models import IdempotencyRecord
+from app.services.metrics_service import record_cache_lookup
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL_SECONDS = 0.1
+# Responses that a retry should re-execute rather than replay
+_RETRYABLE_STATUSES = {408, 409, 429}
+
+# Single-flight registry: concurrent duplicates in this worker wait on the first request's event
+_inflight: dict[tuple[str, str], threading.Event] = {}
+_inflight_lock = threading.Lock()
+
+
+def _request_scope() -> str:
+    decoded_token = verify_token()
+    if decoded_token and decoded_token.get('uid'):
+        return decoded_token['uid']
+    return f"guest:{request.remote_addr}"
+
+
+def _replay(record: IdempotencyRecord):
+    response = make_response(record.response_body or '', record.response_status)
+    response.mimetype = 'application/json'
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _claim(scope: str, key: str, request_hash: str, lease: float) -> IdempotencyRecord | None:
+    """
+    Insert an in-progress record for the key, expiring after ``lease`` seconds so the key is
+    freed even if this worker dies before releasing it. Returns None if this request now owns
+    the key, or the existing record if another request got there first. Expired records,
+    completed or abandoned, are replaced.
+    """
+    now = datetime.now(timezone.utc)
+    if random.random() < 0.01:
+        # Opportunistic cleanup so the table stays small without a cron job
+        db.session.execute(db.delete(IdempotencyRecord).where(IdempotencyRecord.expires_at < now))
+    db.session.add(IdempotencyRecord(scope=scope, key=key, request_hash=request_hash,
+                                     status='in_progress', expires_at=now + timedelta(seconds=lease)))
+    try:
+        db.session.commit()
+        return None
+    except IntegrityError:
+        db.session.rollback()
+    # Take the key over in one conditional statement, so of two retries racing for it only one wins
+    taken_over = db.session.execute(
+        db.update(IdempotencyRecord)
+        .where(IdempotencyRecord.scope == scope, IdempotencyRecord.key == key, IdempotencyRecord.expires_at < now)
+        .values(request_hash=request_hash, status='in_progress', response_status=None, response_body=None,
+                created_at=now, expires_at=now + timedelta(seconds=lease)),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    db.session.commit()
+    if taken_over:
+        return None
+    return db.session.scalars(db.select(IdempotencyRecord).filter_by(scope=scope, key=key)).first()
+
+
+def delete_records(scope: str) -> None:
+    """Delete every stored response of ``scope`` (a Firebase UID), in the caller's transaction."""
+    db.session.execute(db.delete(IdempotencyRecord).where(IdempotencyRecord.scope == scope),
+                       execution_options={"synchronize_session": False})
+
+
+def _wait_for_completion(scope: str, key: str, deadline: float) -> IdempotencyRecord | None:
+    """Poll for a record owned by another worker until it completes, disappears or the deadline passes."""
+    while True:
+        db.session.expire_all()
+        record = db.session.scalars(db.select(IdempotencyRecord).filter_by(scope=scope, key=key)).first()
+        if record is None or record.status == 'completed' or time.monotonic() >= deadline:
+            return record
+        time.sleep(POLL_INTERVAL_SECONDS)
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes even for timezone-aware columns
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def idempotent(view):
+    """
+    Decorator that de-duplicates retried requests carrying an ``Idempotency-Key`` header.
+
+    - Concurrent duplicates in the same worker wait for the first request (single-flight);
+      duplicates in other workers poll the shared record.
+    - Completed responses are stored for IDEMPOTENCY_TTL_SECONDS and replayed with an
+      ``Idempotent-Replayed: true`` header.
+    - A key held by a request whose worker died is reclaimed after IDEMPOTENCY_LEASE_SECONDS.
+    - Reusing a key with a different body is rejected with 422.
+    - 5xx, 408, 409 and 429 responses are not stored, so the client can retry them.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({"error": f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters."}), 400
+
+        scope = _request_scope()
+        request_hash = hashlib.sha256(request.get_data()).hexdigest()
+        ttl = current_app.config.get('IDEMPOTENCY_TTL_SECONDS', 3600)
+        lease = current_app.config.get('IDEMPOTENCY_LEASE_SECONDS', 120)
+        deadline = time.monotonic() + current_app.config.get('IDEMPOTENCY_WAIT_SECONDS', 30)
+
+        with _inflight_lock:
+            leader_event = _inflight.get((scope, key))
+        if leader_event is not None:
+            leader_event.wait(max(0.0, deadline - time.monotonic()))
+
+        existing = _claim(scope, key, request_hash, lease)
+        if existing is not None:
+            if existing.request_hash != request_hash:
+                return jsonify({"error": "Idempotency-Key was already used with a different request body."}), 422
+            if existing.status != 'completed':
+                existing = _wait_for_completion(scope, key, deadline)
+            if existing is not None and existing.status == 'completed':
+                record_cache_lookup('idempotency', True)
+                logger.info("Replaying stored response for Idempotency-Key %s", key)
+                return _replay(existing)
+            if existing is None:
+                # The original request failed and released the key; run this one instead
+                return wrapper(*args, **kwargs)
+            return jsonify({"error": "A request with this Idempotency-Key is still in progress."}), 409
+
+        record_cache_lookup('idempotency', False)
+        event = threading.Event()
+        with _inflight_lock:
+            _inflight[(scope, key)] = event
+        try:
+            response = make_response(view(*args, **kwargs))
+            record = db.session.scalars(db.select(IdempotencyRecord).filter_by(scope=scope, key=key)).first()
+            if record is not None:
+                if response.status_code >= 500 or response.status_code in _RETRYABLE_STATUSES:
+                    db.session.delete(record)
+                else:
+                    record.status = 'completed'
+                    record.response_status = response.status_code
+                    record.response_body = response.get_data(as_text=True)
+                    record.expires_at = datetime.now(timezone.utc) + timedelta(seconds=ttl)
+                db.session.commit()
+            return response
+        except Exception:
+            db.session.rollback()
+            db.session.execute(db.delete(IdempotencyRecord).filter_by(scope=scope, key=key))
+            db.session.commit()
+            raise
+        finally:
+            with _inflight_lock:
+                _inflight.pop((scope, key), None)
+            event.set()
+    return wrapper
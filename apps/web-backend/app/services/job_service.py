@@ -0,0 +1,226 @@
+import os
+import time
+import random
+import signal
+import socket
+import logging
+import threading
+import traceback
+from typing import Callable
+from contextlib import contextmanager
+from datetime import datetime, timezone, timedelta
+from flask import current_app
+from sqlalchemy import and_, or_
+from app.extensions import db
+from app.logging_setup import NO_SAMPLE
+from app.models import Job
+from app.sharding import shard_context
+from app.services.metrics_service import JOBS_TOTAL, JOB_SECONDS, JOB_QUEUE_LAG_SECONDS
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRY_DELAY_SECONDS = 3600
+MAX_ERROR_LENGTH = 4000
+
+# Job kind -> handler; handlers are called with the job payload as keyword arguments
+_handlers: dict[str, Callable] = {}
+
+
+class PermanentJobError(Exception):
+    """Raise from a handler to fail the job immediately instead of retrying it."""
+
+
+def job_handler(kind: str):
+    """Register a function as the handler for jobs of ``kind``."""
+    def register(func):
+        _handlers[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind: str, payload: dict | None = None, delay_seconds: float = 0,
+            max_attempts: int | None = None) -> Job:
+    """
+    Add a job to the current transaction. Workers only see it once the caller commits,
+    so a job is never run for a write that was rolled back.
+    """
+    job = Job(
+        kind=kind,
+        payload=payload or {},
+        run_at=datetime.now(timezone.utc) + timedelta(seconds=delay_seconds),
+        max_attempts=max_attempts or current_app.config.get('JOB_MAX_ATTEMPTS', 5),
+    )
+    db.session.add(job)
+    return job
+
+
+def _claimable(now: datetime, lock_timeout: float):
+    # Due queued jobs, plus running jobs whose worker stopped renewing them (crashed or killed; see _heartbeat)
+    return or_(
+        and_(Job.status == 'queued', Job.run_at <= now),
+        and_(Job.status == 'running', Job.locked_at < now - timedelta(seconds=lock_timeout)),
+    )
+
+
+def claim_next(worker_id: str, lock_timeout: float) -> Job | None:
+    """
+    Claim the oldest due job for this worker.
+
+    On PostgreSQL the candidate row is selected ``FOR UPDATE SKIP LOCKED``, so concurrent
+    workers never wait on each other. SQLite ignores the locking clause; there the
+    conditional UPDATE below is what keeps two workers from taking the same job.
+    """
+    now = datetime.now(timezone.utc)
+    candidate = db.session.scalars(
+        db.select(Job)
+        .where(_claimable(now, lock_timeout))
+        .order_by(Job.run_at)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    ).first()
+    if candidate is None:
+        db.session.rollback()
+        return None
+    claimed = db.session.execute(
+        db.update(Job)
+        .where(Job.id == candidate.id, _claimable(now, lock_timeout))
+        .values(status='running', locked_by=worker_id, locked_at=now, attempts=Job.attempts + 1),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    db.session.commit()
+    if not claimed:
+        return None
+    return db.session.get(Job, candidate.id, populate_existing=True)
+
+
+def _retry_delay(attempts: int) -> float:
+    base = current_app.config.get('JOB_RETRY_BASE_SECONDS', 10)
+    delay = min(base * 2 ** (attempts - 1), MAX_RETRY_DELAY_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _finish(job_id: int, worker_id: str, **values) -> None:
+    # Only the worker that still holds the job may record its outcome
+    db.session.execute(
+        db.update(Job).where(Job.id == job_id, Job.locked_by == worker_id).values(**values),
+        execution_options={"synchronize_session": False},
+    )
+    db.session.commit()
+
+
+@contextmanager
+def _heartbeat(job_id: int, worker_id: str, interval: float):
+    """
+    Renew the job's locked_at every ``interval`` seconds while the block runs, so a job that
+    outlasts JOB_LOCK_TIMEOUT_SECONDS is not taken for lost and run a second time.
+    The renewals use their own connections, outside the handler's transaction.
+    """
+    engine = db.engine
+    stop = threading.Event()
+
+    def renew():
+        while not stop.wait(interval):
+            try:
+                with engine.begin() as connection:
+                    connection.execute(
+                        db.update(Job).where(Job.id == job_id, Job.locked_by == worker_id)
+                        .values(locked_at=datetime.now(timezone.utc))
+                    )
+            except Exception as e:
+                logger.warning("Could not renew the lock on job %s: %s", job_id, e)
+
+    thread = threading.Thread(target=renew, name=f"job-heartbeat-{job_id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_job(job: Job, worker_id: str) -> str:
+    """Run a claimed job and record the outcome: "succeeded", "retried" or "failed"."""
+    job_id, kind, attempts, max_attempts = job.id, job.kind, job.attempts, job.max_attempts
+    heartbeat_interval = current_app.config.get('JOB_LOCK_TIMEOUT_SECONDS', 300) / 4
+    run_at = job.run_at if job.run_at.tzinfo else job.run_at.replace(tzinfo=timezone.utc)
+    JOB_QUEUE_LAG_SECONDS.labels(kind).observe(max(0.0, (datetime.now(timezone.utc) - run_at).total_seconds()))
+
+    start = time.perf_counter()
+    try:
+        handler = _handlers.get(kind)
+        if handler is None:
+            raise PermanentJobError(f"No handler registered for job kind '{kind}'")
+        # Each job starts unrouted; handlers touching conversation data pick the user's shard
+        with shard_context(None), _heartbeat(job_id, worker_id, heartbeat_interval):
+            handler(**job.payload)
+            db.session.commit()
+        outcome = 'succeeded'
+        _finish(job_id, worker_id, status='succeeded', locked_by=None, locked_at=None, last_error=None,
+                finished_at=datetime.now(timezone.utc))
+    except Exception as e:
+        db.session.rollback()
+        error = traceback.format_exc()[-MAX_ERROR_LENGTH:]
+        if isinstance(e, PermanentJobError) or attempts >= max_attempts:
+            outcome = 'failed'
+            logger.error("Job %s (%s) failed after %s attempts: %s", job_id, kind, attempts, e)
+            _finish(job_id, worker_id, status='failed', locked_by=None, locked_at=None, last_error=error,
+                    finished_at=datetime.now(timezone.utc))
+        else:
+            outcome = 'retried'
+            delay = _retry_delay(attempts)
+            logger.warning("Job %s (%s) attempt %s failed, retrying in %.0fs: %s", job_id, kind, attempts, delay, e)
+            _finish(job_id, worker_id, status='queued', locked_by=None, locked_at=None, last_error=error,
+                    run_at=datetime.now(timezone.utc) + timedelta(seconds=delay))
+    JOB_SECONDS.labels(kind).observe(time.perf_counter() - start)
+    JOBS_TOTAL.labels(kind, outcome).inc()
+    return outcome
+
+
+def prune_finished_jobs(retention_days: int) -> int:
+    """Delete succeeded and failed jobs that finished more than ``retention_days`` ago."""
+    result = db.session.execute(
+        db.delete(Job).where(Job.status.in_(['succeeded', 'failed']),
+                             Job.finished_at < datetime.now(timezone.utc) - timedelta(days=retention_days))
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def run_worker(poll_interval: float, burst: bool = False) -> None:
+    """
+    Claim and run jobs until SIGTERM/SIGINT (or, with ``burst``, until the queue is empty).
+    The job in progress is always finished before the worker exits.
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    lock_timeout = current_app.config.get('JOB_LOCK_TIMEOUT_SECONDS', 300)
+    retention_days = current_app.config.get('JOB_RETENTION_DAYS', 7)
+    stopping = threading.Event()
+
+    def _stop(signum, frame):
+        logger.info("Job worker %s received signal %s, stopping after the current job", worker_id, signum,
+                    extra=NO_SAMPLE)
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    logger.info("Job worker %s started (handlers: %s)", worker_id, ', '.join(sorted(_handlers)),
+                extra=NO_SAMPLE)
+
+    while not stopping.is_set():
+        job = claim_next(worker_id, lock_timeout)
+        if job is None:
+            if burst:
+                break
+            stopping.wait(poll_interval * random.uniform(0.5, 1.5))
+            continue
+        run_job(job, worker_id)
+        if random.random() < 0.01:
+            prune_finished_jobs(retention_days)
+    logger.info("Job worker %s stopped", worker_id, extra=NO_SAMPLE)
+
+
+def queue_stats() -> list[tuple[str, str, int]]:
+    """Job counts as (kind, status, count) rows."""
+    return db.session.execute(
+        db.select(Job.kind, Job.status, db.func.count()).group_by(Job.kind, Job.status).order_by(Job.kind, Job.status)
+    ).all()
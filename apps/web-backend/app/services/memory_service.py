@@ -0,0 +1,311 @@
+import os
+import re
+import time
+import queue
+import fcntl
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+import numpy as np
+from flask import current_app
+from app.extensions import db
+from app.models import Conversation, Message
+from app.services.admission_service import admit, AdmissionRejected, PRIORITY_GUEST
+from app.services.archive_service import archived_messages_by_conversation
+from app.services.metrics_service import OPENAI_REQUEST_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Rough token estimate used for the recall budget; avoids a tokenizer dependency
+CHARS_PER_TOKEN = 4
+MAX_SNIPPET_CHARS = 400
+# Vectors of deleted conversations stay in the store until the account is deleted, so recall
+# searches this many times k and keeps the best k that still exist
+RECALL_OVERFETCH = 4
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize rows so a dot product is the cosine similarity."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32, copy=False)
+
+
+# --- Embedders ---
+# An embedder has a ``name`` (vectors from different embedders are stored apart), a ``dim``,
+# ``remote`` (calls go through admission control), and
+# ``embed(texts) -> float32 array of shape (len(texts), dim)`` with unit-length rows.
+
+class OpenAIEmbedder:
+    """Embeds text with the OpenAI embeddings API."""
+
+    remote = True
+
+    def __init__(self, client, model: str, dim: int):
+        self.client = client
+        self.model = model
+        self.dim = dim
+        self.name = f"{model}-{dim}"
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        start = time.perf_counter()
+        response = self.client.embeddings.create(model=self.model, input=texts, dimensions=self.dim)
+        OPENAI_REQUEST_SECONDS.labels('embedding', self.model).observe(time.perf_counter() - start)
+        return _normalize(np.asarray([item.embedding for item in response.data], dtype=np.float32))
+
+
+class HashingEmbedder:
+    """
+    Local feature-hashing embedder over word unigrams and bigrams.
+    Deterministic and needs no network, so it suits offline tests and development;
+    it matches shared vocabulary rather than meaning.
+    """
+
+    remote = False
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = _WORD_RE.findall(text.lower())
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), 'little')
+                # The top bit picks the sign, so colliding features tend to cancel out rather than add up
+                vectors[row, digest % self.dim] += 1.0 if digest >> 63 else -1.0
+        return _normalize(vectors)
+
+
+def create_embedder(app):
+    """Build the embedder selected by MEMORY_EMBEDDER ("openai" or "hashing")."""
+    kind = app.config.get('MEMORY_EMBEDDER', 'openai')
+    dim = app.config.get('MEMORY_EMBEDDING_DIMENSIONS', 256)
+    if kind == 'hashing':
+        return HashingEmbedder(dim)
+    if kind == 'openai':
+        if not app.openai_client:
+            return None
+        return OpenAIEmbedder(app.openai_client, app.config.get('MEMORY_EMBEDDING_MODEL', 'text-embedding-3-small'), dim)
+    raise ValueError(f"Unknown MEMORY_EMBEDDER: {kind}")
+
+
+# --- Vector store ---
+class VectorStore:
+    """
+    One append-only file per user of fixed-size (message_id, conversation_id, vector) records.
+
+    Appends take an exclusive flock so gunicorn workers can share the directory. Reads map the
+    file with np.memmap; the mapping is cached per user and reopened when the file has grown,
+    so a search is a single vectorized dot product over pages the OS already has cached.
+    """
+
+    def __init__(self, directory: str, dim: int, max_open: int = 256):
+        self.directory = directory
+        self.dtype = np.dtype([('message_id', '<i8'), ('conversation_id', '<i8'), ('vector', '<f4', (dim,))])
+        self.max_open = max_open
+        self._open: OrderedDict[int, np.memmap] = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, user_id: int) -> str:
+        return os.path.join(self.directory, f"{user_id}.vec")
+
+    def append(self, user_id: int, message_ids: list[int], conversation_ids: list[int], vectors: np.ndarray) -> None:
+        records = np.empty(len(message_ids), dtype=self.dtype)
+        records['message_id'] = message_ids
+        records['conversation_id'] = conversation_ids
+        records['vector'] = vectors
+        with open(self._path(user_id), 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(records.tobytes())
+
+    def _records(self, user_id: int) -> np.memmap | None:
+        try:
+            # Ignore a trailing record another worker is still writing
+            count = os.path.getsize(self._path(user_id)) // self.dtype.itemsize
+        except FileNotFoundError:
+            count = 0
+        with self._lock:
+            records = self._open.get(user_id)
+            if records is not None and len(records) == count:
+                self._open.move_to_end(user_id)
+                return records
+            self._open.pop(user_id, None)
+        if count == 0:
+            return None
+        records = np.memmap(self._path(user_id), dtype=self.dtype, mode='r', shape=(count,))
+        with self._lock:
+            self._open[user_id] = records
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return records
+
+    def search(self, user_id: int, query: np.ndarray, k: int,
+               exclude_conversation_id: int | None = None) -> list[tuple[int, int, float]]:
+        """Top-k records by cosine similarity, best first, as (message_id, conversation_id, score)."""
+        records = self._records(user_id)
+        if records is None or k <= 0:
+            return []
+        scores = records['vector'] @ query
+        if exclude_conversation_id is not None:
+            scores[records['conversation_id'] == exclude_conversation_id] = -np.inf
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(records['message_id'][i]), int(records['conversation_id'][i]), float(scores[i]))
+                for i in top if np.isfinite(scores[i])]
+
+    def forget(self, user_id: int) -> None:
+        with self._lock:
+            self._open.pop(user_id, None)
+        try:
+            os.remove(self._path(user_id))
+        except FileNotFoundError:
+            pass
+
+
+# --- Memory service ---
+class MemoryService:
+    """
+    Cross-conversation recall for signed-in users.
+
+    New messages are queued and embedded by a background thread after the request has
+    committed them, so storing never slows down a turn. Recall embeds the incoming message
+    once (the vector is reused when that message is stored) and searches the user's store.
+    Calls to a remote embedder go through admission control ("embedding" upstream); the
+    background indexer queues at guest priority.
+    """
+
+    def __init__(self, embedder, store: VectorStore, queue_size: int = 1000):
+        self.embedder = embedder
+        self.store = store
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread: threading.Thread | None = None
+        self._thread_lock = threading.Lock()
+
+    def _ensure_worker(self) -> None:
+        # Started lazily so each gunicorn worker gets its own thread after the fork
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='memory-indexer', daemon=True)
+                self._thread.start()
+
+    def _admit(self, priority: int):
+        return admit('embedding', priority) if self.embedder.remote else nullcontext()
+
+    def remember(self, user_id: int, conversation_id: int,
+                 messages: list[tuple[int, str, np.ndarray | None]]) -> None:
+        """Queue ``(message_id, content, vector or None)`` tuples for embedding and storage."""
+        self._ensure_worker()
+        # Created here, in the app context, and entered by the indexer thread
+        admission = self._admit(PRIORITY_GUEST) if any(vector is None for _, _, vector in messages) else nullcontext()
+        try:
+            self._queue.put_nowait((user_id, conversation_id, messages, admission))
+        except queue.Full:
+            logger.warning("Memory queue full; dropping %s messages for user %s", len(messages), user_id)
+
+    def _run(self) -> None:
+        while True:
+            user_id, conversation_id, messages, admission = self._queue.get()
+            try:
+                self._store(user_id, conversation_id, messages, admission)
+            except AdmissionRejected as e:
+                logger.warning("Dropping %s messages for user %s from memory: %s", len(messages), user_id, e)
+            except Exception as e:
+                logger.error("Failed to index memory for user %s: %s", user_id, e, exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    def _store(self, user_id: int, conversation_id: int, messages, admission) -> None:
+        vectors = [vector for _, _, vector in messages]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            with admission:
+                embedded = self.embedder.embed([messages[i][1] for i in missing])
+            for i, vector in zip(missing, embedded):
+                vectors[i] = vector
+        self.store.append(user_id, [message_id for message_id, _, _ in messages],
+                          [conversation_id] * len(messages), np.stack(vectors))
+
+    def embed_query(self, text: str, priority: int = PRIORITY_GUEST) -> np.ndarray:
+        """
+        Raises:
+            AdmissionRejected: If the embeddings API is saturated and the call was shed
+        """
+        with self._admit(priority):
+            return self.embedder.embed([text])[0]
+
+    def recall(self, user_id: int, query: np.ndarray, k: int, min_score: float,
+               exclude_conversation_id: int | None = None) -> list[dict]:
+        """
+        Past messages most similar to ``query``, best first. Hits are re-read from the
+        database, which also drops vectors whose conversation has since been deleted; messages
+        of archived conversations are read from their archive.
+        """
+        hits = [hit for hit in self.store.search(user_id, query, k * RECALL_OVERFETCH, exclude_conversation_id)
+                if hit[2] >= min_score]
+        if not hits:
+            return []
+        rows = db.session.execute(
+            db.select(Message.id, Message.role, Message.content)
+            .join(Conversation, Message.conversation_id == Conversation.id)
+            .where(Message.id.in_([message_id for message_id, _, _ in hits]), Conversation.user_id == user_id)
+        ).all()
+        by_id = {row.id: {"role": row.role, "content": row.content} for row in rows}
+        archived_ids = {conversation_id for message_id, conversation_id, _ in hits if message_id not in by_id}
+        if archived_ids:
+            for messages in archived_messages_by_conversation(user_id, archived_ids).values():
+                for message in messages:
+                    by_id.setdefault(message["id"], message)
+        return [{"role": by_id[message_id]["role"], "content": by_id[message_id]["content"], "score": score}
+                for message_id, _, score in hits if message_id in by_id][:k]
+
+    def forget(self, user_id: int) -> None:
+        self.store.forget(user_id)
+
+
+def format_memory_context(memories: list[dict], token_budget: int) -> str | None:
+    """Render recalled messages as a system prompt block, stopping at ``token_budget`` (estimated)."""
+    lines, used = [], 0
+    for memory in memories:
+        snippet = ' '.join(memory["content"].split())
+        if len(snippet) > MAX_SNIPPET_CHARS:
+            snippet = snippet[:MAX_SNIPPET_CHARS].rsplit(' ', 1)[0] + '…'
+        speaker = "The user" if memory["role"] == 'user' else "You"
+        line = f"- {speaker} said: {snippet}"
+        cost = len(line) // CHARS_PER_TOKEN + 1
+        if used + cost > token_budget:
+            break
+        lines.append(line)
+        used += cost
+    if not lines:
+        return None
+    return ("Excerpts from your earlier conversations with this user. Draw on them only where "
+            "they are relevant, and do not quote them verbatim:\n" + "\n".join(lines))
+
+
+# Global instance to be used across the application
+memory_service = None
+
+
+def get_memory_service() -> MemoryService | None:
+    """Get or create the memory service instance, or None when memory is disabled."""
+    global memory_service
+    if memory_service is None:
+        if not current_app.config.get('MEMORY_ENABLED', False):
+            return None
+        embedder = create_embedder(current_app)
+        if embedder is None:
+            return None
+        directory = current_app.config.get('MEMORY_DIR') or os.path.join(current_app.instance_path, 'memory')
+        memory_service = MemoryService(
+            embedder,
+            VectorStore(os.path.join(directory, embedder.name), embedder.dim),
+            queue_size=current_app.config.get('MEMORY_QUEUE_SIZE', 1000),
+        )
+    return memory_service
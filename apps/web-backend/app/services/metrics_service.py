@@ -0,0 +1,207 @@
+import os
+import time
+import logging
+from flask import request, has_request_context
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets tuned for our request stages: sub-millisecond DB/validation work
+# up to multi-second upstream LLM calls.
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UPSTREAM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 20.0, 30.0, 60.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 50, 100)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'cogito_http_request_duration_seconds',
+    'Total time spent handling an HTTP request',
+    ['endpoint', 'method', 'status'],
+    buckets=STAGE_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    'cogito_request_stage_duration_seconds',
+    'Time spent in a single stage of request handling',
+    ['stage', 'endpoint'],
+    buckets=STAGE_BUCKETS,
+)
+OPENAI_REQUEST_SECONDS = Histogram(
+    'cogito_openai_request_duration_seconds',
+    'Latency of OpenAI API calls',
+    ['operation', 'model'],
+    buckets=UPSTREAM_BUCKETS,
+)
+OPENAI_TTFT_SECONDS = Histogram(
+    'cogito_openai_time_to_first_token_seconds',
+    'Time until the first streamed token arrives from OpenAI',
+    ['model'],
+    buckets=UPSTREAM_BUCKETS,
+)
+OPENAI_TOKENS_TOTAL = Counter(
+    'cogito_openai_tokens_total',
+    'Tokens consumed by OpenAI completions',
+    ['model', 'kind'],
+)
+CACHE_REQUESTS_TOTAL = Counter(
+    'cogito_cache_requests_total',
+    'Cache lookups by cache name and result',
+    ['cache', 'result'],
+)
+RATE_LIMITED_TOTAL = Counter(
+    'cogito_rate_limited_total',
+    'Requests rejected by rate limiting',
+    ['endpoint'],
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    'cogito_db_queries_per_request',
+    'SQL statements issued while handling one HTTP request',
+    ['endpoint'],
+    buckets=QUERY_COUNT_BUCKETS,
+)
+DB_SECONDS_PER_REQUEST = Histogram(
+    'cogito_db_seconds_per_request',
+    'Time spent executing SQL statements while handling one HTTP request',
+    ['endpoint'],
+    buckets=STAGE_BUCKETS,
+)
+DB_QUERY_ALERTS_TOTAL = Counter(
+    'cogito_db_query_alerts_total',
+    'Requests over their query budget (budget) or repeating one statement (repeated)',
+    ['endpoint', 'kind'],
+)
+
+TRANSCRIPTION_AUDIO_BYTES_TOTAL = Counter(
+    'cogito_transcription_audio_bytes_total',
+    'Audio bytes received from clients and uploaded to Whisper after normalization',
+    ['stage'],
+)
+ADMISSION_TOTAL = Counter(
+    'cogito_upstream_admission_total',
+    'Upstream calls by admission outcome (admitted, shed, evicted, timeout)',
+    ['upstream', 'priority', 'outcome'],
+)
+LONG_REQUESTS_REJECTED_TOTAL = Counter(
+    'cogito_long_requests_rejected_total',
+    'Long-lived requests turned away because their per-worker slots were taken',
+    ['kind'],
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    'cogito_upstream_admission_wait_seconds',
+    'Time an upstream call waited for a concurrency slot',
+    ['upstream', 'priority'],
+    buckets=STAGE_BUCKETS,
+)
+
+JOBS_TOTAL = Counter(
+    'cogito_jobs_total',
+    'Background jobs run, by kind and outcome',
+    ['kind', 'outcome'],
+)
+JOB_SECONDS = Histogram(
+    'cogito_job_duration_seconds',
+    'Time spent running a background job',
+    ['kind'],
+    buckets=UPSTREAM_BUCKETS,
+)
+JOB_QUEUE_LAG_SECONDS = Histogram(
+    'cogito_job_queue_lag_seconds',
+    'Delay between a job becoming due and a worker starting it',
+    ['kind'],
+    buckets=UPSTREAM_BUCKETS,
+)
+
+
+def _current_endpoint() -> str:
+    if has_request_context():
+        return request.endpoint or 'unknown'
+    return 'none'
+
+
+class observe_stage:
+    """
+    Context manager that records the duration of a request stage.
+
+    Usage:
+        with observe_stage('db_commit'):
+            db.session.commit()
+    """
+
+    __slots__ = ('stage', 'endpoint', 'start')
+
+    def __init__(self, stage: str, endpoint: str | None = None):
+        self.stage = stage
+        self.endpoint = endpoint
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        STAGE_SECONDS.labels(self.stage, self.endpoint or _current_endpoint()).observe(
+            time.perf_counter() - self.start
+        )
+        return False
+
+
+def record_openai_usage(model: str, usage) -> None:
+    """Add the token counts from an OpenAI ``usage`` object to the token counter."""
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, 'prompt_tokens', None) or 0
+    completion_tokens = getattr(usage, 'completion_tokens', None) or 0
+    if prompt_tokens:
+        OPENAI_TOKENS_TOTAL.labels(model, 'prompt').inc(prompt_tokens)
+    if completion_tokens:
+        OPENAI_TOKENS_TOTAL.labels(model, 'completion').inc(completion_tokens)
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS_TOTAL.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def init_request_metrics(app) -> None:
+    """Register request hooks that time every request and count rate-limit rejections."""
+
+    @app.before_request
+    def _start_request_timer():
+        request.environ['cogito.request_start'] = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        start = request.environ.get('cogito.request_start')
+        if start is not None:
+            endpoint = request.endpoint or 'unknown'
+            HTTP_REQUEST_SECONDS.labels(endpoint, request.method, str(response.status_code)).observe(
+                time.perf_counter() - start
+            )
+            if response.status_code == 429:
+                RATE_LIMITED_TOTAL.labels(endpoint).inc()
+        return response
+
+
+def generate_metrics() -> tuple[bytes, str]:
+    """
+    Render all metrics in the Prometheus text format.
+
+    Under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR, so the
+    scrape aggregates across all workers instead of reporting whichever one answered.
+    """
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_worker_dead(pid: int) -> None:
+    """Clean up a dead gunicorn worker's live metric files (called from gunicorn's child_exit hook)."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,92 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed
+from typing import Iterator
+from flask import current_app
+from openai import OpenAIError
+from app.services.admission_service import admit, AdmissionRejected, PRIORITY_GUEST
+from app.services.metrics_service import OPENAI_REQUEST_SECONDS, record_openai_usage
+
+logger = logging.getLogger(__name__)
+
+# Shared by every panel request in this process, so PANEL_MAX_WORKERS bounds its concurrent
+# OpenAI calls; excess calls queue instead of opening more connections
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def get_panel_executor() -> ThreadPoolExecutor:
+    global _executor
+    # Created lazily so each gunicorn worker gets its own threads after the fork
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=current_app.config.get('PANEL_MAX_WORKERS', 16),
+                                           thread_name_prefix='panel')
+    return _executor
+
+
+def _complete(client, messages: list[dict], settings: dict, admission):
+    # Runs on the executor, outside the app context: everything it needs is passed in
+    with admission:
+        start = time.perf_counter()
+        completion = client.chat.completions.create(messages=messages, **settings)
+        return completion, time.perf_counter() - start
+
+
+def ask_panel(client, prompts: dict[str, list[dict]], user: str, priority: int = PRIORITY_GUEST) -> Iterator[dict]:
+    """
+    Run one chat completion per persona concurrently and yield the results in the order they
+    finish, each either ``{"persona_id", "content", "usage", "model", "latency"}`` or
+    ``{"persona_id", "error"}``.
+    ``prompts`` maps each persona to its OpenAI messages. Personas still running after
+    PANEL_TIMEOUT_SECONDS get an error result, so the panel takes as long as its slowest member.
+    Each call goes through admission control at ``priority``; shed calls carry ``retry_after``.
+    """
+    model = current_app.config.get('OPENAI_MODEL', 'gpt-4-turbo')
+    timeout = current_app.config.get('PANEL_TIMEOUT_SECONDS', 60)
+    settings = {
+        "model": model,
+        "temperature": current_app.config.get('OPENAI_TEMPERATURE', 0.7),
+        "max_tokens": current_app.config.get('OPENAI_MAX_TOKENS', 256),
+        "user": user,
+        "timeout": timeout,
+    }
+    executor = get_panel_executor()
+    futures = {executor.submit(_complete, client, messages, settings, admit('chat', priority)): persona_id
+               for persona_id, messages in prompts.items()}
+    pending = set(futures)
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            pending.discard(future)
+            persona_id = futures[future]
+            try:
+                completion, seconds = future.result()
+            except AdmissionRejected as e:
+                yield {"persona_id": persona_id, "error": "The AI service is busy. Please try again shortly.",
+                       "retry_after": e.retry_after}
+                continue
+            except OpenAIError as e:
+                logger.error("Panel - OpenAI API Error for persona %s: %s", persona_id, e)
+                yield {"persona_id": persona_id, "error": "Error communicating with AI service."}
+                continue
+            except Exception as e:
+                logger.error("Panel - Unexpected error for persona %s: %s", persona_id, e, exc_info=True)
+                yield {"persona_id": persona_id, "error": "An unexpected error occurred."}
+                continue
+            OPENAI_REQUEST_SECONDS.labels('chat', model).observe(seconds)
+            usage = getattr(completion, 'usage', None)
+            record_openai_usage(model, usage)
+            content = (completion.choices[0].message.content or '').strip()
+            if not content:
+                yield {"persona_id": persona_id, "error": "The AI service returned an empty response."}
+                continue
+            yield {"persona_id": persona_id, "content": content, "usage": usage, "model": model, "latency": seconds}
+    except FuturesTimeoutError:
+        for future in pending:
+            logger.warning("Panel - Persona %s did not answer within %ss", futures[future], timeout)
+            yield {"persona_id": futures[future], "error": "The AI service took too long to respond."}
+    finally:
+        # Nothing is waiting for these any more (timed out, or the client went away mid-stream)
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,155 @@
+import os
+import re
+import sys
+import time
+import random
+import logging
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from flask import g, request, current_app
+from app.auth.utils import is_admin_request
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SUFFIX = '.folded'
+_SAFE_NAME_RE = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+class StackSampler(threading.Thread):
+    """
+    Samples the call stack of one thread at a fixed interval.
+
+    Samples are aggregated into the collapsed-stack ("folded") format used by
+    flamegraph.pl and speedscope: one ``frame;frame;frame count`` line per distinct stack.
+    When stopped, the sampler writes its profile to ``output_path`` from its own thread,
+    so the request being profiled never waits on disk I/O.
+    """
+
+    def __init__(self, target_thread_id: int, interval: float, output_path: str, store: 'ProfileStore'):
+        super().__init__(name='request-profiler', daemon=True)
+        self.target_thread_id = target_thread_id
+        self.interval = interval
+        self.output_path = output_path
+        self.store = store
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        this_file = __file__
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.target_thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                if code.co_filename != this_file:
+                    stack.append(f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+        self._write()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _write(self):
+        if not self.stacks:
+            return
+        try:
+            with open(self.output_path, 'w') as f:
+                for stack, count in self.stacks.items():
+                    f.write(f"{stack} {count}\n")
+            self.store.prune()
+        except OSError as e:
+            logger.warning("Could not write profile %s: %s", self.output_path, e)
+
+
+def _short_path(path: str) -> str:
+    """Trim site-packages and repo prefixes so frame names stay readable."""
+    for marker in ('site-packages' + os.sep, 'web-backend' + os.sep):
+        idx = path.rfind(marker)
+        if idx != -1:
+            return path[idx + len(marker):]
+    return os.path.basename(path)
+
+
+class ProfileStore:
+    """Bounded on-disk ring buffer of request profiles."""
+
+    def __init__(self, directory: str, max_files: int):
+        self.directory = directory
+        self.max_files = max_files
+        os.makedirs(directory, exist_ok=True)
+
+    def new_path(self, endpoint: str, request_id: str) -> str:
+        timestamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+        name = _SAFE_NAME_RE.sub('_', f"{timestamp}_{endpoint}_{request_id}")
+        return os.path.join(self.directory, name + PROFILE_SUFFIX)
+
+    def list(self) -> list[dict]:
+        profiles = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(PROFILE_SUFFIX):
+                stat = entry.stat()
+                profiles.append({
+                    'name': entry.name,
+                    'size': stat.st_size,
+                    'created_at': datetime.fromtimestamp(stat.st_mtime, timezone.utc).isoformat(),
+                })
+        profiles.sort(key=lambda p: p['name'], reverse=True)
+        return profiles
+
+    def prune(self):
+        """Delete the oldest profiles beyond ``max_files``."""
+        names = sorted(p['name'] for p in self.list())
+        for name in names[:max(0, len(names) - self.max_files)]:
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+
+def _should_profile() -> bool:
+    if request.headers.get('X-Profile') and is_admin_request():
+        return True
+    sample_rate = current_app.config.get('PROFILING_SAMPLE_RATE', 0.0)
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+def init_profiling(app) -> None:
+    """
+    Register request hooks that profile selected requests.
+
+    A request is profiled when an admin sends ``X-Profile: 1`` or when it is picked by
+    PROFILING_SAMPLE_RATE. The profile name is returned in the ``X-Profile-Id`` header.
+    """
+    if not app.config.get('PROFILING_ENABLED', True):
+        return
+
+    directory = app.config.get('PROFILING_DIR') or os.path.join(app.instance_path, 'profiles')
+    app.profile_store = ProfileStore(directory, app.config.get('PROFILING_MAX_FILES', 50))
+    interval = app.config.get('PROFILING_INTERVAL_MS', 5) / 1000.0
+
+    @app.before_request
+    def _start_profiler():
+        if request.endpoint and request.endpoint.startswith('admin.'):
+            return
+        if not _should_profile():
+            return
+        path = app.profile_store.new_path(request.endpoint or 'unknown', g.get('request_id', f"{time.time_ns()}"))
+        sampler = StackSampler(threading.get_ident(), interval, path, app.profile_store)
+        g.profiler = sampler
+        sampler.start()
+
+    @app.after_request
+    def _add_profile_header(response):
+        sampler = g.get('profiler')
+        if sampler is not None:
+            response.headers['X-Profile-Id'] = os.path.basename(sampler.output_path)
+        return response
+
+    @app.teardown_request
+    def _stop_profiler(exc):
+        sampler = g.pop('profiler', None)
+        if sampler is not None:
+            sampler.stop()
@@ -0,0 +1,113 @@
+import time
+import logging
+from collections import Counter
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.auth.utils import is_admin_request
+from app.services.metrics_service import DB_QUERIES_PER_REQUEST, DB_SECONDS_PER_REQUEST, DB_QUERY_ALERTS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+STATEMENT_LOG_LENGTH = 500
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A request issued more SQL statements than its endpoint's budget (raised with QUERY_BUDGET_STRICT)."""
+
+
+class RequestQueryStats:
+    """SQL statements issued by one request: how many, how long they took, and how often each repeated."""
+
+    __slots__ = ('count', 'seconds', 'statements')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+
+def query_budget(max_queries: int):
+    """
+    Declare the most SQL statements one request to the decorated view may issue.
+    Place it directly under the route decorator; QUERY_BUDGETS overrides it per endpoint.
+    """
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+# On the Engine class, like the SQLite pragma hook in extensions.py, so shard engines are counted too.
+# Both are no-ops outside a request that init_query_stats is tracking.
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and has_request_context() and 'query_stats' in g:
+        context._query_stats_start = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_query_stats_start', None)
+    if start is None:
+        return
+    stats = g.get('query_stats')
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += time.perf_counter() - start
+        # Parameters are bound separately, so an N+1 shows up as one statement text many times
+        stats.statements[statement] += 1
+
+
+def _check_repeats(stats: RequestQueryStats, endpoint: str, threshold: int) -> None:
+    for statement, count in stats.statements.items():
+        # Reads only: rows written one by one are batched into a single executemany on PostgreSQL
+        if count >= threshold and statement.lstrip()[:6].upper().startswith(('SELECT', 'WITH')):
+            DB_QUERY_ALERTS_TOTAL.labels(endpoint, 'repeated').inc()
+            logger.warning("Possible N+1 in %s: statement ran %s times in one request: %s",
+                           endpoint, count, statement[:STATEMENT_LOG_LENGTH])
+
+
+def _check_budget(app, stats: RequestQueryStats, endpoint: str) -> None:
+    budget = app.config.get('QUERY_BUDGETS', {}).get(endpoint)
+    if budget is None:
+        budget = getattr(app.view_functions.get(endpoint), 'query_budget', None)
+    if budget is None or stats.count <= budget:
+        return
+    DB_QUERY_ALERTS_TOTAL.labels(endpoint, 'budget').inc()
+    message = f"{request.method} {endpoint} issued {stats.count} SQL statements, over its budget of {budget}"
+    if app.config.get('QUERY_BUDGET_STRICT', False):
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+def init_query_stats(app) -> None:
+    """
+    Count the SQL statements and database time of every request. Both go to metrics; with
+    QUERY_STATS_HEADER (or an admin X-Admin-Token) they are also returned in X-DB-Queries and
+    Server-Timing headers. Statements repeated QUERY_REPEAT_THRESHOLD times are logged as possible
+    N+1s, and requests over their endpoint's query budget are logged, or fail under QUERY_BUDGET_STRICT.
+
+    Only work done before the response is returned is counted, not the body of a streamed response.
+    """
+    if not app.config.get('QUERY_STATS_ENABLED', True):
+        return
+
+    @app.before_request
+    def _start_query_stats():
+        g.query_stats = RequestQueryStats()
+
+    @app.after_request
+    def _report_query_stats(response):
+        stats = g.pop('query_stats', None)
+        if stats is None:
+            return response
+        endpoint = request.endpoint or 'unknown'
+        DB_QUERIES_PER_REQUEST.labels(endpoint).observe(stats.count)
+        DB_SECONDS_PER_REQUEST.labels(endpoint).observe(stats.seconds)
+        if app.config.get('QUERY_STATS_HEADER', False) or is_admin_request():
+            response.headers['X-DB-Queries'] = str(stats.count)
+            response.headers.add('Server-Timing', f'db;dur={stats.seconds * 1000:.1f};desc="{stats.count} queries"')
+        _check_repeats(stats, endpoint, app.config.get('QUERY_REPEAT_THRESHOLD', 5))
+        _check_budget(app, stats, endpoint)
+        return response
@@ -0,0 +1,156 @@
+import re
+from app.extensions import db
+from app.models import Message
+from app.services.archive_service import archived_messages_by_conversation
+
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_END = '</mark>'
+MAX_QUERY_LENGTH = 200
+
+# Both queries rank message-content, conversation-title and archived-conversation hits together,
+# page in the inner query, and only then build snippets for the rows actually returned.
+# Archived hits have no snippet in SQL; _resolve_archived_hit reads them from the archive.
+SNIPPET_WORDS = 24
+_POSTGRES_SEARCH_SQL = db.text(f"""
+SELECT hits.kind, hits.message_id, hits.conversation_id, hits.rank,
+       c.title, c.persona_id, c.updated_at, m.role, m.timestamp,
+       CASE WHEN hits.kind = 'message'
+            THEN ts_headline('english', m.content, websearch_to_tsquery('english', :query),
+                             'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, MaxWords=24, MinWords=8, MaxFragments=1')
+            WHEN hits.kind = 'title'
+            THEN ts_headline('english', c.title, websearch_to_tsquery('english', :query),
+                             'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, HighlightAll=true')
+       END AS snippet
+FROM (
+    SELECT 'message' AS kind, m.id AS message_id, m.conversation_id AS conversation_id,
+           ts_rank(m.search_vector, q.query) AS rank
+    FROM message m
+    JOIN conversation c ON c.id = m.conversation_id
+    CROSS JOIN websearch_to_tsquery('english', :query) AS q(query)
+    WHERE c.user_id = :user_id AND m.search_vector @@ q.query
+    UNION ALL
+    SELECT 'title', NULL, c.id, ts_rank(c.search_vector, q.query)
+    FROM conversation c
+    CROSS JOIN websearch_to_tsquery('english', :query) AS q(query)
+    WHERE c.user_id = :user_id AND c.search_vector @@ q.query
+    UNION ALL
+    SELECT 'archived', NULL, a.conversation_id, ts_rank(a.search_vector, q.query)
+    FROM conversation_archive a
+    JOIN conversation c ON c.id = a.conversation_id
+    CROSS JOIN websearch_to_tsquery('english', :query) AS q(query)
+    WHERE c.user_id = :user_id AND a.search_vector @@ q.query
+    ORDER BY rank DESC, conversation_id DESC
+    LIMIT :limit OFFSET :offset
+) AS hits
+JOIN conversation c ON c.id = hits.conversation_id
+LEFT JOIN message m ON m.id = hits.message_id
+ORDER BY hits.rank DESC, hits.conversation_id DESC
+""").columns(updated_at=db.DateTime(timezone=True), timestamp=db.DateTime(timezone=True))
+
+# bm25() is "lower is better", so rank is negated to match PostgreSQL's ordering
+_SQLITE_SEARCH_SQL = db.text(f"""
+SELECT hits.kind, hits.message_id, hits.conversation_id, hits.rank,
+       c.title, c.persona_id, c.updated_at, m.role, m.timestamp, hits.snippet
+FROM (
+    SELECT 'message' AS kind, message_fts.rowid AS message_id, m.conversation_id AS conversation_id,
+           -bm25(message_fts) AS rank,
+           snippet(message_fts, 0, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}', '…', 24) AS snippet
+    FROM message_fts
+    JOIN message m ON m.id = message_fts.rowid
+    JOIN conversation c ON c.id = m.conversation_id
+    WHERE message_fts MATCH :query AND c.user_id = :user_id
+    UNION ALL
+    SELECT 'title', NULL, conversation_fts.rowid, -bm25(conversation_fts),
+           highlight(conversation_fts, 0, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}')
+    FROM conversation_fts
+    JOIN conversation c ON c.id = conversation_fts.rowid
+    WHERE conversation_fts MATCH :query AND c.user_id = :user_id
+    UNION ALL
+    SELECT 'archived', NULL, conversation_archive_fts.rowid, -bm25(conversation_archive_fts), NULL
+    FROM conversation_archive_fts
+    JOIN conversation c ON c.id = conversation_archive_fts.rowid
+    WHERE conversation_archive_fts MATCH :query AND c.user_id = :user_id
+    ORDER BY rank DESC, conversation_id DESC
+    LIMIT :limit OFFSET :offset
+) AS hits
+JOIN conversation c ON c.id = hits.conversation_id
+LEFT JOIN message m ON m.id = hits.message_id
+ORDER BY hits.rank DESC, hits.conversation_id DESC
+""").columns(updated_at=db.DateTime(timezone=True), timestamp=db.DateTime(timezone=True))
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class SearchNotSupportedError(Exception):
+    """Raised when the database has no full-text index we know how to query."""
+
+
+def _fts5_query(raw_query: str) -> str:
+    """Turn free text into an FTS5 query of quoted terms (implicit AND), so user input can't hit FTS5 syntax."""
+    return ' '.join(f'"{word}"' for word in _WORD_RE.findall(raw_query))
+
+
+def _term_prefixes(raw_query: str) -> list[str]:
+    # Word prefixes stand in for the stemming the full-text index did ("running" finds "runs")
+    return [word[:max(4, len(word) - 2)] for word in _WORD_RE.findall(raw_query.lower())]
+
+
+def _highlight(content: str, prefixes: list[str]) -> str | None:
+    """A window of SNIPPET_WORDS words around the first matching word, matches marked; None if nothing matches."""
+    words = content.split()
+    matches = [any(word.lower().lstrip('"\'(').startswith(prefix) for prefix in prefixes) for word in words]
+    if not any(matches):
+        return None
+    start = max(0, matches.index(True) - SNIPPET_WORDS // 3)
+    end = start + SNIPPET_WORDS
+    marked = [f'{HIGHLIGHT_START}{word}{HIGHLIGHT_END}' if match else word
+              for word, match in zip(words[start:end], matches[start:end])]
+    return ('…' if start else '') + ' '.join(marked) + ('…' if end < len(words) else '')
+
+
+def _resolve_archived_hit(hit: dict, messages: list[dict], prefixes: list[str]) -> dict:
+    """Turn a hit on an archived conversation into a message hit, picking the message from the archive."""
+    for message in messages:
+        snippet = _highlight(message["content"], prefixes)
+        if snippet is not None:
+            break
+    else:
+        if not messages:
+            return hit
+        message = messages[0]
+        snippet = ' '.join(message["content"].split()[:SNIPPET_WORDS])
+    return {**hit, "kind": "message", "message_id": message["id"], "role": message["role"],
+            "timestamp": message["timestamp"], "snippet": snippet}
+
+
+def search_history(user_id: int, raw_query: str, limit: int, offset: int) -> list[dict]:
+    """
+    Full-text search over one user's message contents and conversation titles, best match first.
+    Archived conversations are matched as a whole; the best message is then picked from the
+    archive, so they come back as ordinary message hits.
+
+    Uses the tsvector/GIN indexes on PostgreSQL and the FTS5 tables on SQLite; any other
+    database raises SearchNotSupportedError rather than falling back to a LIKE scan.
+    """
+    # Raw SQL names no mapped entity, so point the session at the (possibly sharded) message table
+    bind_arguments = {"mapper": Message}
+    dialect = db.session.get_bind(**bind_arguments).dialect.name
+    if dialect == 'postgresql':
+        statement, query = _POSTGRES_SEARCH_SQL, raw_query
+    elif dialect == 'sqlite':
+        statement, query = _SQLITE_SEARCH_SQL, _fts5_query(raw_query)
+        if not query:
+            return []
+    else:
+        raise SearchNotSupportedError(dialect)
+
+    rows = db.session.execute(statement, {
+        "query": query, "user_id": user_id, "limit": limit, "offset": offset,
+    }, bind_arguments=bind_arguments).mappings().all()
+    archived = [row["conversation_id"] for row in rows if row["kind"] == 'archived']
+    if not archived:
+        return [dict(row) for row in rows]
+    messages = archived_messages_by_conversation(user_id, archived)
+    prefixes = _term_prefixes(raw_query)
+    return [_resolve_archived_hit(dict(row), messages.get(row["conversation_id"], []), prefixes)
+            if row["kind"] == 'archived' else dict(row) for row in rows]
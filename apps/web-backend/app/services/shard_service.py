@@ -0,0 +1,124 @@
+import logging
+import sqlalchemy as sa
+from flask import current_app
+from app.extensions import db
+from app.logging_setup import NO_SAMPLE
+from app.sharding import INTERLEAVED_ID_TABLES, shard_names, shard_engine, shard_for_user, id_offset, next_interleaved_id
+
+logger = logging.getLogger(__name__)
+
+# Insert order respects foreign keys; the user row is copied first
+COPY_ORDER = ('conversation', 'conversation_archive', 'message', 'message_usage', 'conversation_tombstone')
+
+
+def locations() -> list[tuple[str, sa.Engine]]:
+    """Every database that can hold conversation data: the shards, plus the main database if it is not one."""
+    found = [(shard, shard_engine(shard)) for shard in shard_names()]
+    if all(engine is not db.engine for _, engine in found):
+        found.insert(0, ('main', db.engine))
+    return found
+
+
+def _user_filter(table: sa.Table, user_id: int):
+    if 'user_id' in table.c:
+        return table.c.user_id == user_id
+    conversation = db.metadata.tables['conversation']
+    return table.c.conversation_id.in_(sa.select(conversation.c.id).where(conversation.c.user_id == user_id))
+
+
+def _copy_key(table: sa.Table) -> sa.Column:
+    # Tombstone ids are shard-local, so a tombstone is matched (and copied) by its conversation instead
+    return table.c.conversation_id if table.name == 'conversation_tombstone' else table.primary_key.columns[0]
+
+
+def misplaced_users(engine: sa.Engine) -> list[int]:
+    """Users with data on ``engine`` whose shard, under the current shard map, is elsewhere."""
+    tables = db.metadata.tables
+    user_ids = sa.union(
+        sa.select(tables['conversation'].c.user_id),
+        sa.select(tables['conversation_tombstone'].c.user_id),
+    )
+    with engine.connect() as connection:
+        found = connection.scalars(user_ids).all()
+        if engine is not db.engine:
+            # Users copied here earlier who no longer have conversations on this shard
+            found = set(found) | set(connection.scalars(sa.select(tables['user'].c.id)).all())
+    return sorted(user_id for user_id in found if shard_engine(shard_for_user(user_id)) is not engine)
+
+
+def move_user(user_id: int, source: sa.Engine, target: sa.Engine, batch_size: int = 1000) -> dict[str, int]:
+    """
+    Copy a user's conversation data from ``source`` to ``target`` with the same ids, then delete it
+    from ``source``. Rows already on the target (written after the shard map changed, or copied by
+    an interrupted run) are left alone, so a move can be retried.
+    """
+    tables = db.metadata.tables
+    user = tables['user']
+    moved = {}
+    # The target commits first (inner block): a crash in between leaves a copy behind, never a loss
+    with source.begin() as src, target.begin() as dest:
+        user_row = src.execute(sa.select(user.c.id, user.c.firebase_uid, user.c.created_at)
+                               .where(user.c.id == user_id)).first()
+        if user_row is None:
+            return moved
+        if dest.execute(sa.select(user.c.id).where(user.c.id == user_id)).first() is None:
+            dest.execute(sa.insert(user).values(**user_row._asdict()))
+
+        for name in COPY_ORDER:
+            table = tables[name]
+            key = _copy_key(table)
+            existing = set(dest.scalars(sa.select(key).where(_user_filter(table, user_id))).all())
+            columns = [column for column in table.c if not (name == 'conversation_tombstone' and column.primary_key)]
+            rows = src.execute(sa.select(*columns).where(_user_filter(table, user_id)),
+                               execution_options={"yield_per": batch_size})
+            moved[name] = 0
+            for partition in rows.mappings().partitions():
+                batch = [dict(row) for row in partition if row[key.name] not in existing]
+                if batch:
+                    dest.execute(sa.insert(table), batch)
+                    moved[name] += len(batch)
+
+        # ON DELETE CASCADE takes the messages and archives along with the conversations
+        src.execute(sa.delete(tables['conversation']).where(tables['conversation'].c.user_id == user_id))
+        src.execute(sa.delete(tables['conversation_tombstone'])
+                    .where(tables['conversation_tombstone'].c.user_id == user_id))
+        if source is not db.engine:
+            src.execute(sa.delete(user).where(user.c.id == user_id))
+    return moved
+
+
+def rebalance(batch_size: int = 1000, dry_run: bool = False) -> dict[tuple[str, str], int]:
+    """Move every misplaced user to their shard. Returns the number of users per (source, target)."""
+    summary: dict[tuple[str, str], int] = {}
+    for source_name, source in locations():
+        for user_id in misplaced_users(source):
+            target_name = shard_for_user(user_id)
+            if not dry_run:
+                moved = move_user(user_id, source, shard_engine(target_name), batch_size=batch_size)
+                logger.info("Moved user %s from %s to %s: %s", user_id, source_name, target_name, moved, extra=NO_SAMPLE)
+            summary[(source_name, target_name)] = summary.get((source_name, target_name), 0) + 1
+    return summary
+
+
+def init_id_sequences() -> list[str]:
+    """
+    Interleave the conversation and message id sequences of PostgreSQL shards (see SHARD_ID_STRIDE).
+    Idempotent; SQLite shards need nothing, their ids are assigned by the application.
+    """
+    stride = current_app.config['SHARD_ID_STRIDE']
+    changed = []
+    for shard in shard_names():
+        engine = shard_engine(shard)
+        if engine.dialect.name != 'postgresql':
+            continue
+        offset = id_offset(engine)
+        with engine.begin() as connection:
+            for name in INTERLEAVED_ID_TABLES:
+                sequence = connection.scalar(sa.text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": name})
+                highest = connection.scalar(sa.select(sa.func.max(db.metadata.tables[name].c.id))) or 0
+                # The sequence name comes from the catalog, already quoted
+                connection.execute(sa.text(
+                    f"ALTER SEQUENCE {sequence} INCREMENT BY {stride} "
+                    f"RESTART WITH {next_interleaved_id(highest, offset, stride)}"))
+                changed.append(f"{shard}.{name}")
+    return changed
@@ -0,0 +1,131 @@
+import random
+from datetime import datetime, timezone, timedelta
+from app.extensions import db
+from app.models import Conversation, Message, ConversationTombstone
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class CursorError(ValueError):
+    """Raised for malformed cursors."""
+
+
+class CursorExpiredError(Exception):
+    """Raised when a cursor predates tombstone retention, so deletes may have been missed."""
+
+
+def encode_cursor(moment: datetime, after_message_id: int | None = None) -> str:
+    moment = _as_utc(moment)
+    delta = moment - EPOCH
+    micros = str((delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds)
+    return micros if after_message_id is None else f"{micros}_{after_message_id}"
+
+
+def decode_cursor(cursor: str | None) -> tuple[datetime, int | None]:
+    """
+    Decode a cursor returned by a previous sync into ``(since, after_message_id)``. A missing
+    cursor means "from the beginning". ``after_message_id`` is only set when a page ended
+    partway through messages sharing one timestamp.
+    """
+    if not cursor:
+        return EPOCH, None
+    micros, _, after_message_id = cursor.partition('_')
+    try:
+        micros = int(micros)
+        after_message_id = int(after_message_id) if after_message_id else None
+    except ValueError:
+        raise CursorError("Invalid sync cursor.")
+    if micros < 0:
+        raise CursorError("Invalid sync cursor.")
+    return EPOCH + timedelta(microseconds=micros), after_message_id
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes even for timezone-aware columns
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def record_tombstones(user_id: int, conversation_ids: list[int] | None = None) -> None:
+    """
+    Record deletes for /sync. Call in the delete transaction, before the rows are removed.
+    With ``conversation_ids=None`` every conversation of the user is tombstoned in one
+    INSERT ... SELECT.
+    """
+    now = datetime.now(timezone.utc)
+    select_ids = db.select(Conversation.user_id, Conversation.id, db.literal(now)).where(
+        Conversation.user_id == user_id)
+    if conversation_ids is not None:
+        select_ids = select_ids.where(Conversation.id.in_(conversation_ids))
+    db.session.execute(
+        db.insert(ConversationTombstone).from_select(['user_id', 'conversation_id', 'deleted_at'], select_ids)
+    )
+
+
+def prune_tombstones(retention_days: int) -> None:
+    db.session.execute(
+        db.delete(ConversationTombstone).where(
+            ConversationTombstone.deleted_at < datetime.now(timezone.utc) - timedelta(days=retention_days))
+    )
+
+
+def collect_changes(user_id: int, since: datetime, page_size: int, lag_seconds: float,
+                    retention_days: int, after_message_id: int | None = None) -> dict:
+    """
+    Gather a user's conversations, messages and deletes that changed after ``since``
+    (messages at exactly ``since`` too, if their id is above ``after_message_id``).
+
+    The window ends ``lag_seconds`` in the past, so rows from transactions still committing
+    at query time are picked up by the next sync instead of being skipped. Messages are
+    paged by ``page_size``; when a page is full, ``has_more`` is set and the cursor stops
+    just before the first message that didn't fit. If a whole page shares one timestamp,
+    the cursor also carries the last message id, and the next page continues at that timestamp.
+    """
+    now = datetime.now(timezone.utc)
+    if since > EPOCH and since < now - timedelta(days=retention_days):
+        raise CursorExpiredError()
+    if random.random() < 0.01:
+        prune_tombstones(retention_days)
+    upper = max(since, now - timedelta(seconds=lag_seconds))
+
+    after_since = Message.timestamp > since
+    if after_message_id is not None:
+        after_since = db.or_(after_since, db.and_(Message.timestamp == since, Message.id > after_message_id))
+    messages = db.session.execute(
+        db.select(Message.id, Message.conversation_id, Message.role, Message.content, Message.timestamp)
+        .join(Conversation, Message.conversation_id == Conversation.id)
+        .where(Conversation.user_id == user_id, after_since, Message.timestamp <= upper)
+        .order_by(Message.timestamp, Message.id)
+        .limit(page_size + 1)
+    ).all()
+    has_more = len(messages) > page_size
+    cursor_message_id = None
+    if has_more:
+        boundary = messages[page_size].timestamp
+        kept = [m for m in messages if m.timestamp < boundary]
+        if kept:
+            messages = kept
+            upper = boundary - timedelta(microseconds=1)
+        else:
+            # Every message of the page has the boundary timestamp: resume after the last one by id
+            messages = messages[:page_size]
+            upper = boundary
+            cursor_message_id = messages[-1].id
+
+    conversations = db.session.scalars(
+        db.select(Conversation)
+        .where(Conversation.user_id == user_id, Conversation.updated_at > since, Conversation.updated_at <= upper)
+        .order_by(Conversation.updated_at)
+    ).all()
+    deleted_ids = db.session.scalars(
+        db.select(ConversationTombstone.conversation_id)
+        .where(ConversationTombstone.user_id == user_id,
+               ConversationTombstone.deleted_at > since, ConversationTombstone.deleted_at <= upper)
+    ).all()
+
+    return {
+        "conversations": conversations,
+        "messages": messages,
+        "deleted_conversation_ids": sorted(set(deleted_ids)),
+        "cursor": encode_cursor(upper, cursor_message_id),
+        "has_more": has_more,
+    }
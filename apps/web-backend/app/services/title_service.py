@@ -0,0 +1,76 @@
+import time
+import logging
+from flask import current_app
+from app.extensions import db
+from app.logging_setup import NO_SAMPLE
+from app.models import Conversation, Message
+from app.sharding import route_to_user
+from app.services.history_cache import bump_history_version
+from app.services.job_service import job_handler
+from app.services.metrics_service import OPENAI_REQUEST_SECONDS, record_openai_usage
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER_TITLE_LENGTH = 80
+TITLE_MAX_LENGTH = 100  # Conversation.title column size
+TITLE_CONTEXT_CHARS = 1000
+
+TITLE_PROMPT = (
+    "You write short titles for conversations. Reply with the title only: "
+    "at most six words, no quotes and no trailing punctuation."
+)
+
+
+def placeholder_title(first_user_message: str) -> str:
+    """The title a conversation gets on creation, before generate_title replaces it."""
+    return first_user_message[:PLACEHOLDER_TITLE_LENGTH]
+
+
+@job_handler('generate_title')
+def generate_title(conversation_id: int, user_id: int | None = None) -> None:
+    """Replace a conversation's placeholder title with an LLM-written one, unless the user renamed it."""
+    if user_id is not None:
+        route_to_user(user_id)
+    conversation = db.session.get(Conversation, conversation_id)
+    if conversation is None:
+        return  # Deleted before the job ran
+    first_messages = db.session.execute(
+        db.select(Message.role, Message.content)
+        .filter_by(conversation_id=conversation_id)
+        .order_by(Message.timestamp, Message.id)
+        .limit(2)
+    ).all()
+    if not first_messages or first_messages[0].role != 'user':
+        return
+    placeholder = placeholder_title(first_messages[0].content)
+    if conversation.title != placeholder:
+        return
+
+    client = current_app.openai_client
+    if not client:
+        raise RuntimeError("OpenAI client not initialized")
+    model = current_app.config.get('TITLE_MODEL') or current_app.config.get('OPENAI_MODEL', 'gpt-4-turbo')
+    transcript = "\n".join(f"{msg.role.capitalize()}: {msg.content[:TITLE_CONTEXT_CHARS]}" for msg in first_messages)
+    start = time.perf_counter()
+    completion = client.chat.completions.create(
+        model=model,
+        messages=[{"role": "system", "content": TITLE_PROMPT}, {"role": "user", "content": transcript}],
+        temperature=0.3,
+        max_tokens=20,
+    )
+    OPENAI_REQUEST_SECONDS.labels('title', model).observe(time.perf_counter() - start)
+    record_openai_usage(model, getattr(completion, 'usage', None))
+    title = (completion.choices[0].message.content or '').strip().strip('"\'').rstrip('.').strip()[:TITLE_MAX_LENGTH]
+    if not title:
+        return
+
+    # Conditional on the placeholder, so a rename that lands while we waited on OpenAI wins
+    updated = db.session.execute(
+        db.update(Conversation)
+        .where(Conversation.id == conversation_id, Conversation.title == placeholder)
+        .values(title=title),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    if updated:
+        bump_history_version(conversation.user_id)
+        logger.info("Generated title for conversation %s", conversation_id, extra=NO_SAMPLE)
@@ -1,92 +1,158 @@
 import os
+import uuid
 import tempfile
 import logging
+from datetime import datetime, timezone
 from typing import Optional
 from werkzeug.datastructures import FileStorage
 from flask import current_app
 import openai
+import time
+from app.extensions import db
+from app.logging_setup import NO_SAMPLE
+from app.models import Job, TranscriptionJob
+from app.services.admission_service import admit, AdmissionRejected, PRIORITY_GUEST
+from app.services.audio_service import ffmpeg_path, normalize_audio
+from app.services.job_service import enqueue, job_handler, PermanentJobError
+from app.services.metrics_service import OPENAI_REQUEST_SECONDS, TRANSCRIPTION_AUDIO_BYTES_TOTAL
+from app.services.upload_service import audio_path, discard_upload, move_audio, save_audio
 
 logger = logging.getLogger(__name__)
 
+# File extension per MIME type, so Whisper is told the real container format
+AUDIO_SUFFIXES = {
+    'audio/mpeg': '.mp3',
+    'audio/wav': '.wav',
+    'audio/m4a': '.m4a',
+    'audio/mp4': '.m4a',
+    'audio/webm': '.webm',
+}
+
+def audio_suffix(content_type: Optional[str], filename: Optional[str]) -> str:
+    suffix = AUDIO_SUFFIXES.get(content_type)
+    if suffix:
+        return suffix
+    _, extension = os.path.splitext(filename or '')
+    return extension.lower()[:10] or '.m4a'
+
 class TranscriptionService:
     """Service for transcribing audio files using OpenAI Whisper API"""
-    
+
     def __init__(self):
         self.client = openai.OpenAI(api_key=current_app.config['OPENAI_API_KEY'])
         self.max_file_size = current_app.config['MAX_AUDIO_FILE_SIZE']
+        self.max_upload_size = current_app.config.get('MAX_AUDIO_UPLOAD_SIZE', self.max_file_size)
         self.allowed_formats = current_app.config['ALLOWED_AUDIO_FORMATS']
-    
+
+    @property
+    def upload_limit(self) -> int:
+        """Largest accepted upload: bigger than Whisper's limit when ffmpeg can shrink it first."""
+        return max(self.max_upload_size, self.max_file_size) if ffmpeg_path() else self.max_file_size
+
     def validate_audio_file(self, audio_file: FileStorage) -> None:
         """
         Validate the uploaded audio file
-        
+
         Args:
             audio_file: The uploaded file from Flask request
-            
+
         Raises:
             ValueError: If file validation fails
         """
         if not audio_file or not audio_file.filename:
             raise ValueError("No audio file provided")
-        
+
         # Check file size
         if hasattr(audio_file, 'content_length') and audio_file.content_length:
-            if audio_file.content_length > self.max_file_size:
-                raise ValueError(f"File too large. Maximum size is {self.max_file_size} bytes")
-        
+            if audio_file.content_length > self.upload_limit:
+                raise ValueError(f"File too large. Maximum size is {self.upload_limit} bytes")
+
         # Check file format by MIME type
         if audio_file.content_type not in self.allowed_formats:
             raise ValueError(f"Unsupported audio format. Allowed: {', '.join(self.allowed_formats)}")
-    
-    def transcribe_audio(self, audio_file: FileStorage) -> str:
+
+    @staticmethod
+    def audio_suffix(audio_file: FileStorage) -> str:
+        return audio_suffix(audio_file.content_type, audio_file.filename)
+
+    def save_upload(self, audio_file: FileStorage, directory: str) -> str:
+        """
+        Validate the upload and save it into ``directory``.
+
+        Returns:
+            str: Path of the saved file
+
+        Raises:
+            ValueError: If file validation fails
+        """
+        self.validate_audio_file(audio_file)
+        path = os.path.join(directory, "upload" + self.audio_suffix(audio_file))
+        audio_file.seek(0)  # Ensure we're at the beginning of the file
+        audio_file.save(path)
+        # Multipart parts rarely declare a length, so check what actually arrived
+        if os.path.getsize(path) > self.upload_limit:
+            raise ValueError(f"File too large. Maximum size is {self.upload_limit} bytes")
+        return path
+
+    def transcribe_file(self, path: str, priority: int = PRIORITY_GUEST) -> str:
+        """
+        Transcribe a saved audio file with Whisper. The file is normalized first (see
+        audio_service.normalize_audio), so Whisper usually receives a much smaller 16 kHz mono
+        Opus file; the normalized copy is written next to ``path``.
+
+        Raises:
+            ValueError: If the audio is still over Whisper's size limit after normalization
+            AdmissionRejected: If Whisper is saturated and the call was shed
+            openai.OpenAIError: If the Whisper call fails
+        """
+        received_size = os.path.getsize(path)
+        upload_path = normalize_audio(path)
+        upload_size = os.path.getsize(upload_path)
+        if upload_size > self.max_file_size:
+            raise ValueError("Recording too long to transcribe. Please send a shorter recording.")
+        TRANSCRIPTION_AUDIO_BYTES_TOTAL.labels('received').inc(received_size)
+        TRANSCRIPTION_AUDIO_BYTES_TOTAL.labels('uploaded').inc(upload_size)
+
+        # Call OpenAI Whisper API
+        with admit('transcription', priority), open(upload_path, "rb") as audio_data:
+            whisper_start = time.perf_counter()
+            transcript = self.client.audio.transcriptions.create(
+                model="whisper-1",
+                file=audio_data,
+                response_format="text"
+            )
+            OPENAI_REQUEST_SECONDS.labels('transcription', 'whisper-1').observe(
+                time.perf_counter() - whisper_start)
+        return transcript.strip() if transcript else ""
+
+    def transcribe_audio(self, audio_file: FileStorage, priority: int = PRIORITY_GUEST) -> str:
         """
         Transcribe audio file using OpenAI Whisper API
-        
+
         Args:
             audio_file: The uploaded audio file
-            
+            priority: Admission priority of the caller (see admission_service)
+
         Returns:
             str: The transcribed text
-            
+
         Raises:
             ValueError: If file validation fails
+            AdmissionRejected: If Whisper is saturated and the call was shed
             Exception: If transcription fails
         """
         try:
-            # Validate the file first
-            self.validate_audio_file(audio_file)
-            
-            # Create temporary file for OpenAI API
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".m4a") as temp_file:
-                # Read and write audio data
-                audio_file.seek(0)  # Ensure we're at the beginning of the file
-                temp_file.write(audio_file.read())
-                temp_file.flush()
-                
-                try:
-                    # Call OpenAI Whisper API
-                    with open(temp_file.name, "rb") as audio_data:
-                        transcript = self.client.audio.transcriptions.create(
-                            model="whisper-1",
-                            file=audio_data,
-                            response_format="text"
-                        )
-                    
-                    logger.info(f"Successfully transcribed audio file: {audio_file.filename}")
-                    return transcript.strip() if transcript else ""
-                    
-                finally:
-                    # Clean up temporary file
-                    try:
-                        os.unlink(temp_file.name)
-                    except OSError as e:
-                        logger.warning(f"Could not delete temporary file {temp_file.name}: {e}")
-                        
-        except ValueError:
-            # Re-raise validation errors
+            # The upload and its normalized copy share a temporary directory, removed afterwards
+            with tempfile.TemporaryDirectory(prefix="transcribe-") as directory:
+                transcript = self.transcribe_file(self.save_upload(audio_file, directory), priority)
+            logger.info("Successfully transcribed audio file: %s", audio_file.filename)
+            return transcript
+
+        except (ValueError, AdmissionRejected):
+            # Re-raise validation errors and load shedding
             raise
         except Exception as e:
-            logger.error(f"Transcription failed for file {audio_file.filename}: {str(e)}")
+            logger.error("Transcription failed for file %s: %s", audio_file.filename, e)
             raise Exception("Failed to transcribe audio. Please try again.")
 
 # Global instance to be used across the application
@@ -97,4 +163,139 @@ def get_transcription_service() -> TranscriptionService:
     global transcription_service
     if transcription_service is None:
         transcription_service = TranscriptionService()
-    return transcription_service 
\ No newline at end of file
+    return transcription_service
+
+
+def submit_transcription(audio_file: FileStorage, owner_uid: Optional[str] = None,
+                         priority: int = PRIORITY_GUEST) -> TranscriptionJob:
+    """
+    Store a validated upload and queue it for a job worker to transcribe (see run_transcription).
+
+    Raises:
+        ValueError: If file validation fails
+    """
+    service = get_transcription_service()
+    service.validate_audio_file(audio_file)
+    audio_file.seek(0)
+    transcription_id = uuid.uuid4().hex
+    stored_path, size = save_audio(transcription_id, service.audio_suffix(audio_file), audio_file.stream,
+                                   service.upload_limit)
+    try:
+        return _queue_transcription(transcription_id, stored_path, size, audio_file.filename, owner_uid, priority)
+    except Exception:
+        discard_upload(transcription_id)
+        raise
+
+
+def submit_transcription_file(path: str, filename: str, owner_uid: Optional[str] = None,
+                              priority: int = PRIORITY_GUEST) -> TranscriptionJob:
+    """
+    Queue an audio file in the upload directory (a claimed resumable upload) like
+    submit_transcription. The file is moved, not copied; if queueing fails it is moved back,
+    so the upload can be released and finalized again.
+    """
+    transcription_id = uuid.uuid4().hex
+    stored_path, size = move_audio(transcription_id, path)
+    try:
+        return _queue_transcription(transcription_id, stored_path, size, filename, owner_uid, priority)
+    except Exception:
+        os.rename(audio_path(stored_path), path)
+        discard_upload(transcription_id)
+        raise
+
+
+def _queue_transcription(transcription_id: str, stored_path: str, size: int, filename: str,
+                         owner_uid: Optional[str], priority: int) -> TranscriptionJob:
+    job = enqueue('transcribe_audio', {"transcription_id": transcription_id},
+                  max_attempts=current_app.config.get('TRANSCRIPTION_JOB_MAX_ATTEMPTS', 3))
+    transcription = TranscriptionJob(
+        id=transcription_id,
+        job=job,
+        owner_uid=owner_uid,
+        filename=filename[:255],
+        suffix=os.path.splitext(stored_path)[1][:10],
+        priority=priority,
+        audio_path=stored_path,
+        audio_size=size,
+    )
+    db.session.add(transcription)
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    logger.info("Queued transcription %s of %s (%s bytes)", transcription.id, filename, size)
+    return transcription
+
+
+@job_handler('transcribe_audio')
+def run_transcription(transcription_id: str) -> None:
+    """
+    Transcribe a stored upload. Rejected audio is recorded as the result; other failures (Whisper
+    errors, load shedding) propagate so the job is retried, up to TRANSCRIPTION_JOB_MAX_ATTEMPTS.
+    The stored audio is removed once the result is committed.
+    """
+    transcription = db.session.get(TranscriptionJob, transcription_id)
+    if transcription is None or transcription.audio_path is None:
+        return  # Pruned, or finished by an earlier attempt
+    path = audio_path(transcription.audio_path)
+    if not os.path.exists(path):
+        # Pruned after TRANSCRIPTION_UPLOAD_TTL_HOURS, or TRANSCRIPTION_UPLOAD_DIR is not shared with this worker
+        raise PermanentJobError(f"Audio of transcription {transcription_id} not found at {path}")
+    try:
+        transcription.transcript = get_transcription_service().transcribe_file(path, transcription.priority)
+    except ValueError as e:
+        transcription.error_code, transcription.error = 'VALIDATION_ERROR', str(e)[:255]
+    transcription.audio_path = None
+    transcription.finished_at = datetime.now(timezone.utc)
+    db.session.commit()
+    discard_upload(transcription_id)
+    logger.info("Transcribed %s (%s)", transcription_id, transcription.filename, extra=NO_SAMPLE)
+
+
+def delete_transcriptions(owner_uid: str) -> list[str]:
+    """
+    Delete a user's transcriptions and their queue jobs, in the caller's transaction. Returns
+    their ids; remove their stored audio with discard_upload once the caller has committed.
+    """
+    rows = db.session.execute(
+        db.select(TranscriptionJob.id, TranscriptionJob.job_id).where(TranscriptionJob.owner_uid == owner_uid)
+    ).all()
+    if rows:
+        db.session.execute(db.delete(TranscriptionJob).where(TranscriptionJob.owner_uid == owner_uid),
+                           execution_options={"synchronize_session": False})
+        db.session.execute(db.delete(Job).where(Job.id.in_([job_id for _, job_id in rows])),
+                           execution_options={"synchronize_session": False})
+    return [transcription_id for transcription_id, _ in rows]
+
+
+def transcription_status(transcription: TranscriptionJob) -> str:
+    """queued, running, succeeded or failed."""
+    if transcription.transcript is not None:
+        return 'succeeded'
+    # A queue job that ended without a transcript either rejected the audio or gave up retrying
+    return transcription.job.status if transcription.job.status in ('queued', 'running') else 'failed'
+
+
+def wait_for_transcription(transcription_id: str, wait: float = 0) -> TranscriptionJob | None:
+    """
+    Load a transcription job, polling for up to ``wait`` seconds (capped at
+    TRANSCRIPTION_MAX_WAIT_SECONDS) until it has finished.
+    """
+    deadline = time.monotonic() + min(max(wait, 0), current_app.config.get('TRANSCRIPTION_MAX_WAIT_SECONDS', 25))
+    interval = current_app.config.get('TRANSCRIPTION_POLL_INTERVAL_SECONDS', 0.5)
+    while True:
+        transcription = db.session.scalars(
+            db.select(TranscriptionJob)
+            .options(db.joinedload(TranscriptionJob.job))
+            .where(TranscriptionJob.id == transcription_id)
+            .execution_options(populate_existing=True)
+        ).first()
+        if transcription is None or transcription_status(transcription) in ('succeeded', 'failed'):
+            return transcription
+        if time.monotonic() >= deadline:
+            return transcription
+        # End the transaction between polls, so the next read sees the worker's commit and
+        # the connection goes back to the pool while this thread sleeps
+        db.session.rollback()
+        time.sleep(interval)
@@ -0,0 +1,210 @@
+import os
+import re
+import json
+import time
+import uuid
+import fcntl
+import random
+import shutil
+import logging
+import tempfile
+from flask import current_app
+from app.logging_setup import NO_SAMPLE
+
+logger = logging.getLogger(__name__)
+
+# Request bodies are copied to disk in blocks of this size, never held whole in memory
+COPY_BLOCK_SIZE = 64 * 1024
+_UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+META_FILE = "meta.json"
+DATA_FILE = "upload"
+CLAIMED_FILE = "audio"
+
+
+class UploadOffsetMismatch(Exception):
+    """A chunk was sent for an offset other than the upload's current length."""
+
+    def __init__(self, offset: int):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+
+def upload_root() -> str:
+    """TRANSCRIPTION_UPLOAD_DIR; the per-machine temporary directory fallback only suits development and tests."""
+    return current_app.config.get('TRANSCRIPTION_UPLOAD_DIR') or os.path.join(tempfile.gettempdir(), "cogito-uploads")
+
+
+def _upload_dir(upload_id: str) -> str | None:
+    # Ids become path components, so anything but our own format is refused
+    if not _UPLOAD_ID_RE.match(upload_id):
+        return None
+    return os.path.join(upload_root(), upload_id)
+
+
+def create_upload(filename: str, content_type: str, suffix: str, size: int, owner_uid: str | None = None,
+                  queue_on_complete: bool = False) -> dict:
+    """
+    Start a resumable upload of ``size`` bytes and return its metadata. The data goes to
+    ``<TRANSCRIPTION_UPLOAD_DIR>/<upload_id>/upload<suffix>``, appended by append_chunk.
+    """
+    if random.random() < 0.05:
+        prune_stale_uploads()
+    upload_id = uuid.uuid4().hex
+    directory = os.path.join(upload_root(), upload_id)
+    os.makedirs(directory)
+    meta = {
+        "upload_id": upload_id,
+        "filename": filename,
+        "content_type": content_type,
+        "suffix": suffix,
+        "size": size,
+        "owner_uid": owner_uid,
+        "queue_on_complete": queue_on_complete,
+    }
+    with open(os.path.join(directory, META_FILE), "w") as f:
+        json.dump(meta, f)
+    # Created empty here, so append_chunk can open it without creating it: once finalize has
+    # claimed the data, a late chunk finds nothing to append to
+    open(os.path.join(directory, DATA_FILE + suffix), "xb").close()
+    return meta
+
+
+def get_upload(upload_id: str) -> dict | None:
+    """Metadata of an upload with its current ``offset``, or None if it is unknown or already finalized."""
+    directory = _upload_dir(upload_id)
+    if directory is None:
+        return None
+    try:
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        meta["offset"] = os.path.getsize(os.path.join(directory, DATA_FILE + meta["suffix"]))
+    except FileNotFoundError:
+        return None
+    return meta
+
+
+def append_chunk(upload: dict, offset: int, stream, length: int) -> int:
+    """
+    Append ``length`` bytes read from ``stream`` at ``offset``, which must be the upload's current
+    length, and return the new length. Concurrent appends to one upload are serialized by a file
+    lock. If the client disconnects mid-chunk, what arrived is kept, so it resumes from there.
+
+    Raises:
+        UploadOffsetMismatch: If ``offset`` is not the current length
+        ValueError: If the chunk would run past the declared size
+        FileNotFoundError: If the upload was finalized or removed meanwhile
+    """
+    path = os.path.join(upload_root(), upload["upload_id"], DATA_FILE + upload["suffix"])
+    with open(path, "r+b") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        current = f.seek(0, os.SEEK_END)
+        if offset != current:
+            raise UploadOffsetMismatch(current)
+        if current + length > upload["size"]:
+            raise ValueError(f"Chunk runs past the declared upload size of {upload['size']} bytes")
+        remaining = length
+        while remaining:
+            block = stream.read(min(COPY_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            f.write(block)
+            remaining -= len(block)
+        f.flush()
+        return f.tell()
+
+
+def claim_upload(upload: dict) -> str | None:
+    """
+    Take a complete upload's data for transcription and return its path. Only one caller gets
+    it; the rest (and any later chunk) get None. Remove it with discard_upload when done.
+    """
+    directory = os.path.join(upload_root(), upload["upload_id"])
+    path = os.path.join(directory, DATA_FILE + upload["suffix"])
+    claimed = os.path.join(directory, CLAIMED_FILE + upload["suffix"])
+    try:
+        with open(path, "rb") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)  # Waits for a chunk still being written
+            if os.fstat(f.fileno()).st_size != upload["size"]:
+                return None
+            os.rename(path, claimed)
+    except FileNotFoundError:
+        return None
+    return claimed
+
+
+def release_upload(upload: dict) -> None:
+    """Hand a claimed upload back (its transcription failed), so finalize can be retried."""
+    directory = os.path.join(upload_root(), upload["upload_id"])
+    try:
+        os.rename(os.path.join(directory, CLAIMED_FILE + upload["suffix"]),
+                  os.path.join(directory, DATA_FILE + upload["suffix"]))
+    except FileNotFoundError:
+        pass
+
+
+def discard_upload(upload_id: str) -> None:
+    directory = _upload_dir(upload_id)
+    if directory is not None:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+# --- Audio of queued transcriptions ---
+# Kept in the upload directory, which job workers share with the web service, under
+# <TRANSCRIPTION_UPLOAD_DIR>/<transcription_id>/audio<suffix>; prune_stale_uploads removes
+# what a finished or failed transcription leaves behind. Paths are stored relative to the root.
+def save_audio(audio_id: str, suffix: str, stream, max_size: int) -> tuple[str, int]:
+    """
+    Copy ``stream`` into the stored audio of ``audio_id`` and return its relative path and size.
+
+    Raises:
+        ValueError: If the stream holds more than ``max_size`` bytes (nothing is kept)
+    """
+    if random.random() < 0.05:
+        prune_stale_uploads()
+    relative_path = os.path.join(audio_id, CLAIMED_FILE + suffix)
+    os.makedirs(os.path.join(upload_root(), audio_id))
+    size = 0
+    with open(os.path.join(upload_root(), relative_path), "xb") as f:
+        while block := stream.read(COPY_BLOCK_SIZE):
+            size += len(block)
+            if size > max_size:
+                break
+            f.write(block)
+    if size > max_size:
+        discard_upload(audio_id)
+        raise ValueError(f"File too large. Maximum size is {max_size} bytes")
+    return relative_path, size
+
+
+def move_audio(audio_id: str, path: str) -> tuple[str, int]:
+    """Move a file already in the upload directory (a claimed upload) to the stored audio of ``audio_id``."""
+    relative_path = os.path.join(audio_id, CLAIMED_FILE + os.path.splitext(path)[1])
+    os.makedirs(os.path.join(upload_root(), audio_id))
+    os.rename(path, os.path.join(upload_root(), relative_path))
+    return relative_path, os.path.getsize(os.path.join(upload_root(), relative_path))
+
+
+def audio_path(relative_path: str) -> str:
+    return os.path.join(upload_root(), relative_path)
+
+
+def prune_stale_uploads() -> int:
+    """Remove uploads (and stored audio) without a write for TRANSCRIPTION_UPLOAD_TTL_HOURS."""
+    root = upload_root()
+    cutoff = time.time() - current_app.config.get('TRANSCRIPTION_UPLOAD_TTL_HOURS', 24) * 3600
+    removed = 0
+    try:
+        entries = list(os.scandir(root))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            last_activity = max(child.stat().st_mtime for child in os.scandir(entry.path))
+        except (FileNotFoundError, NotADirectoryError, ValueError):
+            continue
+        if last_activity < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+    if removed:
+        logger.info("Removed %s stale uploads from %s", removed, root, extra=NO_SAMPLE)
+    return removed
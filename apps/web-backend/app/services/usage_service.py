@@ -0,0 +1,140 @@
+import logging
+from datetime import datetime, timezone, timedelta
+from app.extensions import db
+from app.models import Message, MessageUsage
+from app.sharding import each_shard, sharding_enabled
+
+logger = logging.getLogger(__name__)
+
+# Report groupings (see usage_report)
+GROUPINGS = {
+    "persona": ("persona_id",),
+    "model": ("model",),
+    "persona_model": ("persona_id", "model"),
+}
+PERCENTILE_COLUMNS = ("latency_ms", "ttft_ms")
+
+
+def _milliseconds(seconds: float | None) -> int | None:
+    return round(seconds * 1000) if seconds is not None else None
+
+
+def record_usage(message: Message, persona_id: str, model: str, usage=None,
+                 latency: float | None = None, ttft: float | None = None) -> MessageUsage:
+    """
+    Add the usage row for an assistant message to the current transaction. ``usage`` is the
+    OpenAI usage object; ``latency`` and ``ttft`` are in seconds. The message must be flushed.
+    """
+    details = getattr(usage, 'prompt_tokens_details', None)
+    entry = MessageUsage(
+        message_id=message.id,
+        conversation_id=message.conversation_id,
+        persona_id=persona_id,
+        model=model,
+        prompt_tokens=getattr(usage, 'prompt_tokens', None),
+        completion_tokens=getattr(usage, 'completion_tokens', None),
+        cached_tokens=getattr(details, 'cached_tokens', None),
+        latency_ms=_milliseconds(latency),
+        ttft_ms=_milliseconds(ttft),
+    )
+    db.session.add(entry)
+    return entry
+
+
+def percentile(sorted_values: list, fraction: float) -> float | None:
+    """Linear interpolation between closest ranks, as PostgreSQL's percentile_cont does."""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def _report_row(key: dict, calls: int, prompt_total: int, completion_total: int, cached_total: int) -> dict:
+    return {
+        **key,
+        "calls": calls,
+        "prompt_tokens_total": prompt_total,
+        "completion_tokens_total": completion_total,
+        "prompt_tokens_avg": round(prompt_total / calls, 1) if calls else None,
+        "completion_tokens_avg": round(completion_total / calls, 1) if calls else None,
+        # Share of prompt tokens billed at the cached rate
+        "cached_share": round(cached_total / prompt_total, 3) if prompt_total else None,
+    }
+
+
+def _report_sql(columns: list, since: datetime) -> list[dict]:
+    # PostgreSQL computes the percentiles itself; only one row per group comes back
+    aggregates = [
+        db.func.count().label("calls"),
+        db.func.coalesce(db.func.sum(MessageUsage.prompt_tokens), 0).label("prompt_total"),
+        db.func.coalesce(db.func.sum(MessageUsage.completion_tokens), 0).label("completion_total"),
+        db.func.coalesce(db.func.sum(MessageUsage.cached_tokens), 0).label("cached_total"),
+    ]
+    for name in PERCENTILE_COLUMNS:
+        column = getattr(MessageUsage, name)
+        aggregates += [db.func.percentile_cont(0.5).within_group(column).label(f"{name}_p50"),
+                       db.func.percentile_cont(0.95).within_group(column).label(f"{name}_p95")]
+    rows = db.session.execute(
+        db.select(*columns, *aggregates).where(MessageUsage.created_at >= since).group_by(*columns)
+    ).mappings().all()
+    report = []
+    for row in rows:
+        entry = _report_row({column.key: row[column.key] for column in columns}, row["calls"],
+                            row["prompt_total"], row["completion_total"], row["cached_total"])
+        for name in PERCENTILE_COLUMNS:
+            for suffix in ("p50", "p95"):
+                value = row[f"{name}_{suffix}"]
+                entry[f"{name}_{suffix}"] = round(value) if value is not None else None
+        report.append(entry)
+    return report
+
+
+def _report_python(columns: list, since: datetime) -> list[dict]:
+    # Percentiles don't combine across shards (and SQLite has none), so gather the values here
+    groups: dict[tuple, dict] = {}
+    for _ in each_shard():
+        rows = db.session.execute(
+            db.select(*columns, MessageUsage.prompt_tokens, MessageUsage.completion_tokens,
+                      MessageUsage.cached_tokens, MessageUsage.latency_ms, MessageUsage.ttft_ms)
+            .where(MessageUsage.created_at >= since),
+            execution_options={"yield_per": 1000},
+        )
+        for row in rows:
+            key = tuple(getattr(row, column.key) for column in columns)
+            group = groups.setdefault(key, {"calls": 0, "prompt": 0, "completion": 0, "cached": 0,
+                                            **{name: [] for name in PERCENTILE_COLUMNS}})
+            group["calls"] += 1
+            group["prompt"] += row.prompt_tokens or 0
+            group["completion"] += row.completion_tokens or 0
+            group["cached"] += row.cached_tokens or 0
+            for name in PERCENTILE_COLUMNS:
+                if getattr(row, name) is not None:
+                    group[name].append(getattr(row, name))
+    report = []
+    for key, group in groups.items():
+        entry = _report_row(dict(zip((column.key for column in columns), key)), group["calls"],
+                            group["prompt"], group["completion"], group["cached"])
+        for name in PERCENTILE_COLUMNS:
+            values = sorted(group[name])
+            for suffix, fraction in (("p50", 0.5), ("p95", 0.95)):
+                value = percentile(values, fraction)
+                entry[f"{name}_{suffix}"] = round(value) if value is not None else None
+        report.append(entry)
+    return report
+
+
+def usage_report(days: int = 7, group_by: str = "persona_model") -> list[dict]:
+    """
+    Completions of the last ``days`` days per persona, model or both (see GROUPINGS): call
+    count, token totals and averages, the cached share of prompt tokens, and p50/p95 of
+    upstream latency and time to first token in milliseconds. Busiest groups first.
+    """
+    columns = [getattr(MessageUsage, name) for name in GROUPINGS[group_by]]
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    if not sharding_enabled() and db.session.get_bind(mapper=MessageUsage).dialect.name == 'postgresql':
+        report = _report_sql(columns, since)
+    else:
+        report = _report_python(columns, since)
+    return sorted(report, key=lambda entry: entry["calls"], reverse=True)
@@ -0,0 +1,184 @@
+# backend/app/sharding.py
+# Optional horizontal sharding of conversation data by user
+
+"""
+With SHARD_DATABASE_URLS set, the rows of SHARDED_TABLES live on one of several databases picked
+by a hash of User.id. Everything else (users, jobs, idempotency records) stays in the main
+database, which is also the directory that maps a Firebase UID to a User.id. Every shard has the
+full schema (`flask db upgrade` migrates them all) and a copy of the user rows placed on it, so
+its foreign keys hold.
+
+Code selects a shard once per unit of work: route_to_user() after the user lookup in a request,
+shard_context() or each_shard() in jobs and commands. RoutingSession then sends every statement
+that touches a sharded table to that shard. Without SHARD_DATABASE_URLS all of this is a no-op.
+"""
+
+from contextlib import contextmanager
+import sqlalchemy as sa
+from flask import current_app, g
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql.util import find_tables
+from app.logging_setup import NO_SAMPLE
+
+SHARDED_TABLES = frozenset({'conversation', 'message', 'conversation_archive', 'conversation_tombstone',
+                            'message_usage'})
+# Ids exposed to clients; interleaved across shards so rebalancing never renumbers them
+INTERLEAVED_ID_TABLES = ('conversation', 'message')
+
+
+class ShardNotSelectedError(RuntimeError):
+    """A sharded table was queried before a shard was selected for the unit of work."""
+
+
+def _jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash (Lamping & Veach): going from n to n+1 buckets moves only 1/(n+1) of the keys."""
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_names() -> list[str]:
+    return [f"shard{index}" for index in range(len(current_app.config.get('SHARD_DATABASE_URLS', [])))]
+
+
+def sharding_enabled() -> bool:
+    return bool(current_app.config.get('SHARD_DATABASE_URLS'))
+
+
+def shard_for_user(user_id: int) -> str | None:
+    """The shard holding a user's conversations, or None when sharding is off."""
+    names = shard_names()
+    if not names:
+        return None
+    return names[_jump_hash(user_id, len(names))]
+
+
+def shard_engine(shard: str) -> sa.Engine:
+    # A shard that points at the main database shares its engine, so one transaction
+    # never holds two connections to the same database
+    engines = current_app.extensions.setdefault('shard_engines', {})
+    if shard not in engines:
+        db = current_app.extensions['sqlalchemy']
+        engine = db.engines[shard]
+        engines[shard] = db.engine if engine.url == db.engine.url else engine
+    return engines[shard]
+
+
+def route_to_user(user_id: int) -> None:
+    """Send the rest of this request's (or app context's) sharded queries to the user's shard."""
+    g._shard = shard_for_user(user_id)
+
+
+@contextmanager
+def shard_context(shard: str | None):
+    previous = g.get('_shard')
+    g._shard = shard
+    try:
+        yield shard
+    finally:
+        g._shard = previous
+
+
+def each_shard():
+    """Runs the loop body once per shard (once, unrouted, when sharding is off); for jobs and commands."""
+    for shard in shard_names() or [None]:
+        with shard_context(shard):
+            yield shard
+
+
+def _touches_sharded_table(mapper, clause) -> bool:
+    if mapper is not None and any(table.name in SHARDED_TABLES for table in sa.inspect(mapper).tables):
+        return True
+    if clause is not None:
+        return any(getattr(table, 'name', None) in SHARDED_TABLES
+                   for table in find_tables(clause, include_joins=True, include_crud=True))
+    return False
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy's session, with statements on SHARDED_TABLES sent to the selected shard."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and current_app.config.get('SHARD_DATABASE_URLS') and _touches_sharded_table(mapper, clause):
+            shard = g.get('_shard')
+            if shard is None:
+                raise ShardNotSelectedError(
+                    "Query on a sharded table without a shard; call route_to_user() or use shard_context().")
+            return shard_engine(shard)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def ensure_user_on_shard(user_id: int) -> None:
+    """Copy the user row to the selected shard if it is not there yet. Call before creating a conversation."""
+    shard = g.get('_shard')
+    if shard is None:
+        return
+    from .models import User
+    db = current_app.extensions['sqlalchemy']
+    bind_arguments = {"bind": shard_engine(shard)}
+    if db.session.execute(sa.select(User.id).where(User.id == user_id), bind_arguments=bind_arguments).first():
+        return
+    user = db.session.get(User, user_id)
+    # Only what the shard's constraints need; profile data stays in the main database
+    db.session.execute(
+        sa.insert(User).values(id=user.id, firebase_uid=user.firebase_uid, created_at=user.created_at),
+        bind_arguments=bind_arguments,
+    )
+
+
+def delete_user_from_shard(user_id: int) -> None:
+    """Delete the user's copy on their shard; ON DELETE CASCADE removes their conversations with it."""
+    shard = shard_for_user(user_id)
+    if shard is None:
+        return
+    from .models import User
+    db = current_app.extensions['sqlalchemy']
+    engine = shard_engine(shard)
+    if engine is db.engine:
+        return  # The shard is the main database, whose user row the caller deletes
+    db.session.execute(sa.delete(User).where(User.id == user_id), bind_arguments={"bind": engine},
+                       execution_options={"synchronize_session": False})
+
+
+def id_offset(engine) -> int | None:
+    """The residue (id % SHARD_ID_STRIDE) of ids created on this engine, or None if it is not a shard."""
+    for index, shard in enumerate(shard_names()):
+        if shard_engine(shard) is engine:
+            return (index + 1) % current_app.config['SHARD_ID_STRIDE']
+    return None
+
+
+def next_interleaved_id(highest: int, offset: int, stride: int) -> int:
+    next_id = highest - highest % stride + offset
+    return next_id if next_id > highest else next_id + stride
+
+
+def _assign_interleaved_id(mapper, connection, target) -> None:
+    # SQLite has no sequences to interleave (Postgres shards use `flask shards init`), so SQLite
+    # shards get ids here. Good enough for the local multi-file setup this exists for.
+    if target.id is not None or connection.dialect.name != 'sqlite' or not sharding_enabled():
+        return
+    offset = id_offset(connection.engine)
+    if offset is None:
+        return
+    table = mapper.local_table
+    # Rows of one flush are inserted after all their before_insert hooks run, so remember the last id handed out
+    key = ('sharding_last_id', table.name)
+    highest = max(connection.scalar(sa.select(sa.func.max(table.c.id))) or 0, connection.info.get(key, 0))
+    target.id = connection.info[key] = next_interleaved_id(highest, offset, current_app.config['SHARD_ID_STRIDE'])
+
+
+def init_sharding(app) -> None:
+    shards = app.config.get('SHARD_DATABASE_URLS', [])
+    if len(shards) > app.config['SHARD_ID_STRIDE']:
+        raise ValueError(f"{len(shards)} shards configured but SHARD_ID_STRIDE is {app.config['SHARD_ID_STRIDE']}.")
+    from .models import Conversation, Message
+    for model in (Conversation, Message):
+        if not event.contains(model, 'before_insert', _assign_interleaved_id):
+            event.listen(model, 'before_insert', _assign_interleaved_id)
+    if shards:
+        app.logger.info("Sharding conversation data over %s databases", len(shards), extra=NO_SAMPLE)
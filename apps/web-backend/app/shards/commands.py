@@ -0,0 +1,51 @@
+# backend/app/shards/commands.py
+# `flask shards ...` commands for the optional user-hash sharding (see app/sharding.py)
+
+import click
+import sqlalchemy as sa
+from flask.cli import AppGroup
+from ..extensions import db
+from ..sharding import sharding_enabled
+from ..services.shard_service import locations, misplaced_users, rebalance, init_id_sequences
+
+shards_cli = AppGroup('shards', help="Sharding of conversation data across databases.")
+
+
+@shards_cli.command('status')
+def status_command():
+    """Show each database's conversation count and how many of its users belong elsewhere."""
+    if not sharding_enabled():
+        click.echo("Sharding is off (SHARD_DATABASE_URLS is empty).")
+        return
+    conversation = db.metadata.tables['conversation']
+    for name, engine in locations():
+        with engine.connect() as connection:
+            count = connection.scalar(sa.select(sa.func.count()).select_from(conversation))
+        click.echo(f"{name}: {engine.url.render_as_string(hide_password=True)} - "
+                   f"{count} conversations, {len(misplaced_users(engine))} users to move")
+
+
+@shards_cli.command('init')
+def init_command():
+    """Interleave the id sequences of PostgreSQL shards. Run after `flask db upgrade`, before traffic."""
+    if not sharding_enabled():
+        raise click.UsageError("Sharding is off (SHARD_DATABASE_URLS is empty).")
+    changed = init_id_sequences()
+    click.echo(f"Interleaved sequences: {', '.join(changed)}" if changed else "No PostgreSQL shards to initialize.")
+
+
+@shards_cli.command('rebalance')
+@click.option('--batch-size', type=int, default=1000, show_default=True, help="Rows copied per INSERT.")
+@click.option('--dry-run', is_flag=True, help="Only report which users would move.")
+def rebalance_command(batch_size, dry_run):
+    """
+    Move users whose data is not on the shard the shard map assigns them, e.g. after adding a
+    shard or when first enabling sharding. Requests route by the new map as soon as it is
+    deployed, so run this right after; it is safe to re-run.
+    """
+    if not sharding_enabled():
+        raise click.UsageError("Sharding is off (SHARD_DATABASE_URLS is empty).")
+    summary = rebalance(batch_size=batch_size, dry_run=dry_run)
+    for (source, target), users in sorted(summary.items()):
+        click.echo(f"{source} -> {target}: {users} users{' (dry run)' if dry_run else ''}")
+    click.echo(f"{sum(summary.values())} users {'to move' if dry_run else 'moved'}.")
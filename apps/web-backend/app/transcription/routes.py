@@ -1,7 +1,19 @@
 import logging
-from flask import Blueprint, request, jsonify, current_app
+from contextlib import nullcontext
+from flask import Blueprint, request, jsonify, current_app, url_for
+from pydantic import BaseModel, Field
 from werkzeug.exceptions import RequestEntityTooLarge
-from app.services.transcription_service import get_transcription_service
+from app.auth.utils import verify_token
+from app.services.admission_service import caller_priority, long_request_slot, overloaded_response, AdmissionRejected
+from app.services.audio_service import ffmpeg_path
+from app.services.transcription_service import (
+    audio_suffix, get_transcription_service, submit_transcription, submit_transcription_file,
+    transcription_status, wait_for_transcription,
+)
+from app.services.upload_service import (
+    UploadOffsetMismatch, append_chunk, claim_upload, create_upload, discard_upload, get_upload, release_upload,
+)
+from app.dialogue.pipeline import json_body
 from app.extensions import limiter
 
 logger = logging.getLogger(__name__)
@@ -9,6 +21,23 @@ logger = logging.getLogger(__name__)
 # Create blueprint
 transcription_bp = Blueprint('transcription', __name__)
 
+
+class UploadCreateSchema(BaseModel):
+    filename: str = Field(..., min_length=1, max_length=255)
+    content_type: str = Field(..., max_length=100)
+    size: int = Field(..., gt=0)  # Total bytes the client will send
+    # Queue the transcription as soon as the last chunk lands, without a finalize call
+    transcribe_async: bool = Field(False, alias='async')
+
+
+def _accepted(transcription):
+    """202 for a queued transcription, pointing at where its result will be."""
+    response = jsonify({'job_id': transcription.id, 'status': 'queued'})
+    response.headers['Location'] = url_for('transcription.transcription_result', job_id=transcription.id)
+    response.headers['Retry-After'] = '1'
+    return response, 202
+
+
 @transcription_bp.route('/transcribe', methods=['POST'])
 @limiter.limit("5 per minute")  # Conservative limit for resource-intensive transcription
 def transcribe_audio():
@@ -17,6 +46,10 @@ def transcribe_audio():
     
     Expected form data:
     - audio: Audio file (multipart/form-data)
+
+    Query parameters:
+    - async: "true" to queue the transcription and return 202 with a job id at once;
+      the result is then fetched from GET /api/transcribe/<job_id>
     
     Returns:
     - JSON response with transcript or error message
@@ -40,12 +73,20 @@ def transcribe_audio():
         
         # Log the request
         client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
-        logger.info(f"Transcription request from {client_ip}, file: {audio_file.filename}, "
-                   f"content_type: {audio_file.content_type}")
+        logger.info(
+            "Transcription request from %s, file: %s, content_type: %s",
+            client_ip, audio_file.filename, audio_file.content_type)
         
+        # Signed-in callers are optional here, but get priority when Whisper is saturated
+        decoded_token = verify_token()
+        if request.args.get('async', 'false').lower() == 'true':
+            transcription = submit_transcription(audio_file, owner_uid=decoded_token['uid'] if decoded_token else None,
+                                                 priority=caller_priority(decoded_token))
+            return _accepted(transcription)
+
         # Get transcription service and process the file
         service = get_transcription_service()
-        transcript = service.transcribe_audio(audio_file)
+        transcript = service.transcribe_audio(audio_file, priority=caller_priority(decoded_token))
         
         if not transcript:
             return jsonify({
@@ -53,16 +94,20 @@ def transcribe_audio():
                 'code': 'NO_SPEECH'
             }), 422
         
-        logger.info(f"Successfully transcribed audio file: {audio_file.filename}")
+        logger.info("Successfully transcribed audio file: %s", audio_file.filename)
         
         return jsonify({
             'transcript': transcript,
             'status': 'success'
         }), 200
         
+    except AdmissionRejected as e:
+        # Whisper is saturated; shed the request rather than queue it indefinitely
+        return overloaded_response(e, code='OVERLOADED')
+
     except ValueError as e:
         # File validation errors
-        logger.warning(f"File validation error: {str(e)}")
+        logger.warning("File validation error: %s", e)
         return jsonify({
             'error': str(e),
             'code': 'VALIDATION_ERROR'
@@ -78,11 +123,241 @@ def transcribe_audio():
         
     except Exception as e:
         # General transcription errors
-        logger.error(f"Transcription error: {str(e)}")
+        logger.error("Transcription error: %s", e)
+        return jsonify({
+            'error': 'Failed to transcribe audio. Please try again.',
+            'code': 'TRANSCRIPTION_ERROR'
+        }), 500
+
+@transcription_bp.route('/transcribe/<job_id>', methods=['GET'])
+@limiter.limit("120 per minute")  # Clients poll, but long-polling (?wait=) keeps it to a few calls per job
+def transcription_result(job_id):
+    """
+    Status or result of an async transcription (POST /api/transcribe?async=true)
+
+    Query parameters:
+    - wait: Seconds to hold the request open for the result (capped at TRANSCRIPTION_MAX_WAIT_SECONDS;
+      answered at once while the worker already holds its share of waiting polls)
+
+    Returns:
+    - 200 with status "queued" or "running" (and Retry-After) while in progress
+    - Once finished, what the synchronous call would have returned, with job_id and status
+    """
+    decoded_token = verify_token()
+    wait = request.args.get('wait', 0, type=float)
+    with long_request_slot('long_poll') if wait > 0 else nullcontext(False) as may_wait:
+        # Without a slot the poll returns the current status; the client polls again after Retry-After
+        transcription = wait_for_transcription(job_id, wait if may_wait else 0)
+    # Jobs of signed-in users are theirs alone; a guest's job is reachable by its random id
+    if transcription is None or (transcription.owner_uid is not None
+                                 and (decoded_token is None or decoded_token['uid'] != transcription.owner_uid)):
+        return jsonify({
+            'error': 'Transcription job not found',
+            'code': 'NOT_FOUND'
+        }), 404
+
+    status = transcription_status(transcription)
+    body = {'job_id': transcription.id, 'status': status}
+    if status in ('queued', 'running'):
+        response = jsonify(body)
+        response.headers['Retry-After'] = '1'
+        return response, 200
+    if transcription.error_code:
+        return jsonify({**body, 'error': transcription.error, 'code': transcription.error_code}), 400
+    if status == 'failed':
         return jsonify({
+            **body,
             'error': 'Failed to transcribe audio. Please try again.',
             'code': 'TRANSCRIPTION_ERROR'
         }), 500
+    if not transcription.transcript:
+        return jsonify({
+            **body,
+            'error': 'Could not transcribe audio - no speech detected',
+            'code': 'NO_SPEECH'
+        }), 422
+    return jsonify({**body, 'transcript': transcription.transcript}), 200
+
+def _upload_state(upload: dict, **extra):
+    response = jsonify({'upload_id': upload['upload_id'], 'offset': upload['offset'], 'size': upload['size'], **extra})
+    response.headers['Upload-Offset'] = str(upload['offset'])
+    return response
+
+def _owned_upload(upload_id: str):
+    """The upload, if the caller may use it: like async jobs, a guest's upload is reachable by its id."""
+    upload = get_upload(upload_id)
+    if upload is None or upload['owner_uid'] is None:
+        return upload
+    decoded_token = verify_token()
+    return upload if decoded_token and decoded_token['uid'] == upload['owner_uid'] else None
+
+def _upload_not_found():
+    return jsonify({
+        'error': 'Upload not found',
+        'code': 'NOT_FOUND'
+    }), 404
+
+@transcription_bp.route('/transcribe/uploads', methods=['POST'])
+@limiter.limit("5 per minute")  # One per recording, like POST /transcribe
+@json_body(UploadCreateSchema, error="Invalid upload")
+def create_audio_upload(body: UploadCreateSchema):
+    """
+    Start a resumable upload: send the audio with PATCH /api/transcribe/uploads/<upload_id>,
+    then transcribe it with POST /api/transcribe/uploads/<upload_id>/finalize
+
+    Expected JSON body:
+    - filename, content_type, size: The recording and its total length in bytes
+    - async: true to queue the transcription as soon as the last chunk lands
+
+    Returns:
+    - 201 with the upload id and offset 0, and its URL in Location
+    """
+    service = get_transcription_service()
+    if body.content_type not in service.allowed_formats:
+        return jsonify({
+            'error': f"Unsupported audio format. Allowed: {', '.join(service.allowed_formats)}",
+            'code': 'VALIDATION_ERROR'
+        }), 400
+    if body.size > service.upload_limit:
+        return jsonify({
+            'error': f"File too large. Maximum size is {service.upload_limit} bytes",
+            'code': 'FILE_TOO_LARGE'
+        }), 413
+
+    decoded_token = verify_token()
+    upload = create_upload(body.filename, body.content_type, audio_suffix(body.content_type, body.filename),
+                           body.size, owner_uid=decoded_token['uid'] if decoded_token else None,
+                           queue_on_complete=body.transcribe_async)
+    logger.info("Started upload %s of %s (%s bytes)", upload['upload_id'], body.filename, body.size)
+    response = _upload_state({**upload, 'offset': 0})
+    response.headers['Location'] = url_for('transcription.upload_status', upload_id=upload['upload_id'])
+    return response, 201
+
+@transcription_bp.route('/transcribe/uploads/<upload_id>', methods=['GET'])
+@limiter.limit("120 per minute")
+def upload_status(upload_id):
+    """
+    Where to resume an upload: the number of bytes received so far, as offset and Upload-Offset
+    """
+    upload = _owned_upload(upload_id)
+    if upload is None:
+        return _upload_not_found()
+    return _upload_state(upload), 200
+
+@transcription_bp.route('/transcribe/uploads/<upload_id>', methods=['PATCH'])
+@limiter.limit("300 per minute")  # Many chunks per recording
+def append_upload_chunk(upload_id):
+    """
+    Append a chunk to an upload
+
+    Expected request:
+    - Upload-Offset header: The upload's current offset (where this chunk starts)
+    - Body: The chunk's raw bytes, with a Content-Length
+
+    Returns:
+    - 200 with the new offset; with a job_id too if the upload was created with async and is now complete
+    - 409 with the current offset if Upload-Offset does not match it
+    """
+    upload = _owned_upload(upload_id)
+    if upload is None:
+        return _upload_not_found()
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None or offset < 0:
+        return jsonify({
+            'error': 'Missing or invalid Upload-Offset header',
+            'code': 'INVALID_OFFSET'
+        }), 400
+    if request.content_length is None:
+        return jsonify({
+            'error': 'Content-Length is required',
+            'code': 'LENGTH_REQUIRED'
+        }), 411
+
+    try:
+        upload['offset'] = append_chunk(upload, offset, request.stream, request.content_length)
+    except UploadOffsetMismatch as e:
+        upload['offset'] = e.offset
+        response = _upload_state(upload, error='Upload-Offset does not match the upload', code='OFFSET_MISMATCH')
+        return response, 409
+    except ValueError as e:
+        return jsonify({
+            'error': str(e),
+            'code': 'FILE_TOO_LARGE'
+        }), 413
+    except FileNotFoundError:
+        return _upload_not_found()
+
+    if upload['offset'] == upload['size'] and upload['queue_on_complete']:
+        return _finalize_upload(upload, transcribe_async=True)
+    return _upload_state(upload), 200
+
+@transcription_bp.route('/transcribe/uploads/<upload_id>/finalize', methods=['POST'])
+@limiter.limit("10 per minute")
+def finalize_upload(upload_id):
+    """
+    Transcribe a complete upload, as POST /api/transcribe would have
+
+    Query parameters:
+    - async: "true" to queue the transcription and return 202 with a job id at once
+
+    Returns:
+    - JSON response with transcript or error message; 409 with the current offset if incomplete
+    """
+    upload = _owned_upload(upload_id)
+    if upload is None:
+        return _upload_not_found()
+    return _finalize_upload(upload, transcribe_async=request.args.get('async', 'false').lower() == 'true')
+
+def _finalize_upload(upload: dict, transcribe_async: bool):
+    path = claim_upload(upload)
+    if path is None:
+        # Still missing chunks, or another request got here first
+        upload = get_upload(upload['upload_id']) or upload
+        return _upload_state(upload, error='Upload is incomplete', code='UPLOAD_INCOMPLETE'), 409
+
+    decoded_token = verify_token()
+    try:
+        if transcribe_async:
+            transcription = submit_transcription_file(
+                path, upload['filename'], owner_uid=decoded_token['uid'] if decoded_token else None,
+                priority=caller_priority(decoded_token))
+            discard_upload(upload['upload_id'])
+            response, status = _accepted(transcription)
+            response.headers['Upload-Offset'] = str(upload['size'])
+            return response, status
+
+        transcript = get_transcription_service().transcribe_file(path, priority=caller_priority(decoded_token))
+    except ValueError as e:
+        # The audio itself was rejected; sending it again would not help
+        discard_upload(upload['upload_id'])
+        logger.warning("File validation error: %s", e)
+        return jsonify({
+            'error': str(e),
+            'code': 'VALIDATION_ERROR'
+        }), 400
+    except AdmissionRejected as e:
+        # Keep the data, so the client can retry the finalize call without uploading again
+        release_upload(upload)
+        return overloaded_response(e, code='OVERLOADED')
+    except Exception as e:
+        release_upload(upload)
+        logger.error("Transcription error for upload %s: %s", upload['upload_id'], e)
+        return jsonify({
+            'error': 'Failed to transcribe audio. Please try again.',
+            'code': 'TRANSCRIPTION_ERROR'
+        }), 500
+
+    discard_upload(upload['upload_id'])
+    if not transcript:
+        return jsonify({
+            'error': 'Could not transcribe audio - no speech detected',
+            'code': 'NO_SPEECH'
+        }), 422
+    logger.info("Successfully transcribed upload %s: %s", upload['upload_id'], upload['filename'])
+    return jsonify({
+        'transcript': transcript,
+        'status': 'success'
+    }), 200
 
 @transcription_bp.route('/transcribe/health', methods=['GET'])
 @limiter.limit("30 per minute")  # More generous limit for health checks
@@ -101,12 +376,13 @@ def transcription_health():
         return jsonify({
             'status': 'healthy',
             'service': 'transcription',
-            'max_file_size': current_app.config['MAX_AUDIO_FILE_SIZE'],
+            'max_file_size': get_transcription_service().upload_limit,
+            'audio_normalization': ffmpeg_path() is not None,
             'allowed_formats': current_app.config['ALLOWED_AUDIO_FORMATS']
         }), 200
         
     except Exception as e:
-        logger.error(f"Health check error: {str(e)}")
+        logger.error("Health check error: %s", e)
         return jsonify({
             'status': 'error',
             'message': 'Service unavailable'
@@ -0,0 +1,31 @@
+# backend/app/usage/commands.py
+# `flask usage ...` commands for the per-message usage ledger
+
+import click
+from flask.cli import AppGroup
+from ..services.usage_service import usage_report, GROUPINGS
+
+usage_cli = AppGroup('usage', help="Token usage and upstream latency of completions.")
+
+
+def _cell(value) -> str:
+    return "-" if value is None else str(value)
+
+
+@usage_cli.command('report')
+@click.option('--days', type=int, default=7, show_default=True, help="Look back this many days.")
+@click.option('--by', 'group_by', type=click.Choice(list(GROUPINGS)), default='persona_model', show_default=True)
+def report_command(days, group_by):
+    """Latency percentiles and token use per persona and/or model."""
+    report = usage_report(days=days, group_by=group_by)
+    if not report:
+        click.echo(f"No completions recorded in the last {days} days.")
+        return
+    keys = list(GROUPINGS[group_by])
+    columns = keys + ["calls", "latency_ms_p50", "latency_ms_p95", "ttft_ms_p50", "ttft_ms_p95",
+                      "prompt_tokens_avg", "completion_tokens_avg", "cached_share"]
+    rows = [[_cell(entry[column]) for column in columns] for entry in report]
+    widths = [max(len(column), *(len(row[i]) for row in rows)) for i, column in enumerate(columns)]
+    click.echo("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        click.echo("  ".join(cell.ljust(width) for cell, width in zip(row, widths)))
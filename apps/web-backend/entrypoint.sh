@@ -8,7 +8,12 @@ echo "Running database migrations..."
 # (Render environment variables should make it available)
 flask db upgrade
 
+# Shared directory where every gunicorn worker writes its Prometheus samples.
+# It must be wiped on each start so stale worker files are not reported.
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus_multiproc}"
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
 echo "Starting Gunicorn..."
-# Replace this with your actual Gunicorn start command
 # Ensure it binds to 0.0.0.0 and uses the $PORT environment variable provided by Render
-exec gunicorn --bind 0.0.0.0:$PORT "app:create_app()"
+exec gunicorn --config gunicorn.conf.py --bind 0.0.0.0:$PORT "app:create_app()"
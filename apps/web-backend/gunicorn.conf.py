@@ -0,0 +1,23 @@
+# backend/gunicorn.conf.py
+# Gunicorn server hooks. Bind address and worker count are still passed on the
+# command line (see entrypoint.sh) or via GUNICORN_CMD_ARGS / WEB_CONCURRENCY.
+import os
+
+# Each open /api/dialogue/ws session occupies a thread for its lifetime, so workers run
+# threaded (gunicorn switches to the gthread worker when threads > 1). Sessions are capped at
+# a quarter of the threads per worker (LONG_REQUEST_LIMITS in app/config.py), so the rest stay
+# free for ordinary requests and health probes.
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+
+def post_worker_init(worker):
+    # Runs in the worker after the app is loaded and before it accepts connections,
+    # so the first real requests find warm DB, OpenAI and Firebase connections
+    from app.services.health_service import warm_up
+    warm_up(worker.wsgi)
+
+
+def child_exit(server, worker):
+    # Drop the dead worker's live metric files so /metrics stops reporting them
+    from app.services.metrics_service import mark_worker_dead
+    mark_worker_dead(worker.pid)
@@ -51,6 +51,29 @@ def get_metadata():
     return target_db.metadata
 
 
+# Full-text search objects are created by raw DDL (see app/models.py) and are not
+# mapped on the models; keep autogenerate from proposing to drop them.
+SEARCH_OBJECT_NAMES = {
+    'search_vector', 'ix_message_search_vector', 'ix_conversation_search_vector',
+    'ix_conversation_archive_search_vector',
+}
+
+
+def get_shard_engines():
+    # Shards (SHARD_DATABASE_URLS, see app/sharding.py) carry the full schema and their own
+    # alembic_version, so every migration runs on each of them after the main database
+    from app.sharding import shard_names, shard_engine
+    return [engine for engine in (shard_engine(shard) for shard in shard_names()) if engine is not get_engine()]
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    if name in SEARCH_OBJECT_NAMES:
+        return False
+    if type_ == 'table' and name and '_fts' in name:
+        return False
+    return True
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -65,7 +88,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -93,18 +117,25 @@ def run_migrations_online():
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
-
-    connectable = get_engine()
-
-    with connectable.connect() as connection:
-        context.configure(
-            connection=connection,
-            target_metadata=get_metadata(),
-            **conf_args
-        )
-
-        with context.begin_transaction():
-            context.run_migrations()
+    conf_args.setdefault("include_object", include_object)
+
+    engines = [get_engine()]
+    # Autogenerate compares against the main database only
+    if not getattr(config.cmd_opts, 'autogenerate', False):
+        engines += get_shard_engines()
+
+    for connectable in engines:
+        if len(engines) > 1:
+            logger.info('Migrating %s', connectable.url.render_as_string(hide_password=True))
+        with connectable.connect() as connection:
+            context.configure(
+                connection=connection,
+                target_metadata=get_metadata(),
+                **conf_args
+            )
+
+            with context.begin_transaction():
+                context.run_migrations()
 
 
 if context.is_offline_mode():
@@ -0,0 +1,51 @@
+"""cascade_deletes_on_foreign_keys
+
+Revision ID: 3ec18e946b0e
+Revises: e4d7e15af78e
+Create Date: 2026-10-19 10:52:03.117640
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3ec18e946b0e'
+down_revision = 'e4d7e15af78e'
+branch_labels = None
+depends_on = None
+
+# The initial migration created unnamed foreign keys. PostgreSQL named them
+# <table>_<column>_fkey; on SQLite batch mode needs a naming convention to find them.
+SQLITE_NAMING_CONVENTION = {"fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s"}
+FOREIGN_KEYS = [
+    # (table, column, referred table, postgres name, sqlite name)
+    ('conversation', 'user_id', 'user', 'conversation_user_id_fkey', 'fk_conversation_user_id_user'),
+    ('message', 'conversation_id', 'conversation', 'message_conversation_id_fkey', 'fk_message_conversation_id_conversation'),
+]
+
+
+def _recreate_foreign_keys(ondelete):
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        # Batch mode copies and drops tables; with foreign keys enforced, dropping the old
+        # conversation table would cascade into (or be blocked by) the message table.
+        op.execute("PRAGMA foreign_keys=OFF")
+        for table, column, referred, _, name in FOREIGN_KEYS:
+            with op.batch_alter_table(table, schema=None, recreate='always',
+                                      naming_convention=SQLITE_NAMING_CONVENTION) as batch_op:
+                batch_op.drop_constraint(name, type_='foreignkey')
+                batch_op.create_foreign_key(name, referred, [column], ['id'], ondelete=ondelete)
+        op.execute("PRAGMA foreign_keys=ON")
+    else:
+        for table, column, referred, name, _ in FOREIGN_KEYS:
+            op.drop_constraint(name, table, type_='foreignkey')
+            op.create_foreign_key(name, table, referred, [column], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    _recreate_foreign_keys('CASCADE')
+
+
+def downgrade():
+    _recreate_foreign_keys(None)
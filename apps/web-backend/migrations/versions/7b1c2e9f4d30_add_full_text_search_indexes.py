@@ -0,0 +1,78 @@
+"""add_full_text_search_indexes
+
+Revision ID: 7b1c2e9f4d30
+Revises: 1902758bb2ba
+Create Date: 2026-10-19 11:31:54.208817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b1c2e9f4d30'
+down_revision = '1902758bb2ba'
+branch_labels = None
+depends_on = None
+
+# Kept in step with POSTGRES_SEARCH_DDL / SQLITE_SEARCH_DDL in app/models.py.
+# NOTE: on SQLite, a later batch migration that recreates message or conversation
+# drops these triggers and must create them again.
+POSTGRES_UPGRADE = [
+    # Generated columns rewrite the table once; new rows are indexed automatically
+    "ALTER TABLE message ADD COLUMN search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('english', content)) STORED",
+    "CREATE INDEX ix_message_search_vector ON message USING GIN (search_vector)",
+    "ALTER TABLE conversation ADD COLUMN search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('english', coalesce(title, ''))) STORED",
+    "CREATE INDEX ix_conversation_search_vector ON conversation USING GIN (search_vector)",
+]
+POSTGRES_DOWNGRADE = [
+    "DROP INDEX IF EXISTS ix_conversation_search_vector",
+    "ALTER TABLE conversation DROP COLUMN IF EXISTS search_vector",
+    "DROP INDEX IF EXISTS ix_message_search_vector",
+    "ALTER TABLE message DROP COLUMN IF EXISTS search_vector",
+]
+SQLITE_UPGRADE = [
+    "CREATE VIRTUAL TABLE message_fts USING fts5(content, content='message', content_rowid='id')",
+    "CREATE TRIGGER message_fts_ai AFTER INSERT ON message BEGIN "
+    "INSERT INTO message_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER message_fts_ad AFTER DELETE ON message BEGIN "
+    "INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER message_fts_au AFTER UPDATE OF content ON message BEGIN "
+    "INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO message_fts(rowid, content) VALUES (new.id, new.content); END",
+    "INSERT INTO message_fts(message_fts) VALUES ('rebuild')",
+    "CREATE VIRTUAL TABLE conversation_fts USING fts5(title, content='conversation', content_rowid='id')",
+    "CREATE TRIGGER conversation_fts_ai AFTER INSERT ON conversation BEGIN "
+    "INSERT INTO conversation_fts(rowid, title) VALUES (new.id, coalesce(new.title, '')); END",
+    "CREATE TRIGGER conversation_fts_ad AFTER DELETE ON conversation BEGIN "
+    "INSERT INTO conversation_fts(conversation_fts, rowid, title) VALUES ('delete', old.id, coalesce(old.title, '')); END",
+    "CREATE TRIGGER conversation_fts_au AFTER UPDATE OF title ON conversation BEGIN "
+    "INSERT INTO conversation_fts(conversation_fts, rowid, title) VALUES ('delete', old.id, coalesce(old.title, '')); "
+    "INSERT INTO conversation_fts(rowid, title) VALUES (new.id, coalesce(new.title, '')); END",
+    "INSERT INTO conversation_fts(rowid, title) SELECT id, coalesce(title, '') FROM conversation",
+]
+SQLITE_DOWNGRADE = [
+    "DROP TRIGGER IF EXISTS conversation_fts_au",
+    "DROP TRIGGER IF EXISTS conversation_fts_ad",
+    "DROP TRIGGER IF EXISTS conversation_fts_ai",
+    "DROP TABLE IF EXISTS conversation_fts",
+    "DROP TRIGGER IF EXISTS message_fts_au",
+    "DROP TRIGGER IF EXISTS message_fts_ad",
+    "DROP TRIGGER IF EXISTS message_fts_ai",
+    "DROP TABLE IF EXISTS message_fts",
+]
+
+
+def _run(statements_by_dialect):
+    for statement in statements_by_dialect.get(op.get_bind().dialect.name, []):
+        op.execute(statement)
+
+
+def upgrade():
+    _run({'postgresql': POSTGRES_UPGRADE, 'sqlite': SQLITE_UPGRADE})
+
+
+def downgrade():
+    _run({'postgresql': POSTGRES_DOWNGRADE, 'sqlite': SQLITE_DOWNGRADE})
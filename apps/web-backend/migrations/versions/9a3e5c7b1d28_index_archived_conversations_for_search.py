@@ -0,0 +1,72 @@
+"""index_archived_conversations_for_search
+
+Revision ID: 9a3e5c7b1d28
+Revises: 5c8e2a7d9f14
+Create Date: 2026-10-19 14:12:05.402117
+
+"""
+import json
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a3e5c7b1d28'
+down_revision = '5c8e2a7d9f14'
+branch_labels = None
+depends_on = None
+
+# Kept in step with the 'conversation_archive' entries of POSTGRES_SEARCH_DDL / SQLITE_SEARCH_DDL
+# in app/models.py. The index is written by archive_service, not by a trigger, because the
+# archived text only exists inside the compressed blob.
+POSTGRES_UPGRADE = [
+    "ALTER TABLE conversation_archive ADD COLUMN search_vector tsvector",
+    "CREATE INDEX ix_conversation_archive_search_vector ON conversation_archive USING GIN (search_vector)",
+]
+POSTGRES_DOWNGRADE = [
+    "DROP INDEX IF EXISTS ix_conversation_archive_search_vector",
+    "ALTER TABLE conversation_archive DROP COLUMN IF EXISTS search_vector",
+]
+SQLITE_UPGRADE = [
+    "CREATE VIRTUAL TABLE conversation_archive_fts USING fts5(content)",
+    "CREATE TRIGGER conversation_archive_fts_ad AFTER DELETE ON conversation_archive BEGIN "
+    "DELETE FROM conversation_archive_fts WHERE rowid = old.conversation_id; END",
+]
+SQLITE_DOWNGRADE = [
+    "DROP TRIGGER IF EXISTS conversation_archive_fts_ad",
+    "DROP TABLE IF EXISTS conversation_archive_fts",
+]
+BACKFILL = {
+    'postgresql': "UPDATE conversation_archive SET search_vector = to_tsvector('english', :text) "
+                  "WHERE conversation_id = :conversation_id",
+    'sqlite': "INSERT INTO conversation_archive_fts(rowid, content) VALUES (:conversation_id, :text)",
+}
+
+
+def _run(statements_by_dialect):
+    for statement in statements_by_dialect.get(op.get_bind().dialect.name, []):
+        op.execute(statement)
+
+
+def _backfill():
+    # Index conversations archived before this revision (blobs are zlib-compressed JSON, see archive_service)
+    bind = op.get_bind()
+    statement = BACKFILL.get(bind.dialect.name)
+    if statement is None:
+        return
+    rows = bind.execute(sa.text("SELECT conversation_id, messages_blob FROM conversation_archive")).all()
+    for conversation_id, blob in rows:
+        messages = json.loads(zlib.decompress(blob))["messages"]
+        text = "\n".join(content for _, _, content, _ in messages)
+        bind.execute(sa.text(statement), {"text": text, "conversation_id": conversation_id})
+
+
+def upgrade():
+    _run({'postgresql': POSTGRES_UPGRADE, 'sqlite': SQLITE_UPGRADE})
+    _backfill()
+
+
+def downgrade():
+    _run({'postgresql': POSTGRES_DOWNGRADE, 'sqlite': SQLITE_DOWNGRADE})
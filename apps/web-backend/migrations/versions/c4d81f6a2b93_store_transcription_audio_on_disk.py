@@ -0,0 +1,65 @@
+"""store_transcription_audio_on_disk
+
+Revision ID: c4d81f6a2b93
+Revises: 9a3e5c7b1d28
+Create Date: 2026-10-19 15:02:47.630518
+
+"""
+import os
+import tempfile
+
+from alembic import op
+from flask import current_app
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d81f6a2b93'
+down_revision = '9a3e5c7b1d28'
+branch_labels = None
+depends_on = None
+
+# Same layout as upload_service.save_audio, so transcriptions queued before the upgrade still run
+AUDIO_FILE = "audio"
+
+
+def _upload_root():
+    return current_app.config.get('TRANSCRIPTION_UPLOAD_DIR') or os.path.join(tempfile.gettempdir(), "cogito-uploads")
+
+
+def upgrade():
+    with op.batch_alter_table('transcription_job', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('audio_path', sa.String(length=255), nullable=True))
+
+    # Write the audio of transcriptions still queued out to the upload directory
+    bind = op.get_bind()
+    rows = bind.execute(sa.text("SELECT id, suffix, audio FROM transcription_job WHERE audio IS NOT NULL")).all()
+    for transcription_id, suffix, audio in rows:
+        relative_path = os.path.join(transcription_id, AUDIO_FILE + suffix)
+        os.makedirs(os.path.join(_upload_root(), transcription_id), exist_ok=True)
+        with open(os.path.join(_upload_root(), relative_path), "wb") as f:
+            f.write(audio)
+        bind.execute(sa.text("UPDATE transcription_job SET audio_path = :path WHERE id = :id"),
+                     {"path": relative_path, "id": transcription_id})
+
+    with op.batch_alter_table('transcription_job', schema=None) as batch_op:
+        batch_op.drop_column('audio')
+
+
+def downgrade():
+    with op.batch_alter_table('transcription_job', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('audio', sa.LargeBinary(), nullable=True))
+
+    bind = op.get_bind()
+    rows = bind.execute(sa.text("SELECT id, audio_path FROM transcription_job WHERE audio_path IS NOT NULL")).all()
+    for transcription_id, relative_path in rows:
+        try:
+            with open(os.path.join(_upload_root(), relative_path), "rb") as f:
+                audio = f.read()
+        except FileNotFoundError:
+            continue
+        bind.execute(sa.text("UPDATE transcription_job SET audio = :audio WHERE id = :id"),
+                     {"audio": audio, "id": transcription_id})
+
+    with op.batch_alter_table('transcription_job', schema=None) as batch_op:
+        batch_op.drop_column('audio_path')
@@ -0,0 +1,50 @@
+"""add_denormalized_conversation_stats
+
+Revision ID: e4d7e15af78e
+Revises: 60f4b6c0074b
+Create Date: 2026-10-19 10:41:27.905114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4d7e15af78e'
+down_revision = '60f4b6c0074b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 1. Add the stats columns
+    with op.batch_alter_table('conversation', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('message_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('last_message_preview', sa.String(length=200), nullable=True))
+        batch_op.add_column(sa.Column('last_role', sa.String(length=10), nullable=True))
+        batch_op.add_column(sa.Column('prompt_tokens_total', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('completion_tokens_total', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.create_index('ix_conversation_user_id_updated_at', ['user_id', 'updated_at'], unique=False)
+
+    # 2. Backfill from existing messages (token usage was never stored, so totals start at 0)
+    op.execute(
+        "UPDATE conversation SET message_count = "
+        "(SELECT COUNT(*) FROM message WHERE message.conversation_id = conversation.id)"
+    )
+    op.execute(
+        "UPDATE conversation SET "
+        "last_message_preview = (SELECT substr(m.content, 1, 200) FROM message m "
+        "WHERE m.conversation_id = conversation.id ORDER BY m.timestamp DESC, m.id DESC LIMIT 1), "
+        "last_role = (SELECT m.role FROM message m "
+        "WHERE m.conversation_id = conversation.id ORDER BY m.timestamp DESC, m.id DESC LIMIT 1)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('conversation', schema=None) as batch_op:
+        batch_op.drop_index('ix_conversation_user_id_updated_at')
+        batch_op.drop_column('completion_tokens_total')
+        batch_op.drop_column('prompt_tokens_total')
+        batch_op.drop_column('last_role')
+        batch_op.drop_column('last_message_preview')
+        batch_op.drop_column('message_count')
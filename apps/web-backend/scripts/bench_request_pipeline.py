@@ -0,0 +1,195 @@
+"""
+Microbenchmark of the dialogue request pipeline (app/dialogue/pipeline.py).
+
+Compares the per-request code the dialogue routes used to inline (separate user and
+conversation queries, dict-then-model validation through a Python validator) with the
+shared decorators (one joined ownership query, model_validate_json), in three steps:
+body validation alone, the user/conversation lookup alone, and a full request through
+the Flask test client on two otherwise identical routes.
+
+Firebase token verification is mocked out, so the numbers are the server's own overhead.
+Runs against an in-memory SQLite database with no external services:
+
+    python scripts/bench_request_pipeline.py [--iterations 2000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import warnings
+from typing import List, Optional, Literal
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# create_app() refuses to start without these; the benchmark never calls out
+_prompt_dir = tempfile.mkdtemp()
+for _persona in ('socrates', 'nietzsche', 'kant', 'schopenhauer', 'plato', 'smith', 'marx', 'camus'):
+    _path = os.path.join(_prompt_dir, f"{_persona}.txt")
+    with open(_path, 'w') as f:
+        f.write(f"You are {_persona}.")
+    os.environ.setdefault(f"{_persona.upper()}_PROMPT_FILE_PATH", _path)
+os.environ.setdefault('JWT_SECRET_KEY', 'bench')
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('OPENAI_API_KEY', 'sk-bench')
+os.environ.setdefault('MEMORY_ENABLED', 'false')
+os.environ.setdefault('PROFILING_ENABLED', 'false')
+os.environ['FLASK_ENV'] = 'testing'
+
+import firebase_admin.auth  # noqa: E402
+from flask import jsonify, request  # noqa: E402
+from pydantic import BaseModel, Field, constr, validator  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+from app import create_app  # noqa: E402
+from app.auth.utils import verify_token  # noqa: E402
+from app.dialogue.pipeline import authenticated, json_body, get_user_and_conversation  # noqa: E402
+from app.dialogue.routes import ConversationTitleUpdateSchema, DialogueRequestSchema  # noqa: E402
+from app.extensions import db, limiter  # noqa: E402
+from app.models import User, Conversation  # noqa: E402
+
+TOKEN = {'uid': 'bench-user', 'email': 'bench@example.com', 'email_verified': True}
+
+
+# --- The previous inline implementation, kept here as the baseline ---
+warnings.filterwarnings('ignore', message='Pydantic V1 style', category=DeprecationWarning)
+
+
+class LegacyMessageSchema(BaseModel):
+    role: Literal['user', 'assistant'] = Field(...)
+    content: constr(min_length=1, max_length=5000) = Field(...)
+
+
+class LegacyDialogueRequestSchema(BaseModel):
+    history: List[LegacyMessageSchema] = Field(...)
+    conversation_id: Optional[int] = Field(None)
+    persona_id: Optional[str] = Field(None)
+
+    @validator('history')
+    def validate_history(cls, v):
+        if not v:
+            raise ValueError("History cannot be empty")
+        if len(v) > 50:
+            raise ValueError("History too long (maximum 50 messages)")
+        return v
+
+
+def legacy_lookup(firebase_uid: str, conversation_id: int):
+    user = db.session.scalars(db.select(User).filter_by(firebase_uid=firebase_uid)).first()
+    if not user:
+        return None, None
+    return user, db.session.scalars(db.select(Conversation).filter_by(id=conversation_id, user_id=user.id)).first()
+
+
+def register_bench_routes(app):
+    @app.route('/bench/before/<int:conversation_id>', methods=['PATCH'])
+    def before(conversation_id: int):
+        decoded_token = verify_token()
+        if not decoded_token:
+            return jsonify({"error": "Authorization required: Invalid or missing token."}), 401
+        firebase_uid = decoded_token.get('uid')
+        if not firebase_uid:
+            return jsonify({"error": "Invalid token payload."}), 401
+        try:
+            raw_data = request.get_json()
+            if not raw_data:
+                return jsonify({"error": "Missing request body."}), 400
+            data = ConversationTitleUpdateSchema(**raw_data)
+        except Exception as e:
+            return jsonify({"error": f"Invalid title data: {str(e)}"}), 400
+        user, conversation = legacy_lookup(firebase_uid, conversation_id)
+        if not user or not conversation:
+            return jsonify({"error": "Conversation not found or access denied."}), 404
+        db.session.rollback()
+        return jsonify({"title": data.title})
+
+    @app.route('/bench/after/<int:conversation_id>', methods=['PATCH'])
+    @authenticated(verified_email=False, load_conversation=True)
+    @json_body(ConversationTitleUpdateSchema, error="Invalid title data")
+    def after(conversation_id: int, user, conversation, body):
+        if not user or not conversation:
+            return jsonify({"error": "Conversation not found or access denied."}), 404
+        db.session.rollback()
+        return jsonify({"title": body.title})
+
+
+def timed(func, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def compare(title: str, iterations: int, before, after, rounds: int = 5) -> None:
+    """Alternates rounds of both variants and keeps each one's best, so warm-up and drift favour neither."""
+    print(title)
+    for func in (before, after):  # Warm up caches and compiled paths
+        timed(func, min(200, iterations))
+    best = {"before": float('inf'), "after": float('inf')}
+    for _ in range(rounds):
+        best["before"] = min(best["before"], timed(before, iterations // rounds))
+        best["after"] = min(best["after"], timed(after, iterations // rounds))
+    for label, per_call_us in best.items():
+        print(f"  {label:<42} {per_call_us:9.1f} us")
+    saved = best["before"] - best["after"]
+    print(f"  {'saved per request':<42} {saved:9.1f} us ({saved / best['before'] * 100:.0f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    app = create_app()
+    limiter.enabled = False
+    register_bench_routes(app)
+    with app.app_context():
+        db.create_all()
+        user = User(firebase_uid=TOKEN['uid'], email=TOKEN['email'])
+        db.session.add(user)
+        db.session.flush()
+        conversation = Conversation(user_id=user.id, title="Benchmark", persona_id='socrates')
+        db.session.add(conversation)
+        db.session.commit()
+        conversation_id = conversation.id
+
+    statements = []
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', lambda *a, **kw: statements.append(1))
+
+    body = app.json.dumps({
+        "history": [{"role": "user" if i % 2 == 0 else "assistant", "content": "What is virtue? " * 20}
+                    for i in range(20)],
+        "conversation_id": conversation_id,
+    }).encode()
+    compare(f"Dialogue body validation (20 messages, {len(body)} bytes)", args.iterations,
+            lambda: LegacyDialogueRequestSchema(**app.json.loads(body)),
+            lambda: DialogueRequestSchema.model_validate_json(body))
+
+    with app.app_context():
+        for label, lookup in (("before", legacy_lookup), ("after", get_user_and_conversation)):
+            statements.clear()
+            lookup(TOKEN['uid'], conversation_id)
+            db.session.rollback()
+            print(f"User + conversation lookup, {label}: {len(statements)} queries")
+        compare("User + conversation lookup", args.iterations,
+                lambda: (legacy_lookup(TOKEN['uid'], conversation_id), db.session.rollback()),
+                lambda: (get_user_and_conversation(TOKEN['uid'], conversation_id), db.session.rollback()))
+
+    client = app.test_client()
+    headers = {'Authorization': 'Bearer bench'}
+    title = {"title": "A renamed conversation"}
+    with mock.patch.object(firebase_admin.auth, 'verify_id_token', return_value=TOKEN):
+        for label in ("before", "after"):
+            statements.clear()
+            response = client.patch(f'/bench/{label}/{conversation_id}', json=title, headers=headers)
+            assert response.status_code == 200, response.get_data(as_text=True)
+            print(f"Full request, {label}: {len(statements)} queries")
+        compare("Full request through the test client", args.iterations,
+                lambda: client.patch(f'/bench/before/{conversation_id}', json=title, headers=headers),
+                lambda: client.patch(f'/bench/after/{conversation_id}', json=title, headers=headers))
+
+
+if __name__ == '__main__':
+    main()
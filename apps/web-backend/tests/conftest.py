@@ -0,0 +1,57 @@
+import os
+import tempfile
+import types
+from unittest import mock
+
+import pytest
+
+# app.config reads these at import time, so they are set before the app is imported
+_scratch = tempfile.mkdtemp(prefix="cogito-tests-")
+PERSONA_IDS = ('socrates', 'nietzsche', 'kant', 'schopenhauer', 'plato', 'smith', 'marx', 'camus')
+for _persona_id in PERSONA_IDS:
+    _path = os.path.join(_scratch, f"{_persona_id}.txt")
+    with open(_path, "w") as _f:
+        _f.write(f"You are {_persona_id}.")
+    os.environ.setdefault(f"{_persona_id.upper()}_PROMPT_FILE_PATH", _path)
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_scratch, 'test.db')}")
+os.environ.setdefault("TRANSCRIPTION_UPLOAD_DIR", os.path.join(_scratch, "uploads"))
+
+from app import create_app  # noqa: E402
+from app.config import TestingConfig  # noqa: E402
+from app.extensions import db  # noqa: E402
+
+DECODED_TOKEN = {'uid': 'test-user', 'email': 'test@example.com', 'email_verified': True, 'name': 'Test User'}
+AUTH_HEADERS = {'Authorization': 'Bearer test-token'}
+
+
+class _Config(TestingConfig):
+    RATELIMIT_ENABLED = False
+    TITLE_GENERATION_ENABLED = False
+
+
+def _completion(content="An answer."):
+    usage = types.SimpleNamespace(prompt_tokens=10, completion_tokens=5, total_tokens=15, prompt_tokens_details=None)
+    message = types.SimpleNamespace(content=content)
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=usage, model='gpt-test')
+
+
+@pytest.fixture
+def app():
+    app = create_app(_Config)
+    app.openai_client = mock.MagicMock()
+    app.openai_client.chat.completions.create.side_effect = lambda **kwargs: _completion()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    with mock.patch('firebase_admin.auth.verify_id_token', return_value=DECODED_TOKEN):
+        yield app.test_client()
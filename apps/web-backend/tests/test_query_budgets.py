@@ -0,0 +1,96 @@
+"""
+Every budgeted route, called under TestingConfig's QUERY_BUDGET_STRICT: a request over its
+@query_budget raises QueryBudgetExceeded, so these fail as soon as a change adds queries.
+"""
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+from app.extensions import db
+from app.services.archive_service import archive_conversation
+from app.services.query_stats_service import QueryBudgetExceeded
+from conftest import AUTH_HEADERS, PERSONA_IDS
+
+
+def _start_conversation(client, content="What is virtue?"):
+    response = client.post('/api/dialogue', json={'history': [{'role': 'user', 'content': content}]},
+                           headers=AUTH_HEADERS)
+    assert response.status_code == 200, response.json
+    return response.json['conversation_id']
+
+
+def _continue(client, conversation_id, content="Go on."):
+    return client.post('/api/dialogue', headers=AUTH_HEADERS,
+                       json={'history': [{'role': 'user', 'content': content}], 'conversation_id': conversation_id})
+
+
+def test_dialogue(client):
+    conversation_id = _start_conversation(client)
+    response = _continue(client, conversation_id)
+    assert response.status_code == 200
+
+
+def test_dialogue_restores_archived_conversation(app, client):
+    conversation_id = _start_conversation(client)
+    with app.app_context():
+        assert archive_conversation(conversation_id, datetime.now(timezone.utc) + timedelta(days=1))
+        db.session.commit()
+    response = _continue(client, conversation_id)
+    assert response.status_code == 200
+
+
+def test_panel_with_every_persona(client):
+    response = client.post('/api/dialogue/panel', json={'message': 'What is justice?', 'persona_ids': list(PERSONA_IDS)},
+                           headers=AUTH_HEADERS)
+    assert response.status_code == 200
+    assert len(response.json['answers']) == len(PERSONA_IDS)
+
+
+@pytest.mark.parametrize('path', ['/api/history', '/api/history/search?q=virtue', '/api/sync?since=0',
+                                  '/api/history/export'])
+def test_reads_do_not_grow_with_conversations(client, path):
+    # The N+1 guard: one conversation or many, a listing issues the same statements
+    _start_conversation(client)
+    single = client.get(path, headers=AUTH_HEADERS)
+    assert single.status_code == 200
+    single.get_data()  # Runs a streamed body to the end
+    for _ in range(5):
+        _start_conversation(client)
+    several = client.get(path, headers=AUTH_HEADERS)
+    assert several.status_code == 200
+    several.get_data()
+    assert several.headers['X-DB-Queries'] == single.headers['X-DB-Queries']
+
+
+def test_conversation_detail(client):
+    conversation_id = _start_conversation(client)
+    _continue(client, conversation_id)
+    response = client.get(f'/api/history/{conversation_id}', headers=AUTH_HEADERS)
+    assert response.status_code == 200
+    assert len(response.json['messages']) == 4
+
+
+def test_rename_conversation(client):
+    conversation_id = _start_conversation(client)
+    response = client.patch(f'/api/history/{conversation_id}', json={'title': 'On virtue'}, headers=AUTH_HEADERS)
+    assert response.status_code == 200
+
+
+def test_delete_conversation(client):
+    conversation_id = _start_conversation(client)
+    response = client.delete(f'/api/history/{conversation_id}', headers=AUTH_HEADERS)
+    assert response.status_code == 200
+
+
+def test_delete_all_conversations(client):
+    for _ in range(5):
+        _start_conversation(client)
+    response = client.delete('/api/history', headers=AUTH_HEADERS)
+    assert response.status_code == 200
+
+
+def test_strict_mode_fails_a_request_over_budget(app, client):
+    _start_conversation(client)
+    app.config['QUERY_BUDGETS'] = {'dialogue.get_history_list': 1}
+    with pytest.raises(QueryBudgetExceeded):
+        client.get('/api/history', headers=AUTH_HEADERS)